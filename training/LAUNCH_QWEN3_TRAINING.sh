@@ -13,6 +13,7 @@ DATASET_PATH="${1:-}"  # Pass dataset path as first argument
 MODEL_BASE_PATH="/Users/polyversai/.lmstudio/models"
 MODEL_NAME="Qwen3-30B-A3B-Thinking-2507"
 TRAINING_DIR="/Users/polyversai/training_runs/qwen3_thinking_$(date +%Y%m%d_%H%M%S)"
+MAX_INVALID="${MAX_INVALID:-0.01}"  # Fail when more than this fraction of entries is invalid
 
 # Colors for output
 RED='\033[0;31m'
@@ -32,14 +33,18 @@ if [ -z "$DATASET_PATH" ]; then
     exit 1
 fi
 
-# Step 2: Validate dataset
-echo -e "\n${GREEN}✓ Step 1: Validating dataset...${NC}"
-python3 /Users/polyversai/Codebase/Klaudiusz/libraxis-ai/training/validate_dataset.py "$DATASET_PATH"
+# Step 2: Validate and prepare the dataset in a single pass
+echo -e "\n${GREEN}✓ Step 1: Validating and preparing dataset...${NC}"
+mkdir -p "$TRAINING_DIR"
+# Prepares straight into the run directory; an unchanged dataset is linked
+# from the preparation cache instead of being split and copied again
+python3 /Users/polyversai/Codebase/Klaudiusz/libraxis-ai/training/qwen3-thinking-prepare.py "$DATASET_PATH" --validate --max-invalid "$MAX_INVALID" --output-dir "$TRAINING_DIR"
 
 if [ $? -ne 0 ]; then
     echo -e "${RED}❌ Dataset validation failed!${NC}"
     exit 1
 fi
+echo -e "${GREEN}✅ Training data prepared in: $TRAINING_DIR${NC}"
 
 # Step 3: Check if model is ready
 echo -e "\n${GREEN}✓ Step 2: Checking for Qwen3 model...${NC}"
@@ -58,25 +63,13 @@ else
     echo -e "${GREEN}✅ Model found at: $MODEL_PATH${NC}"
 fi
 
-# Step 4: Prepare training data
-echo -e "\n${GREEN}✓ Step 3: Preparing training data...${NC}"
-mkdir -p "$TRAINING_DIR"
-python3 /Users/polyversai/Codebase/Klaudiusz/libraxis-ai/training/qwen3-thinking-prepare.py "$DATASET_PATH"
-
-# Move prepared data to training directory
-if [ -d "/Users/polyversai/training_runs/qwen3_thinking_"* ]; then
-    latest_prep=$(ls -td /Users/polyversai/training_runs/qwen3_thinking_* | head -1)
-    cp -r "$latest_prep"/* "$TRAINING_DIR/"
-    echo -e "${GREEN}✅ Training data prepared in: $TRAINING_DIR${NC}"
-fi
-
-# Step 5: Monitor system resources
-echo -e "\n${GREEN}✓ Step 4: Checking system resources...${NC}"
+# Step 4: Monitor system resources
+echo -e "\n${GREEN}✓ Step 3: Checking system resources...${NC}"
 echo "Current memory usage:"
-top -l 1 | grep -E "PhysMem|CPU usage" | head -2
+python3 /Users/polyversai/Codebase/Klaudiusz/libraxis-ai/training/telemetry.py --once
 
-# Step 6: Launch training
-echo -e "\n${GREEN}✓ Step 5: Ready to launch training!${NC}"
+# Step 5: Launch training
+echo -e "\n${GREEN}✓ Step 4: Ready to launch training!${NC}"
 echo "================================================"
 echo "Training configuration:"
 echo "  Model: $MODEL_PATH"
@@ -87,10 +80,13 @@ echo "  LoRA rank: 64"
 echo "  Checkpoints every: 250 steps"
 echo "================================================"
 
-# Create final launch command
+# Create final launch command; the model path is read from training.env
+# next to it, so the script itself needs no editing (and no BSD-only sed -i '')
+echo "MODEL_PATH=\"$MODEL_PATH\"" > "$TRAINING_DIR/training.env"
 cat > "$TRAINING_DIR/START_TRAINING.sh" << 'EOF'
 #!/bin/bash
 # AUTO-GENERATED TRAINING SCRIPT
+source "$(dirname "$0")/training.env"
 
 echo "🚀 LAUNCHING QWEN3-30B THINKING MODEL TRAINING!"
 echo "Perfect for your flight duration!"
@@ -100,17 +96,15 @@ echo ""
 export PYTHONUNBUFFERED=1
 export MLX_METAL_MEMORY_LIMIT=48GB
 
-# Monitor in background
-(while true; do 
-    echo -e "\n📊 [$(date +%H:%M:%S)] Memory check:"
-    top -l 1 | grep -E "PhysMem|python" | head -5
-    sleep 300  # Check every 5 minutes
-done) &
+# Record RSS/CPU/memory of this script and the trainer under it every 30s
+# (adapters/telemetry.jsonl), printing a line every sample
+python3 /Users/polyversai/Codebase/Klaudiusz/libraxis-ai/training/telemetry.py \
+    --pid $$ --interval 30 --output ./adapters/telemetry.jsonl &
 MONITOR_PID=$!
 
 # Run training
 python3 -m mlx_lm.lora \
-    --model "MODEL_PATH_PLACEHOLDER" \
+    --model "$MODEL_PATH" \
     --data . \
     --train \
     --batch-size 1 \
@@ -126,17 +120,26 @@ python3 -m mlx_lm.lora \
 # Stop monitor
 kill $MONITOR_PID 2>/dev/null
 
+# Held-out generations: base model vs adapter, answer quality and inference cost
+python3 /Users/polyversai/Codebase/Klaudiusz/libraxis-ai/training/eval_adapters.py \
+    --model-path "$MODEL_PATH" \
+    --data-path . \
+    --adapter-path ./adapters \
+    --include-base \
+    --max-tokens 1024 \
+    2>&1 | tee eval_log.txt
+
 echo ""
 echo "✅ Training completed!"
 echo "📁 Adapter saved in: ./adapters"
 echo "📊 Log saved in: training_log.txt"
+echo "📈 Resource telemetry in: ./adapters/telemetry.jsonl"
+echo "🧪 Eval report in: ./adapters/eval_report.json"
 
 # Send notification
 osascript -e 'display notification "Qwen3-30B training completed!" with title "MLX Training" sound name "Hero"'
 EOF
 
-# Replace placeholder with actual model path
-sed -i '' "s|MODEL_PATH_PLACEHOLDER|$MODEL_PATH|g" "$TRAINING_DIR/START_TRAINING.sh"
 chmod +x "$TRAINING_DIR/START_TRAINING.sh"
 
 echo -e "\n${GREEN}🎉 EVERYTHING IS READY!${NC}"
@@ -149,6 +152,10 @@ echo ""
 echo -e "${YELLOW}To monitor progress:${NC}"
 echo "  tail -f $TRAINING_DIR/training_log.txt"
 echo ""
+echo -e "${YELLOW}To compare several configurations in parallel instead:${NC}"
+echo "  python3 /Users/polyversai/Codebase/Klaudiusz/libraxis-ai/training/train_sweep.py --model-path \"$MODEL_PATH\" \\"
+echo "      --data-path $TRAINING_DIR --output-dir $TRAINING_DIR/sweep --grid lora-rank=16,64 learning-rate=1e-5,2e-5"
+echo ""
 echo -e "${GREEN}✈️  Perfect setup for your flight! Miłego lotu!${NC}"
 echo "================================================"
 
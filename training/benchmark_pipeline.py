@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite for the Dataset Pipeline
+Generates seeded synthetic conversation corpora and measures every
+preparation stage (throughput, peak RSS, wall time) as comparable JSON
+"""
+
+import argparse
+import contextlib
+import hashlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+import jsonl_codec as codec
+from validate_dataset import DatasetValidator
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+STAGES = ["validate", "validate_parallel", "shuffle_and_split", "save_split_datasets",
+          "stream_split", "hash_split", "checksum"]
+SIZE_SUFFIXES = {"k": 1000, "m": 1000 ** 2}
+# ru_maxrss is in bytes on macOS and in kilobytes on Linux
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+ENGLISH_WORDS = ("the model should reason step by step before it answers a question about "
+                 "training data tokens memory latency throughput sequence batch").split()
+POLISH_WORDS = ("zażółć gęślą jaźń myślę więc jestem dzień dobry proszę dziękuję pytanie "
+                "odpowiedź łódź źródło wiedzy każdy krok rozumowania").split()
+MALFORMED_KINDS = ("truncated_json", "missing_messages", "missing_content", "unclosed_think")
+
+def parse_size(value: str) -> int:
+    """'10k' -> 10000, '1m' -> 1000000, plain integers pass through."""
+    value = value.strip().lower()
+    if value[-1:] in SIZE_SUFFIXES:
+        return int(float(value[:-1]) * SIZE_SUFFIXES[value[-1]])
+    return int(value)
+
+def random_text(rng: random.Random, length: int, polish_ratio: float) -> str:
+    """About `length` characters of words, each Polish with probability `polish_ratio`."""
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(POLISH_WORDS if rng.random() < polish_ratio else ENGLISH_WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+def synthetic_entry(rng: random.Random, params: Dict) -> bytes:
+    """One JSONL line (with newline); malformed with probability `malformed_ratio`."""
+    def length():
+        return rng.randint(params["min_chars"], params["max_chars"])
+    
+    polish = params["polish_ratio"]
+    messages = []
+    for _ in range(params["turns"]):
+        messages.append({"role": "user", "content": random_text(rng, length(), polish)})
+        answer = random_text(rng, length(), polish)
+        if rng.random() < params["think_ratio"]:
+            answer = f"<think>{random_text(rng, length(), polish)}</think>\n{answer}"
+        messages.append({"role": "assistant", "content": answer})
+    entry = {"messages": messages}
+    
+    if rng.random() < params["malformed_ratio"]:
+        kind = rng.choice(MALFORMED_KINDS)
+        if kind == "truncated_json":
+            line = codec.dumps(entry)
+            return line[:rng.randint(1, len(line) - 1)] + b'\n'
+        if kind == "missing_messages":
+            entry = {"conversation": messages}
+        elif kind == "missing_content":
+            del messages[-1]["content"]
+        else:
+            messages[-1]["content"] = "<think>" + messages[-1]["content"].replace("</think>", "")
+    return codec.dumps(entry) + b'\n'
+
+def generate_corpus(path: Path, lines: int, params: Dict) -> Path:
+    """Write a seeded synthetic corpus; the same params always give the same bytes."""
+    rng = random.Random(params["seed"])
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        for line_num in range(1, lines + 1):
+            f.write(synthetic_entry(rng, params))
+            if line_num % 1000000 == 0:
+                print(f"  Generated {line_num} lines...")
+    os.replace(tmp_path, path)
+    return path
+
+def corpus_path(work_dir: Path, lines: int, params: Dict) -> Path:
+    """Corpus file named after its parameters, so reruns reuse it."""
+    key = hashlib.sha256(json.dumps({"lines": lines, **params}, sort_keys=True).encode()).hexdigest()[:12]
+    return work_dir / f"synthetic_{lines}_{key}.jsonl"
+
+def load_prepare_module():
+    """Import qwen3-thinking-prepare.py (its name isn't a valid module name)."""
+    spec = importlib.util.spec_from_file_location("qwen3_thinking_prepare", SCRIPT_DIR / "qwen3-thinking-prepare.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def peak_rss_mb() -> float:
+    """Peak RSS of this process or any of its finished children, in MB."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) * RSS_UNIT / 1e6
+
+def _run_stage(stage: str, dataset_path: str, out_dir: str, workers: int, seed: int) -> Dict:
+    """Process pool entry point: run one stage in a fresh process and time it.
+    
+    A fresh process per stage keeps peak RSS attributable to that stage.
+    Stage output is discarded; only the timed section counts toward wall time.
+    """
+    prepare = load_prepare_module()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if stage == "save_split_datasets":
+            # Loading isn't part of this stage, only writing the splits is
+            train_data, val_data, _ = prepare.shuffle_and_split_dataset(dataset_path, seed)
+        start = time.perf_counter()
+        if stage == "validate":
+            DatasetValidator(dataset_path).validate_dataset(workers=1)
+        elif stage == "validate_parallel":
+            DatasetValidator(dataset_path).validate_dataset(workers=workers)
+        elif stage == "shuffle_and_split":
+            prepare.shuffle_and_split_dataset(dataset_path, seed)
+        elif stage == "save_split_datasets":
+            prepare.save_split_datasets(train_data, val_data, out_dir)
+        elif stage == "stream_split":
+            prepare.stream_shuffle_and_split(dataset_path, out_dir, seed)
+        elif stage == "hash_split":
+            prepare.hash_split_dataset(dataset_path, out_dir, seed)
+        elif stage == "checksum":
+            prepare.calculate_checksum(Path(dataset_path))
+        else:
+            raise ValueError(f"Unknown stage {stage!r}")
+        wall = time.perf_counter() - start
+    return {"wall_s": wall, "peak_rss_mb": peak_rss_mb()}
+
+def run_stage(stage: str, dataset_path: Path, work_dir: Path, workers: int, seed: int,
+              lines: int) -> Dict:
+    """Run a stage in its own spawned process and add throughput numbers."""
+    out_dir = Path(tempfile.mkdtemp(prefix=f"{stage}_", dir=work_dir))
+    try:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            result = pool.submit(_run_stage, stage, str(dataset_path), str(out_dir), workers, seed).result()
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    size_mb = dataset_path.stat().st_size / 1e6
+    result["lines_per_s"] = lines / result["wall_s"] if result["wall_s"] else 0.0
+    result["mb_per_s"] = size_mb / result["wall_s"] if result["wall_s"] else 0.0
+    return result
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_comparison(results: Dict, baseline: Dict):
+    """Speedup of every stage against a previous results file."""
+    print("\n📊 Against baseline " + str(baseline.get("commit")))
+    for size, stages in results["results"].items():
+        for stage, result in stages.items():
+            before = baseline.get("results", {}).get(size, {}).get(stage)
+            if not before:
+                continue
+            speedup = before["wall_s"] / result["wall_s"] if result["wall_s"] else 0.0
+            print(f"  {size:>10} {stage:20s} {speedup:5.2f}x wall, "
+                  f"RSS {before['peak_rss_mb']:.0f} -> {result['peak_rss_mb']:.0f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dataset pipeline on synthetic corpora")
+    parser.add_argument("--sizes", nargs="+", default=["10k"],
+                        help="Corpus sizes in lines, e.g. 10k 1m 10m")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES,
+                        help="Stages to run")
+    parser.add_argument("--think-ratio", type=float, default=0.9,
+                        help="Share of assistant messages with a <think> block")
+    parser.add_argument("--polish-ratio", type=float, default=0.3,
+                        help="Share of Polish words in the generated text")
+    parser.add_argument("--min-chars", type=int, default=50,
+                        help="Shortest generated message")
+    parser.add_argument("--max-chars", type=int, default=400,
+                        help="Longest generated message")
+    parser.add_argument("--turns", type=int, default=1,
+                        help="User/assistant turns per conversation")
+    parser.add_argument("--malformed-ratio", type=float, default=0.01,
+                        help="Share of malformed lines (bad JSON, missing fields, unclosed <think>)")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Seed for the corpus and the splits")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes for the validate_parallel stage")
+    parser.add_argument("--work-dir", type=str, default=None,
+                        help="Where corpora are generated and kept (default: a temp dir)")
+    parser.add_argument("--output", type=str, default="benchmark_results.json",
+                        help="Results JSON file")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Previous results JSON to compare against")
+    args = parser.parse_args()
+    
+    params = {
+        "think_ratio": args.think_ratio,
+        "polish_ratio": args.polish_ratio,
+        "min_chars": args.min_chars,
+        "max_chars": args.max_chars,
+        "turns": args.turns,
+        "malformed_ratio": args.malformed_ratio,
+        "seed": args.seed,
+    }
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="pipeline_bench_"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    
+    print("⏱️  Dataset Pipeline Benchmark")
+    print("=" * 60)
+    print(f"📁 Work directory: {work_dir}")
+    
+    results = {
+        "commit": git_commit(),
+        "created": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "json_backend": codec.BACKEND,
+        "workers": args.workers,
+        "params": params,
+        "results": {},
+    }
+    for size in args.sizes:
+        lines = parse_size(size)
+        path = corpus_path(work_dir, lines, params)
+        if not path.exists():
+            print(f"\n🔄 Generating {lines} synthetic lines...")
+            generate_corpus(path, lines, params)
+        print(f"\n📊 {lines} lines ({path.stat().st_size / 1e6:.1f} MB)")
+        
+        stage_results = {}
+        for stage in args.stages:
+            result = run_stage(stage, path, work_dir, args.workers, args.seed, lines)
+            stage_results[stage] = result
+            print(f"  {stage:20s} {result['wall_s']:8.2f}s  {result['lines_per_s']:>10.0f} lines/s  "
+                  f"{result['mb_per_s']:7.1f} MB/s  peak RSS {result['peak_rss_mb']:.0f} MB")
+        results["results"][str(lines)] = stage_results
+    
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\n💾 Saved results to: {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            print_comparison(results, json.load(f))
+    
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Dataset File Formats for the Training Scripts
+Streams gzip/zstd compressed JSONL transparently and memory-maps prepared
+splits (offsets index or Arrow IPC) for O(1) random access
+"""
+
+import argparse
+import gzip
+import io
+import mmap
+import os
+import sys
+from array import array
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+import jsonl_codec as codec
+
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+# Moderate levels: splits are rewritten often, ratio matters less than speed
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+READ_BUFFER_SIZE = 1 << 20
+INDEX_SUFFIX = ".idx"
+ARROW_SUFFIX = ".arrow"
+ARROW_BATCH_ROWS = 8192
+COLUMNAR_FORMATS = ["offsets", "arrow"]
+
+PathLike = Union[str, Path]
+
+def compression(path: PathLike) -> Optional[str]:
+    """'gzip' or 'zstd' when the file name says it's compressed, else None."""
+    return COMPRESSION_SUFFIXES.get(Path(path).suffix.lower())
+
+def is_compressed(path: PathLike) -> bool:
+    return compression(path) is not None
+
+def open_dataset(path: PathLike, mode: str = 'rb'):
+    """Open a JSONL file in binary mode ('rb', 'wb' or 'ab'), compressed by suffix.
+    
+    Compressed files are plain streams: iterating yields raw lines, seeking
+    only works forward (see `seek_forward`) and appending
+    adds a new gzip member or zstd frame, which readers go straight through.
+    """
+    kind = compression(path)
+    if kind == "gzip":
+        return gzip.open(path, mode, compresslevel=GZIP_LEVEL)
+    if kind == "zstd":
+        if zstandard is None:
+            raise ImportError(f"{path} is zstd-compressed, install the zstandard package (pip install zstandard)")
+        raw = open(path, mode)
+        if 'r' in mode:
+            reader = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+            return io.BufferedReader(reader, buffer_size=READ_BUFFER_SIZE)
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw, closefd=True)
+    return open(path, mode)
+
+def seek_forward(f, offset: int):
+    """Move a stream from `open_dataset` to byte `offset` of its (decompressed) data.
+    
+    zstd readers can't seek at all, so from the start they read and drop bytes.
+    """
+    if f.seekable():
+        f.seek(offset)
+        return
+    remaining = offset - f.tell()
+    while remaining > 0:
+        skipped = len(f.read(min(remaining, READ_BUFFER_SIZE)))
+        if not skipped:
+            break
+        remaining -= skipped
+
+def index_path(path: PathLike) -> Path:
+    """Offsets sidecar of a JSONL file: `<name>.idx`."""
+    return Path(str(path) + INDEX_SUFFIX)
+
+def arrow_path(path: PathLike) -> Path:
+    """Arrow copy of a JSONL file: `train.jsonl.gz` -> `train.arrow`."""
+    path = Path(path)
+    stem = path.name.split(".")[0]
+    return path.with_name(stem + ARROW_SUFFIX)
+
+def write_offsets_index(path: PathLike) -> Path:
+    """Write `<path>.idx`: the little-endian uint64 start offset of every line plus the file size.
+    
+    Line i spans bytes [idx[i], idx[i+1]) of the JSONL file, which stays the
+    only copy of the data. Needs an uncompressed file, offsets into a
+    compressed stream can't be memory-mapped.
+    """
+    if is_compressed(path):
+        raise ValueError(f"{path} is compressed, an offsets index needs plain JSONL (use the arrow format)")
+    offsets = array('Q')
+    pos = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            offsets.append(pos)
+            pos += len(line)
+    offsets.append(pos)
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    
+    out_path = index_path(path)
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        offsets.tofile(f)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+def write_arrow(path: PathLike, out_path: Optional[Path] = None) -> Path:
+    """Copy the lines of a (possibly compressed) JSONL file into an Arrow IPC file.
+    
+    One `json` column holds each line's raw bytes, so nothing is parsed up
+    front and the file can be memory-mapped for random access.
+    """
+    if pyarrow is None:
+        raise ImportError("The arrow format needs the pyarrow package (pip install pyarrow)")
+    out_path = Path(out_path) if out_path else arrow_path(path)
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+    schema = pyarrow.schema([("json", pyarrow.large_binary())])
+    
+    with open_dataset(path) as src, pyarrow.OSFile(str(tmp_path), 'wb') as sink:
+        with pyarrow.ipc.new_file(sink, schema) as writer:
+            batch = []
+            for line in src:
+                batch.append(line.rstrip(b'\n'))
+                if len(batch) >= ARROW_BATCH_ROWS:
+                    writer.write_batch(pyarrow.record_batch([pyarrow.array(batch, pyarrow.large_binary())], schema=schema))
+                    batch = []
+            if batch:
+                writer.write_batch(pyarrow.record_batch([pyarrow.array(batch, pyarrow.large_binary())], schema=schema))
+    os.replace(tmp_path, out_path)
+    return out_path
+
+def write_columnar(path: PathLike, fmt: str) -> Path:
+    """Write the random-access sidecar of a split in format 'offsets' or 'arrow'."""
+    if fmt == "offsets":
+        return write_offsets_index(path)
+    if fmt == "arrow":
+        return write_arrow(path)
+    raise ValueError(f"Unknown columnar format {fmt!r} (have: {', '.join(COLUMNAR_FORMATS)})")
+
+class IndexedDataset:
+    """O(1) access to entry i of an indexed JSONL split or its Arrow copy.
+    
+    Everything is memory-mapped: opening reads no data and only the entries
+    that are accessed get paged in and parsed.
+    """
+    
+    def __init__(self, path: PathLike):
+        self.path = Path(path)
+        self._file = self._data = self._offsets = None
+        self._column = None
+        
+        if self.path.suffix == ARROW_SUFFIX:
+            if pyarrow is None:
+                raise ImportError("Reading Arrow splits needs the pyarrow package (pip install pyarrow)")
+            self._source = pyarrow.memory_map(str(self.path))
+            self._column = pyarrow.ipc.open_file(self._source).read_all().column("json")
+            self._length = len(self._column)
+            return
+        
+        offsets_path = index_path(self.path)
+        if not offsets_path.exists():
+            raise FileNotFoundError(f"{offsets_path} not found, write it with: python dataset_io.py {self.path} --format offsets")
+        self._offsets_file = open(offsets_path, 'rb')
+        self._offsets = memoryview(mmap.mmap(self._offsets_file.fileno(), 0, access=mmap.ACCESS_READ)).cast('Q')
+        self._length = len(self._offsets) - 1
+        self._file = open(self.path, 'rb')
+        # mmap refuses empty files, and an empty split has nothing to map
+        size = os.fstat(self._file.fileno()).st_size
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        if self._offsets[-1] != size:
+            self.close()
+            raise ValueError(f"{offsets_path} doesn't match {self.path}, rebuild the index")
+    
+    def __len__(self) -> int:
+        return self._length
+    
+    def raw(self, i: int) -> bytes:
+        """Raw JSON bytes of entry `i`, without the newline."""
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError(f"entry {i} out of range for {self._length} entries")
+        if self._column is not None:
+            return self._column[i].as_py()
+        return self._data[self._offsets[i]:self._offsets[i + 1]].rstrip(b'\n')
+    
+    def __getitem__(self, i: int) -> Dict:
+        return codec.loads(self.raw(i))
+    
+    def close(self):
+        if self._column is not None:
+            self._column = None
+            self._source.close()
+            return
+        if self._offsets is not None:
+            mapped = self._offsets.obj
+            self._offsets.release()
+            mapped.close()
+            self._offsets_file.close()
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        if self._file:
+            self._file.close()
+    
+    def __enter__(self) -> "IndexedDataset":
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or read random-access sidecars of a JSONL split")
+    parser.add_argument("dataset_path", help="JSONL file (.gz/.zst for the arrow format), or a .arrow file with --show")
+    parser.add_argument("--format", choices=COLUMNAR_FORMATS, default="offsets",
+                        help="offsets: <file>.idx next to plain JSONL; arrow: an Arrow IPC copy")
+    parser.add_argument("--show", type=int, nargs="+", default=None,
+                        help="Print these entries (0-based) instead of building a sidecar")
+    args = parser.parse_args()
+    
+    if not Path(args.dataset_path).exists():
+        print(f"❌ Dataset file not found: {args.dataset_path}")
+        sys.exit(1)
+    
+    try:
+        if args.show is not None:
+            with IndexedDataset(args.dataset_path) as dataset:
+                for i in args.show:
+                    print(dataset.raw(i).decode('utf-8'))
+            return
+        out_path = write_columnar(args.dataset_path, args.format)
+    except (ValueError, ImportError, FileNotFoundError, IndexError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"💾 Saved {args.format} sidecar to: {out_path}")
+
+if __name__ == "__main__":
+    main()
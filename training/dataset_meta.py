@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Per-Entry Metadata Index for Prepared Splits
+One fixed-size record per line (offset, size, chars, tokens, roles, <think>,
+language, source, content hash, dedup cluster) so sampling, selection and
+slicing never re-read the JSONL
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import dataset_io
+import instrumentation
+import jsonl_codec as codec
+from dedup_dataset import normalize_messages
+from tokenize_dataset import file_signature, matches_signature
+from validate_dataset import chunk_boundaries, scan_think_blocks
+
+SPLITS = ("train", "valid")
+META_SUFFIX = ".meta.npy"
+META_INFO_SUFFIX = ".meta.json"
+META_DTYPE = np.dtype([
+    ("offset", "<u8"),       # byte offset of the line in the split
+    ("size", "<u4"),         # line length in bytes, newline included
+    ("chars", "<u4"),        # characters over all message contents
+    ("tokens", "<u4"),       # from <split>.tokens.npy, 0 when not tokenized
+    ("turns", "<u2"),        # number of messages
+    ("roles", "u1"),         # ROLE_BITS of the roles present
+    ("has_think", "u1"),
+    ("think_chars", "<u4"),  # characters inside the think blocks of assistant turns (see scan_think_blocks)
+    ("language", "<u2"),     # index into the info file's "languages"
+    ("source", "<u2"),       # index into the info file's "sources"
+    ("hash", "<u8"),         # dedup_dataset.py's exact-duplicate hash of the normalized messages
+    ("cluster", "<i8"),      # dedup cluster id from <split>.clusters.npy, else the line itself
+    ("parsed", "u1"),        # 0 for lines that aren't a JSON object with a messages list
+])
+ROLE_BITS = {"system": 1, "user": 2, "assistant": 4, "tool": 8}
+OTHER_ROLE = 16
+UNKNOWN_SOURCE = "unknown"
+_POLISH_CHAR = re.compile('[ąćęłńóśźżĄĆĘŁŃÓŚŹŻ]')
+
+def split_stem(path: Path) -> str:
+    return Path(path).name.split(".")[0]
+
+def meta_path(split_path: Path) -> Path:
+    """`train.jsonl` -> `train.meta.npy`."""
+    return Path(split_path).with_name(split_stem(split_path) + META_SUFFIX)
+
+def meta_info_path(split_path: Path) -> Path:
+    return Path(split_path).with_name(split_stem(split_path) + META_INFO_SUFFIX)
+
+def content_hash(data: bytes) -> int:
+    """8-byte BLAKE2b as an integer, the same value dedup_dataset.py compares."""
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+def entry_source(entry: Dict) -> str:
+    """Where an entry came from: a top-level or metadata `source` field."""
+    source = entry.get("source")
+    if source is None and isinstance(entry.get("metadata"), dict):
+        source = entry["metadata"].get("source")
+    return str(source) if source is not None else UNKNOWN_SOURCE
+
+def entry_language(entry: Dict, text: str) -> str:
+    """An explicit `language`/`lang` field, else the validator's Polish-character check."""
+    language = entry.get("language") or entry.get("lang")
+    if language:
+        return str(language).lower()
+    return "polish" if _POLISH_CHAR.search(text) else "other"
+
+def _meta_chunk(path: str, start: int, end: int) -> Tuple[np.ndarray, List[str], List[str]]:
+    """Metadata records of the lines in [start, end) plus their language and source names."""
+    records = []
+    languages = []
+    sources = []
+    with open(path, 'rb') as f:
+        f.seek(start)
+        pos = start
+        for raw in f:
+            if pos >= end:
+                break
+            record = {"offset": pos, "size": len(raw), "cluster": -1}
+            pos += len(raw)
+            language = source = UNKNOWN_SOURCE
+            try:
+                entry = codec.loads(raw)
+            except codec.DecodeError:
+                entry = None
+            if isinstance(entry, dict) and isinstance(entry.get("messages"), list):
+                parts = []
+                roles = 0
+                think_chars = 0
+                for msg in entry["messages"]:
+                    if not isinstance(msg, dict):
+                        continue
+                    roles |= ROLE_BITS.get(msg.get("role"), OTHER_ROLE)
+                    if not isinstance(msg.get("content"), str):
+                        continue
+                    parts.append(msg["content"])
+                    if msg.get("role") == "assistant":
+                        think_lengths, _ = scan_think_blocks(msg["content"])
+                        if think_lengths:
+                            record["has_think"] = 1
+                            think_chars += sum(think_lengths)
+                text = "".join(parts)
+                record.update(chars=len(text), turns=len(entry["messages"]), roles=roles,
+                              think_chars=think_chars, parsed=1,
+                              hash=content_hash(normalize_messages(entry).encode('utf-8')))
+                language = entry_language(entry, text)
+                source = entry_source(entry)
+            else:
+                record["hash"] = content_hash(raw.strip())
+            records.append(tuple(record.get(name, 0) for name in META_DTYPE.names))
+            languages.append(language)
+            sources.append(source)
+    return np.array(records, dtype=META_DTYPE), languages, sources
+
+def build_metadata(split_path: Path, workers: int = 1) -> Tuple[np.ndarray, Dict]:
+    """Scan a split once (in parallel chunks) and return its metadata table and name tables."""
+    split_path = Path(split_path)
+    if dataset_io.is_compressed(split_path):
+        raise ValueError(f"{split_path.name} is compressed; byte offsets need a plain JSONL file")
+    boundaries = chunk_boundaries(split_path, max(workers, 1) * 4)
+    starts = boundaries[:-1]
+    ends = boundaries[1:]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunks = list(pool.map(_meta_chunk, [str(split_path)] * len(starts), starts, ends))
+    else:
+        chunks = [_meta_chunk(str(split_path), start, end) for start, end in zip(starts, ends)]
+    
+    meta = np.concatenate([c[0] for c in chunks]) if chunks else np.zeros(0, dtype=META_DTYPE)
+    languages = [name for c in chunks for name in c[1]]
+    sources = [name for c in chunks for name in c[2]]
+    # Most common first, so ids are stable for a given split
+    language_names = [name for name, _ in Counter(languages).most_common()]
+    source_names = [name for name, _ in Counter(sources).most_common()]
+    language_ids = {name: i for i, name in enumerate(language_names)}
+    source_ids = {name: i for i, name in enumerate(source_names)}
+    meta["language"] = [language_ids[name] for name in languages]
+    meta["source"] = [source_ids[name] for name in sources]
+    meta["cluster"] = np.arange(len(meta))
+    
+    stem = split_stem(split_path)
+    tokens_path = split_path.with_name(f"{stem}.tokens.npy")
+    if tokens_path.exists():
+        tokens = np.load(tokens_path)
+        if len(tokens) == len(meta):
+            meta["tokens"] = tokens
+    clusters_path = split_path.with_name(f"{stem}.clusters.npy")
+    if clusters_path.exists():
+        clusters = np.load(clusters_path)
+        if len(clusters) == len(meta):
+            meta["cluster"] = clusters
+    
+    info = {
+        "split": split_path.name,
+        **file_signature(split_path),
+        "entries": int(len(meta)),
+        "languages": language_names,
+        "sources": source_names,
+        "roles": list(ROLE_BITS) + ["other"],
+        "tokens": bool(meta["tokens"].any()),
+        "clusters": clusters_path.exists() and len(np.unique(meta["cluster"])) < len(meta),
+    }
+    return meta, info
+
+def save_metadata(split_path: Path, meta: np.ndarray, info: Dict) -> Path:
+    path = meta_path(split_path)
+    info_path = meta_info_path(split_path)
+    # Replace rather than truncate, the index may be hardlinked into the prep cache
+    with open(path.with_name(path.name + ".tmp"), 'wb') as f:
+        np.save(f, meta)
+    with open(info_path.with_name(info_path.name + ".tmp"), 'w') as f:
+        json.dump(info, f, indent=2)
+    os.replace(path.with_name(path.name + ".tmp"), path)
+    os.replace(info_path.with_name(info_path.name + ".tmp"), info_path)
+    return path
+
+def load_metadata(split_path: Path) -> Tuple[np.ndarray, Dict]:
+    """Metadata table and name tables of a split; raises if missing or stale."""
+    path = meta_path(split_path)
+    if not path.exists():
+        raise FileNotFoundError(f"{path} not found, build it with: python dataset_meta.py {Path(split_path).parent}")
+    with open(meta_info_path(split_path), 'r') as f:
+        info = json.load(f)
+    if not matches_signature(split_path, info):
+        raise ValueError(f"{path} was built from a different {Path(split_path).name}, rebuild it")
+    meta = np.load(path, mmap_mode='r')
+    if meta.dtype != META_DTYPE:
+        raise ValueError(f"{path} was built by an older dataset_meta.py, rebuild it")
+    return meta, info
+
+def refresh_metadata(split_path: Path, workers: int = 1) -> bool:
+    """Rebuild a split's index if it has one, e.g. after new token counts or clusters."""
+    if not meta_path(split_path).exists():
+        return False
+    meta, info = build_metadata(split_path, workers)
+    save_metadata(split_path, meta, info)
+    return True
+
+def summarize(meta: np.ndarray, info: Dict) -> Dict:
+    parsed = meta[meta["parsed"] == 1]
+    
+    def counts(column: str, names: List[str]) -> Dict[str, int]:
+        return {names[i]: int(n) for i, n in enumerate(np.bincount(parsed[column], minlength=len(names))) if n}
+    
+    summary = {
+        "entries": int(len(meta)),
+        "unparsed": int(len(meta) - len(parsed)),
+        "with_think": int(parsed["has_think"].sum()),
+        "with_system": int((parsed["roles"] & ROLE_BITS["system"] != 0).sum()),
+        "languages": counts("language", info["languages"]),
+        "sources": counts("source", info["sources"]),
+        "exact_duplicates": int(len(meta) - len(np.unique(meta["hash"]))),
+        "clusters": int(len(np.unique(meta["cluster"]))),
+    }
+    if info.get("tokens"):
+        summary["total_tokens"] = int(parsed["tokens"].sum())
+    return summary
+
+def index_paths(path: Path) -> List[Path]:
+    """The splits of a prepared run directory, or a single JSONL file."""
+    if path.is_dir():
+        return [path / f"{split}.jsonl" for split in SPLITS]
+    return [path]
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the per-entry metadata index of prepared splits")
+    parser.add_argument("data_dir", help="Directory containing train.jsonl and valid.jsonl, or a single JSONL file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes scanning the splits")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.setup(args)
+    
+    data_dir = Path(args.data_dir)
+    if not data_dir.exists():
+        print(f"❌ Not found: {data_dir}")
+        sys.exit(1)
+    
+    print("🗂️  Metadata Index")
+    print("=" * 60)
+    for split_path in index_paths(data_dir):
+        if not split_path.exists():
+            print(f"⚠️  No {split_path}, skipping")
+            continue
+        print(f"\n🔍 Scanning {split_path}...")
+        try:
+            meta, info = build_metadata(split_path, args.workers)
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        out_path = save_metadata(split_path, meta, info)
+        summary = summarize(meta, info)
+        print(f"  Entries: {summary['entries']} ({summary['unparsed']} unparsed)")
+        print(f"  With <think>: {summary['with_think']}, with a system prompt: {summary['with_system']}")
+        print(f"  Languages: {summary['languages']}")
+        print(f"  Sources: {dict(list(summary['sources'].items())[:10])}")
+        print(f"  Exact duplicates: {summary['exact_duplicates']}")
+        if info["clusters"]:
+            print(f"  Dedup clusters: {summary['clusters']}")
+        if not info["tokens"]:
+            print("  ⚠️  No token counts (run tokenize_dataset.py first for token-based curricula)")
+        print(f"💾 Saved metadata to: {out_path}")
+    
+    print("\n" + "=" * 60)
+    print("✅ Metadata index ready!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Exact and Near-Duplicate Detection for Qwen3 Thinking Model Training
+Normalised content hashes plus MinHash signatures with an LSH banding index
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import instrumentation
+import jsonl_codec as codec
+from validate_dataset import chunk_boundaries
+from tokenize_dataset import (DATASET_MANIFEST, SPLIT_COUNT_KEYS, filter_token_sidecars, invalidate_derived_files,
+                              record_rewritten_split, update_dataset_manifest)
+
+SHINGLE_WORDS = 5
+MERSENNE_PRIME = (1 << 61) - 1
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_messages(entry: Dict) -> str:
+    """Role-tagged message text, lowercased with whitespace collapsed."""
+    parts = [f"{msg.get('role', '')}: {msg.get('content', '')}"
+             for msg in entry.get("messages", []) if isinstance(msg, dict)]
+    return _WHITESPACE.sub(' ', "\n".join(parts)).strip().lower()
+
+def normalize_entry(raw: bytes) -> str:
+    return normalize_messages(codec.loads(raw))
+
+def shingle_hashes(text: str) -> np.ndarray:
+    """CRC32 of every word n-gram of the text (the whole text if it's short)."""
+    words = text.split(' ')
+    if len(words) <= SHINGLE_WORDS:
+        shingles = {text}
+    else:
+        shingles = {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    return np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+def permutations(num_perm: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Coefficients of the universal hashes (a*x + b) mod p used as permutations."""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+    return a, b
+
+def universal_hash(a: np.ndarray, b: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """(a*x + b) mod (2^61 - 1) for every coefficient pair (rows) and shingle (columns).
+    
+    a, b and the CRC32 shingles are below 2^32, so a*x + b stays below 2^64
+    and never wraps in uint64. The reduction uses 2^61 = 1 (mod p): the
+    bits above 61 are added back onto the low 61 bits, with no division.
+    """
+    product = a[:, None] * x[None, :] + b[:, None]
+    reduced = (product & np.uint64(MERSENNE_PRIME)) + (product >> np.uint64(61))
+    return np.where(reduced >= MERSENNE_PRIME, reduced - np.uint64(MERSENNE_PRIME), reduced)
+
+def _signature_chunk(path: str, start: int, end: int, num_perm: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact content hashes and MinHash signatures for the lines in [start, end).
+    
+    Lines that don't parse get a hash of their raw bytes and an all-max
+    signature, so they only ever match exact copies of themselves.
+    """
+    a, b = permutations(num_perm, seed)
+    exact = []
+    signatures = []
+    with open(path, 'rb') as f:
+        f.seek(start)
+        pos = start
+        for raw in f:
+            if pos >= end:
+                break
+            pos += len(raw)
+            try:
+                text = normalize_entry(raw)
+            except codec.DecodeError + (AttributeError,):
+                exact.append(hashlib.blake2b(raw.strip(), digest_size=8).digest())
+                signatures.append(np.full(num_perm, 0xFFFFFFFF, dtype=np.uint32))
+                continue
+            exact.append(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest())
+            x = shingle_hashes(text)
+            hashed = universal_hash(a, b, x)
+            signatures.append((hashed.min(axis=1) & 0xFFFFFFFF).astype(np.uint32))
+    
+    exact_arr = np.frombuffer(b"".join(exact), dtype=np.uint64) if exact else np.zeros(0, dtype=np.uint64)
+    sig_arr = np.stack(signatures) if signatures else np.zeros((0, num_perm), dtype=np.uint32)
+    return exact_arr, sig_arr
+
+class UnionFind:
+    """Disjoint sets whose root is always the lowest (first seen) index."""
+    
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+    
+    def find(self, x: int) -> int:
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+    
+    def union(self, x: int, y: int):
+        rx, ry = self.find(x), self.find(y)
+        if rx < ry:
+            self.parent[ry] = rx
+        elif ry < rx:
+            self.parent[rx] = ry
+
+def compute_signatures(paths: List[Path], num_perm: int, seed: int, workers: int) -> Tuple[np.ndarray, np.ndarray, List[int]]:
+    """Hashes and signatures of every line of every file, in file order."""
+    tasks = []
+    for path in paths:
+        boundaries = chunk_boundaries(path, max(workers, 1) * 4)
+        tasks.extend((str(path), s, e) for s, e in zip(boundaries[:-1], boundaries[1:]))
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_signature_chunk, [t[0] for t in tasks], [t[1] for t in tasks],
+                                [t[2] for t in tasks], [num_perm] * len(tasks), [seed] * len(tasks)))
+    
+    file_sizes = Counter()
+    for (path, _, _), (exact, _) in zip(tasks, results):
+        file_sizes[path] += len(exact)
+    exact = np.concatenate([r[0] for r in results]) if results else np.zeros(0, dtype=np.uint64)
+    sigs = np.concatenate([r[1] for r in results]) if results else np.zeros((0, num_perm), dtype=np.uint32)
+    return exact, sigs, [file_sizes[str(path)] for path in paths]
+
+def cluster_duplicates(exact: np.ndarray, sigs: np.ndarray, bands: int, threshold: float) -> Tuple[UnionFind, int, int]:
+    """Union exact duplicates, then LSH candidates whose estimated Jaccard passes.
+    
+    Each band is bucketed on its own and the bucket is discarded afterwards,
+    so memory stays O(entries) and time O(entries * bands).
+    """
+    uf = UnionFind(len(exact))
+    exact_pairs = near_pairs = 0
+    
+    first_seen = {}
+    for idx, digest in enumerate(exact.tolist()):
+        if digest in first_seen:
+            uf.union(first_seen[digest], idx)
+            exact_pairs += 1
+        else:
+            first_seen[digest] = idx
+    del first_seen
+    
+    rows = sigs.shape[1] // bands
+    unparsed = np.all(sigs == 0xFFFFFFFF, axis=1)
+    for band in range(bands):
+        band_bytes = np.ascontiguousarray(sigs[:, band * rows:(band + 1) * rows])
+        buckets = {}
+        for idx in range(len(sigs)):
+            if unparsed[idx]:
+                continue
+            key = band_bytes[idx].tobytes()
+            other = buckets.setdefault(key, idx)
+            if other == idx or uf.find(other) == uf.find(idx):
+                continue
+            if np.mean(sigs[other] == sigs[idx]) >= threshold:
+                uf.union(other, idx)
+                near_pairs += 1
+    
+    return uf, exact_pairs, near_pairs
+
+def expand_paths(paths: List[str]) -> List[Path]:
+    """Directories stand for their train.jsonl and valid.jsonl splits."""
+    expanded = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            expanded.extend(p for p in (path / "train.jsonl", path / "valid.jsonl") if p.exists())
+        else:
+            expanded.append(path)
+    return expanded
+
+def rewrite_without(path: Path, keep: np.ndarray):
+    """Rewrite a JSONL file keeping only the lines where `keep` is True."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(path, 'rb') as src, open(tmp_path, 'wb') as dest:
+        for line, kept in zip(src, keep):
+            if kept:
+                dest.write(line)
+    os.replace(tmp_path, path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Find exact and near-duplicate entries")
+    parser.add_argument("paths", nargs="+",
+                        help="JSONL files or prepared run directories (train.jsonl + valid.jsonl), in priority order")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Signature processes")
+    parser.add_argument("--num-perm", type=int, default=64,
+                        help="MinHash permutations")
+    parser.add_argument("--bands", type=int, default=8,
+                        help="LSH bands (num-perm must be divisible by it)")
+    parser.add_argument("--threshold", type=float, default=0.8,
+                        help="Minimum estimated Jaccard similarity for a near duplicate")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="MinHash permutation seed")
+    parser.add_argument("--apply", action="store_true",
+                        help="Rewrite the files keeping only the first entry of every cluster")
+    parser.add_argument("--report", type=str, default=None,
+                        help="Where to write the JSON cluster report (default: next to the first file)")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.setup(args)
+    
+    if args.num_perm % args.bands:
+        print(f"❌ --num-perm {args.num_perm} is not divisible by --bands {args.bands}")
+        sys.exit(1)
+    
+    paths = expand_paths(args.paths)
+    missing = [p for p in paths if not p.exists()]
+    if not paths or missing:
+        print(f"❌ Dataset not found: {', '.join(map(str, missing or args.paths))}")
+        sys.exit(1)
+    
+    print("🧬 Duplicate Detection")
+    print("=" * 60)
+    print(f"🔢 Computing MinHash signatures for {', '.join(map(str, paths))}...")
+    with instrumentation.span("hash", workers=args.workers):
+        exact, sigs, sizes = compute_signatures(paths, args.num_perm, args.seed, args.workers)
+    instrumentation.count("lines", len(exact))
+    print(f"✅ {len(exact)} entries signed")
+    
+    with instrumentation.span("cluster"):
+        uf, exact_pairs, near_pairs = cluster_duplicates(exact, sigs, args.bands, args.threshold)
+        roots = np.fromiter((uf.find(i) for i in range(len(exact))), dtype=np.int64, count=len(exact))
+    
+    # Global index -> (file, 1-based line)
+    file_of = np.repeat(np.arange(len(paths)), sizes)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+    
+    members = {}
+    for idx in np.flatnonzero(roots != np.arange(len(roots))).tolist():
+        members.setdefault(int(roots[idx]), [int(roots[idx])]).append(idx)
+    clusters = sorted(members.values(), key=len, reverse=True)
+    duplicates = sum(len(c) - 1 for c in clusters)
+    
+    # Entries in a later file whose cluster already has a member in an earlier file
+    leakage = Counter()
+    for cluster in clusters:
+        first_file = int(file_of[cluster[0]])
+        for idx in cluster[1:]:
+            if file_of[idx] != first_file:
+                leakage[(paths[first_file].name, paths[file_of[idx]].name)] += 1
+    
+    print(f"\n📊 Exact duplicate pairs: {exact_pairs}")
+    print(f"📊 Near-duplicate pairs: {near_pairs} (Jaccard >= {args.threshold})")
+    print(f"📊 Duplicate clusters: {len(clusters)} ({duplicates} removable entries)")
+    for cluster in clusters[:5]:
+        first = cluster[0]
+        print(f"  - {len(cluster)} entries, first at {paths[file_of[first]].name}:{first - starts[file_of[first]] + 1}")
+    if leakage:
+        print(f"\n⚠️  Cross-split leakage:")
+        for (src, dest), count in leakage.most_common():
+            print(f"  - {count} entries in {dest} duplicate {src}")
+    else:
+        print(f"\n✅ No cross-split leakage")
+    
+    report = {
+        "entries": int(len(exact)),
+        "exact_pairs": exact_pairs,
+        "near_pairs": near_pairs,
+        "clusters": len(clusters),
+        "duplicates": duplicates,
+        "leakage": {f"{dest}<-{src}": count for (src, dest), count in leakage.items()},
+        "params": {"num_perm": args.num_perm, "bands": args.bands,
+                   "threshold": args.threshold, "seed": args.seed},
+    }
+    report_path = Path(args.report) if args.report else paths[0].parent / "dedup_report.json"
+    with open(report_path, 'w') as f:
+        json.dump({**report, "members": [
+            [[paths[file_of[i]].name, int(i - starts[file_of[i]] + 1)] for i in cluster]
+            for cluster in clusters
+        ]}, f, indent=2)
+    print(f"\n💾 Saved cluster report to: {report_path}")
+    
+    # Imported here, dataset_meta builds on this module
+    from dataset_meta import refresh_metadata
+    keep = roots == np.arange(len(roots))
+    for file_idx, path in enumerate(paths):
+        lo, hi = starts[file_idx], starts[file_idx] + sizes[file_idx]
+        file_roots = roots[lo:hi]
+        if args.apply:
+            with instrumentation.span("write", file=path.name):
+                rewrite_without(path, keep[lo:hi])
+            file_roots = file_roots[keep[lo:hi]]
+            print(f"🗑️  Removed {int((~keep[lo:hi]).sum())} duplicates from {path}")
+            if path.name in SPLIT_COUNT_KEYS and (path.parent / DATASET_MANIFEST).exists():
+                record_rewritten_split(path, int(keep[lo:hi].sum()))
+            if filter_token_sidecars(path, keep[lo:hi]):
+                print(f"🔢 Removed them from the token sidecars of {path.name} too")
+            deleted = invalidate_derived_files(path)
+            if deleted:
+                print(f"🗑️  Deleted {', '.join(deleted)}, built on the old line numbers")
+        # Cluster id per remaining line, for metadata and sampling
+        np.save(path.with_name(path.name.replace(".jsonl", "") + ".clusters.npy"), file_roots)
+        with instrumentation.span("metadata", file=path.name):
+            refreshed = refresh_metadata(path, args.workers)
+        if refreshed:
+            print(f"🗂️  Refreshed the metadata index of {path.name}")
+    
+    if (paths[0].parent / DATASET_MANIFEST).exists():
+        update_dataset_manifest(paths[0].parent, {"dedup": report})
+    
+    print("\n" + "=" * 60)
+    print("✅ Duplicate detection complete!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Adapter Evaluation Harness
+Held-out prompts from valid.jsonl through the base model and each adapter:
+batched generation from a cached shared prompt prefix, with speed, think-block
+and answer-match metrics side by side
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import dataset_io
+import instrumentation
+import jsonl_codec as codec
+from tokenize_dataset import DATASET_MANIFEST, render_chat
+from train_backends import ADAPTER_CONFIG, BACKENDS, get_backend
+
+EVAL_REPORT = "eval_report.json"
+ASSISTANT_PREFIX = "<|im_start|>assistant\n"
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+BASE = "base"
+# LoRA shape used for --include-base when no adapter says otherwise (B = 0, so it doesn't matter)
+BASE_LORA = {"lora_layers": 16, "lora_rank": 8, "lora_alpha": 16, "lora_dropout": 0.0}
+_PUNCTUATION = re.compile(r'[^\w\s]')
+
+def valid_split(data_path: Path) -> Path:
+    """A split file as given, or the validation split of a prepared run directory."""
+    data_path = Path(data_path)
+    if data_path.is_file():
+        return data_path
+    manifest_path = data_path / DATASET_MANIFEST
+    if manifest_path.exists():
+        with open(manifest_path, 'r') as f:
+            name = json.load(f).get("valid_file")
+        if name:
+            return data_path / name
+    return data_path / "valid.jsonl"
+
+def load_prompts(path: Path, limit: int) -> List[Dict]:
+    """Entries ending in an assistant turn, as a generation prompt plus that turn as the reference."""
+    samples = []
+    with dataset_io.open_dataset(path) as f:
+        for line in f:
+            if limit and len(samples) >= limit:
+                break
+            try:
+                entry = codec.loads(line)
+            except codec.DecodeError:
+                continue
+            messages = entry.get("messages") if isinstance(entry, dict) else None
+            if not isinstance(messages, list) or len(messages) < 2:
+                continue
+            last = messages[-1]
+            if not isinstance(last, dict) or last.get("role") != "assistant" or not isinstance(last.get("content"), str):
+                continue
+            samples.append({
+                "prompt": render_chat({"messages": messages[:-1]}) + ASSISTANT_PREFIX,
+                "reference": last["content"],
+            })
+    return samples
+
+def split_think(text: str) -> Tuple[str, str, bool]:
+    """(think block, answer, whether an opened think block was closed)."""
+    if THINK_CLOSE in text:
+        think, answer = text.split(THINK_CLOSE, 1)
+        return think.split(THINK_OPEN, 1)[-1].strip(), answer.strip(), True
+    if THINK_OPEN in text:
+        return text.split(THINK_OPEN, 1)[1].strip(), "", False
+    return "", text.strip(), True
+
+def normalize_answer(text: str) -> str:
+    return " ".join(_PUNCTUATION.sub(" ", text.lower()).split())
+
+def answer_f1(answer: str, reference: str) -> float:
+    """Word-overlap F1 between normalized answers (1.0 when both are empty)."""
+    words = normalize_answer(answer).split()
+    reference_words = normalize_answer(reference).split()
+    if not words or not reference_words:
+        return float(words == reference_words)
+    common = sum((Counter(words) & Counter(reference_words)).values())
+    if not common:
+        return 0.0
+    precision = common / len(words)
+    recall = common / len(reference_words)
+    return 2 * precision * recall / (precision + recall)
+
+def shared_prefix_length(prompts: List[List[int]]) -> int:
+    """Tokens every prompt starts with (the common system prompt), leaving each at least one."""
+    length = min(len(prompt) for prompt in prompts) - 1
+    first = prompts[0]
+    for prompt in prompts[1:]:
+        same = 0
+        while same < length and prompt[same] == first[same]:
+            same += 1
+        length = same
+    return max(length, 0)
+
+def adapter_config(adapter_dir: Path) -> Tuple[str, Dict]:
+    """Backend name and LoRA settings from an adapter_config.json (ours or mlx_lm.lora's)."""
+    with open(Path(adapter_dir) / ADAPTER_CONFIG, 'r') as f:
+        config = json.load(f)
+    lora = config["lora_parameters"]
+    return config.get("backend", "mlx"), {
+        "lora_layers": config["num_layers"],
+        "lora_rank": lora["rank"],
+        "lora_alpha": lora["scale"] * lora["rank"],
+        "lora_dropout": lora.get("dropout", 0.0),
+    }
+
+def run_prompts(backend, prompts: List[List[int]], batch_size: int, max_tokens: int,
+                temperature: float, prefix_length: int) -> Dict:
+    """Generate for every prompt, timing the first token of each and the batches overall."""
+    cache = None
+    prefill_s = 0.0
+    if prefix_length:
+        start = time.perf_counter()
+        with instrumentation.span("prefill", tokens=prefix_length):
+            cache = backend.prefill(prompts[0][:prefix_length])
+        prefill_s = time.perf_counter() - start
+    
+    completions = [[] for _ in prompts]
+    first_token_s = [None] * len(prompts)
+    generate_s = 0.0
+    for start in range(0, len(prompts), batch_size):
+        batch = [prompt[prefix_length:] for prompt in prompts[start:start + batch_size]]
+        batch_start = time.perf_counter()
+        with instrumentation.span("generate", prompts=len(batch)):
+            for step in backend.generate(batch, max_tokens, temperature, cache):
+                now = time.perf_counter() - batch_start
+                for row, token in step:
+                    if first_token_s[start + row] is None:
+                        first_token_s[start + row] = now
+                    completions[start + row].append(token)
+                instrumentation.count("tokens", len(step))
+        generate_s += time.perf_counter() - batch_start
+    return {"completions": completions, "first_token_s": first_token_s,
+            "generate_s": generate_s, "prefill_s": prefill_s}
+
+def score(backend, samples: List[Dict], run: Dict, max_tokens: int) -> Tuple[Dict, List[str]]:
+    """Speed, think-block and answer-match metrics of one adapter's completions."""
+    tokenizer = backend.tokenizer
+    texts = [tokenizer.decode(ids) for ids in run["completions"]]
+    think_tokens = []
+    reference_think_tokens = []
+    closed = []
+    exact = []
+    f1 = []
+    for text, sample in zip(texts, samples):
+        think, answer, think_closed = split_think(text)
+        reference_think, reference_answer, _ = split_think(sample["reference"])
+        think_tokens.append(len(tokenizer.encode(think)) if think else 0)
+        reference_think_tokens.append(len(tokenizer.encode(reference_think)) if reference_think else 0)
+        closed.append(think_closed)
+        exact.append(normalize_answer(answer) == normalize_answer(reference_answer))
+        f1.append(answer_f1(answer, reference_answer))
+    
+    generated = sum(len(ids) for ids in run["completions"])
+    first_token_ms = [s * 1000 for s in run["first_token_s"] if s is not None]
+    metrics = {
+        "prompts": len(samples),
+        "generated_tokens": generated,
+        "tokens_per_s": round(generated / run["generate_s"], 1) if run["generate_s"] else 0.0,
+        "ttft_ms_mean": round(float(np.mean(first_token_ms)), 2) if first_token_ms else None,
+        "ttft_ms_p95": round(float(np.percentile(first_token_ms, 95)), 2) if first_token_ms else None,
+        "prefix_prefill_ms": round(run["prefill_s"] * 1000, 2),
+        "hit_max_tokens": round(sum(len(ids) >= max_tokens for ids in run["completions"]) / len(samples), 4),
+        "think_tokens_mean": round(float(np.mean(think_tokens)), 1),
+        "reference_think_tokens_mean": round(float(np.mean(reference_think_tokens)), 1),
+        "think_closed": round(sum(closed) / len(samples), 4),
+        "exact_match": round(sum(exact) / len(samples), 4),
+        "answer_f1": round(float(np.mean(f1)), 4),
+    }
+    return metrics, texts
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare adapters by answer quality and inference cost on held-out prompts")
+    parser.add_argument("--model-path", type=str, required=True,
+                        help="Base model (for the NumPy backend: a directory with tokenizer.json / base_model.npz)")
+    parser.add_argument("--adapter-path", type=str, nargs="*", default=[],
+                        help="Adapter or checkpoint directories to evaluate")
+    parser.add_argument("--include-base", action="store_true",
+                        help="Also evaluate the base model without an adapter")
+    parser.add_argument("--data-path", type=str, required=True,
+                        help="Prepared run directory (uses its validation split) or a JSONL file")
+    parser.add_argument("--backend", choices=BACKENDS, default=None,
+                        help="Engine to generate with (default: the one the adapter was trained with)")
+    parser.add_argument("--num-prompts", type=int, default=32,
+                        help="Held-out prompts to run (0 = all)")
+    parser.add_argument("--batch-size", type=int, default=8,
+                        help="Prompts generated together")
+    parser.add_argument("--max-tokens", type=int, default=512,
+                        help="Generation limit per prompt")
+    parser.add_argument("--temperature", type=float, default=0.0,
+                        help="Sampling temperature (0 = greedy)")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Seed for sampling")
+    parser.add_argument("--no-prefix-cache", action="store_true",
+                        help="Prefill every prompt in full instead of reusing the shared prefix")
+    parser.add_argument("--output", type=str, default=None,
+                        help=f"JSON report (default: {EVAL_REPORT} in the first adapter directory)")
+    parser.add_argument("--completions", type=str, default=None,
+                        help="Also write every completion to this JSONL file")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.setup(args)
+    
+    if not args.adapter_path and not args.include_base:
+        print("❌ Nothing to evaluate: pass --adapter-path and/or --include-base")
+        sys.exit(1)
+    for adapter_dir in args.adapter_path:
+        if not (Path(adapter_dir) / ADAPTER_CONFIG).exists():
+            print(f"❌ No {ADAPTER_CONFIG} in {adapter_dir}")
+            sys.exit(1)
+    split = valid_split(Path(args.data_path))
+    if not split.exists():
+        print(f"❌ Validation split not found: {split}")
+        sys.exit(1)
+    
+    print("🧪 Adapter Evaluation")
+    print("=" * 60)
+    samples = load_prompts(split, args.num_prompts)
+    if not samples:
+        print(f"❌ No entries ending in an assistant turn in {split}")
+        sys.exit(1)
+    print(f"📁 {len(samples)} held-out prompts from {split}")
+    
+    # Adapters of the same shape share one loaded backend
+    targets = ([(BASE, None)] if args.include_base else []) + [(path, Path(path)) for path in args.adapter_path]
+    backend = None
+    backend_key = None
+    base_state = None
+    results = []
+    completions = []
+    # The base model borrows the first adapter's engine and shape so it can share its backend
+    base_backend, base_lora = adapter_config(Path(args.adapter_path[0])) if args.adapter_path else ("mlx", BASE_LORA)
+    for name, adapter_dir in targets:
+        backend_name, lora = adapter_config(adapter_dir) if adapter_dir is not None else (base_backend, base_lora)
+        backend_name = args.backend or backend_name
+        config = {key: lora[key] for key in BASE_LORA}
+        key = (backend_name, tuple(sorted(config.items())))
+        if key != backend_key:
+            print(f"\n🔧 Loading {backend_name} backend...")
+            load_start = time.time()
+            with instrumentation.span("load-backend", backend=backend_name):
+                backend = get_backend(backend_name, {**config, "model": args.model_path, "learning_rate": 0.0,
+                                                     "seed": args.seed})
+            backend_key = key
+            # Freshly initialised LoRA has B = 0, i.e. it is the base model
+            base_state = backend.adapter_state()
+            print(f"✅ Backend ready in {time.time() - load_start:.1f}s")
+        backend.load_adapter_state(base_state if adapter_dir is None else backend.read_adapter(adapter_dir))
+        
+        prompts = [backend.tokenizer.encode(sample["prompt"]) for sample in samples]
+        prefix_length = 0 if args.no_prefix_cache else shared_prefix_length(prompts)
+        print(f"\n🔍 {name}: {len(prompts)} prompts, batch {args.batch_size}, "
+              f"shared prefix {prefix_length} tokens{' (cached)' if prefix_length else ''}")
+        run = run_prompts(backend, prompts, args.batch_size, args.max_tokens, args.temperature, prefix_length)
+        with instrumentation.span("score"):
+            metrics, texts = score(backend, samples, run, args.max_tokens)
+        metrics = {"adapter": name, "prefix_tokens": prefix_length, **metrics}
+        results.append(metrics)
+        completions.extend({"adapter": name, "prompt": i, "completion": text} for i, text in enumerate(texts))
+        print(f"  {metrics['tokens_per_s']:.1f} tok/s, TTFT {metrics['ttft_ms_mean']} ms (p95 {metrics['ttft_ms_p95']}), "
+              f"think {metrics['think_tokens_mean']} tokens, EM {metrics['exact_match']:.2%}, F1 {metrics['answer_f1']:.3f}")
+    
+    print("\n📊 Comparison")
+    print(f"  {'adapter':32s} {'tok/s':>9} {'TTFT ms':>9} {'think':>7} {'closed':>7} {'EM':>7} {'F1':>6}")
+    for metrics in results:
+        print(f"  {metrics['adapter'][-32:]:32s} {metrics['tokens_per_s']:>9.1f} {metrics['ttft_ms_mean'] or 0:>9.1f} "
+              f"{metrics['think_tokens_mean']:>7.1f} {metrics['think_closed']:>7.1%} "
+              f"{metrics['exact_match']:>7.1%} {metrics['answer_f1']:>6.3f}")
+    
+    output = Path(args.output) if args.output else Path(args.adapter_path[0] if args.adapter_path else ".") / EVAL_REPORT
+    report = {
+        "created": datetime.now().isoformat(),
+        "model": args.model_path,
+        "split": str(split),
+        "settings": {
+            "num_prompts": len(samples),
+            "batch_size": args.batch_size,
+            "max_tokens": args.max_tokens,
+            "temperature": args.temperature,
+            "seed": args.seed,
+            "prefix_cache": not args.no_prefix_cache,
+        },
+        "results": results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Saved report to: {output}")
+    if args.completions:
+        with open(args.completions, 'wb') as f:
+            for record in completions:
+                f.write(codec.dumps(record) + b"\n")
+        print(f"💾 Saved completions to: {args.completions}")
+    
+    print("\n" + "=" * 60)
+    print("✅ Evaluation complete!")
+
+if __name__ == "__main__":
+    main()
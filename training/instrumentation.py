@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Stage Timing and Profiling for the Training Scripts
+Named spans and counters that cost one flag check while disabled, a per-stage
+summary table, Chrome trace-event export, and a --profile flag running the
+script under cProfile or a stack-sampling profiler
+"""
+
+import argparse
+import atexit
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+PROFILERS = ("cprofile", "sample")
+SAMPLE_INTERVAL = 0.005
+# Spans past this many per thread still count in the summary, only the trace stops growing
+MAX_TRACE_EVENTS = 1_000_000
+REPORT_ROWS = 25
+
+_enabled = False
+_origin_ns = 0
+_local = threading.local()
+_lock = threading.Lock()
+_threads: List["_ThreadState"] = []
+_counters: Dict[str, float] = {}
+_counter_events: List[Tuple[str, int, float]] = []
+
+class _ThreadState:
+    """Open spans, per-name totals and trace events of one thread."""
+    __slots__ = ("tid", "name", "stack", "stats", "events")
+    
+    def __init__(self):
+        thread = threading.current_thread()
+        self.tid = thread.native_id
+        self.name = thread.name
+        self.stack: List["_Span"] = []
+        self.stats: Dict[str, List[int]] = {}  # name -> [calls, total ns, self ns, max ns]
+        self.events: List[Tuple[str, int, int, Dict]] = []
+
+def _thread_state() -> _ThreadState:
+    try:
+        return _local.state
+    except AttributeError:
+        state = _local.state = _ThreadState()
+        with _lock:
+            _threads.append(state)
+        return state
+
+class _Span:
+    __slots__ = ("name", "args", "state", "start", "children")
+    
+    def __init__(self, name: str, args: Dict):
+        self.name = name
+        self.args = args
+        self.children = 0
+    
+    def __enter__(self):
+        self.state = _thread_state()
+        self.state.stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+    
+    def __exit__(self, *exc):
+        duration = time.perf_counter_ns() - self.start
+        state = self.state
+        state.stack.pop()
+        # Time in nested spans is the parent's total but not its self time
+        if state.stack:
+            state.stack[-1].children += duration
+        stat = state.stats.get(self.name)
+        if stat is None:
+            stat = state.stats[self.name] = [0, 0, 0, 0]
+        stat[0] += 1
+        stat[1] += duration
+        stat[2] += duration - self.children
+        if duration > stat[3]:
+            stat[3] = duration
+        if len(state.events) < MAX_TRACE_EVENTS:
+            state.events.append((self.name, self.start, duration, self.args))
+        return False
+
+class _NullSpan:
+    # Fixed __exit__ arguments: *args would build a tuple on every disabled span
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def span(name: str, **args):
+    """`with span("parse"): ...` times the block as stage `name`; a shared no-op while disabled."""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+def count(name: str, value: float = 1):
+    """Add `value` to counter `name` (lines, bytes, tokens, ...); nothing while disabled."""
+    if not _enabled:
+        return
+    with _lock:
+        total = _counters[name] = _counters.get(name, 0) + value
+        if len(_counter_events) < MAX_TRACE_EVENTS:
+            _counter_events.append((name, time.perf_counter_ns(), total))
+
+def enabled() -> bool:
+    return _enabled
+
+def enable():
+    """Start recording spans and counters."""
+    global _enabled, _origin_ns
+    if not _enabled:
+        _origin_ns = time.perf_counter_ns()
+        _enabled = True
+
+def summary() -> Dict:
+    """Per-stage calls and times (all threads merged) and counter totals."""
+    wall = max(time.perf_counter_ns() - _origin_ns, 1)
+    merged: Dict[str, List[int]] = {}
+    for state in list(_threads):
+        for name, (calls, total, self_ns, longest) in list(state.stats.items()):
+            stat = merged.setdefault(name, [0, 0, 0, 0])
+            stat[0] += calls
+            stat[1] += total
+            stat[2] += self_ns
+            stat[3] = max(stat[3], longest)
+    return {
+        "wall_s": wall / 1e9,
+        "spans": {name: {"calls": calls, "total_s": total / 1e9, "self_s": self_ns / 1e9,
+                         "mean_ms": total / calls / 1e6, "max_ms": longest / 1e6}
+                  for name, (calls, total, self_ns, longest) in merged.items()},
+        "counters": dict(_counters),
+    }
+
+def summary_lines() -> List[str]:
+    """The summary as a table, stages by self time."""
+    data = summary()
+    wall = data["wall_s"]
+    lines = [f"⏱️  Stage timings over {wall:.2f}s (self = time not in a nested stage)",
+             f"  {'stage':<20} {'calls':>9} {'total s':>9} {'self s':>9} {'self %':>7} {'mean ms':>9} {'max ms':>9}"]
+    for name, stat in sorted(data["spans"].items(), key=lambda item: -item[1]["self_s"]):
+        lines.append(f"  {name:<20} {stat['calls']:>9} {stat['total_s']:>9.3f} {stat['self_s']:>9.3f} "
+                     f"{stat['self_s'] / wall * 100:>6.1f}% {stat['mean_ms']:>9.3f} {stat['max_ms']:>9.1f}")
+    for name, value in sorted(data["counters"].items()):
+        lines.append(f"  {name:<20} {value:>12g} ({value / wall:,.0f}/s)")
+    return lines
+
+def trace_events() -> List[Dict]:
+    """Spans and counters as Chrome trace events (microsecond timestamps)."""
+    pid = os.getpid()
+    events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0,
+               "args": {"name": Path(sys.argv[0]).name}}]
+    for state in list(_threads):
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": state.tid,
+                       "args": {"name": state.name}})
+        for name, start, duration, args in list(state.events):
+            event = {"name": name, "ph": "X", "pid": pid, "tid": state.tid,
+                     "ts": (start - _origin_ns) / 1000, "dur": duration / 1000}
+            if args:
+                event["args"] = args
+            events.append(event)
+    for name, ts, total in list(_counter_events):
+        events.append({"name": name, "ph": "C", "pid": pid, "tid": 0,
+                       "ts": (ts - _origin_ns) / 1000, "args": {name: total}})
+    return events
+
+def write_trace(path: Path):
+    """Write a trace for chrome://tracing or ui.perfetto.dev."""
+    with open(path, 'w') as f:
+        json.dump({"traceEvents": trace_events(), "displayTimeUnit": "ms"}, f, default=str)
+
+class StackSampler:
+    """Samples every thread's Python stack on a timer thread.
+    
+    Unlike cProfile nothing hooks function calls, so the profiled code runs
+    at full speed and only pays for the GIL the sampler takes every interval.
+    """
+    
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+    
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(tid, str(tid)))
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+    
+    def report_lines(self, rows: int = REPORT_ROWS) -> List[str]:
+        """The main thread's functions by samples spent in them (self) and under them
+        (total), then the busiest function of every other thread.
+        """
+        main_name = threading.main_thread().name
+        own = Counter()
+        inclusive = Counter()
+        threads: Dict[str, Counter] = {}
+        for stack, n in self.stacks.items():
+            if stack[0] != main_name:
+                threads.setdefault(stack[0], Counter())[stack[-1]] += n
+                continue
+            own[stack[-1]] += n
+            for function in set(stack[1:]):
+                inclusive[function] += n
+        total = max(sum(own.values()), 1)
+        lines = [f"🔬 {self.samples} stack samples every {self.interval * 1000:g} ms ({main_name})",
+                 f"  {'self %':>7} {'total %':>8}  function"]
+        for function, n in own.most_common(rows):
+            lines.append(f"  {n / total * 100:>6.1f}% {inclusive[function] / total * 100:>7.1f}%  {function}")
+        for name, functions in sorted(threads.items()):
+            function, n = functions.most_common(1)[0]
+            lines.append(f"  Thread {name}: mostly in {function} "
+                         f"({n / sum(functions.values()) * 100:.0f}% of its samples)")
+        return lines
+    
+    def write_collapsed(self, path: Path):
+        """Collapsed stacks, one `thread;outer;...;inner count` line each (speedscope, flamegraph.pl)."""
+        with open(path, 'w') as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {n}\n")
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """The shared --timings / --trace / --profile flags."""
+    group = parser.add_argument_group("profiling")
+    group.add_argument("--timings", action="store_true",
+                       help="Time the named stages (read, parse, write, ...) and print a summary at exit")
+    group.add_argument("--trace", metavar="PATH", default=None,
+                       help="Also write the stages as Chrome trace events (chrome://tracing, ui.perfetto.dev)")
+    group.add_argument("--profile", nargs="?", const="cprofile", choices=PROFILERS, default=None,
+                       help="Run under cProfile (default) or a stack sampler and print the hottest functions at exit")
+    group.add_argument("--profile-output", metavar="PATH", default=None,
+                       help="Save the profile: pstats for cprofile (snakeviz), collapsed stacks for sample (speedscope)")
+
+def setup(args: argparse.Namespace):
+    """Start what the profiling flags ask for; the reports go to stderr when the process exits."""
+    if args.timings or args.trace:
+        enable()
+    profiler = None
+    if args.profile == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif args.profile == "sample":
+        profiler = StackSampler()
+        profiler.start()
+    if _enabled or profiler:
+        atexit.register(_report, args, profiler)
+
+def _report(args: argparse.Namespace, profiler):
+    out = sys.stderr
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        print(f"\n🔬 cProfile, top {REPORT_ROWS} by cumulative time", file=out)
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(REPORT_ROWS)
+        if args.profile_output:
+            profiler.dump_stats(args.profile_output)
+            print(f"💾 Saved pstats to: {args.profile_output}", file=out)
+    elif isinstance(profiler, StackSampler):
+        profiler.stop()
+        print("", file=out)
+        for line in profiler.report_lines():
+            print(line, file=out)
+        if args.profile_output:
+            profiler.write_collapsed(args.profile_output)
+            print(f"💾 Saved collapsed stacks to: {args.profile_output}", file=out)
+    if _enabled:
+        print("", file=out)
+        for line in summary_lines():
+            print(line, file=out)
+        if args.trace:
+            write_trace(args.trace)
+            print(f"💾 Saved Chrome trace to: {args.trace}", file=out)
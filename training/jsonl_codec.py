@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Pluggable JSON Codec for the Dataset Scripts
+Uses orjson or msgspec when installed and falls back to the stdlib json
+module. Everything works on raw line bytes, no decode/strip copies needed.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+BACKENDS = [name for name, module in (("orjson", orjson), ("msgspec", msgspec)) if module] + ["json"]
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    # Compact like orjson and msgspec, so written lines don't depend on which one is installed
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+
+if msgspec:
+    class Message(msgspec.Struct):
+        role: str
+        content: str
+    
+    class Conversation(msgspec.Struct):
+        messages: List[Message]
+    
+    _conversation_decoder = msgspec.json.Decoder(Conversation)
+
+_CODECS = {"json": (json.loads, _stdlib_dumps, (json.JSONDecodeError, UnicodeDecodeError))}
+if orjson:
+    _CODECS["orjson"] = (orjson.loads, orjson.dumps, (orjson.JSONDecodeError,))
+if msgspec:
+    _CODECS["msgspec"] = (msgspec.json.decode, msgspec.json.encode, (msgspec.DecodeError, UnicodeDecodeError))
+
+def set_backend(name: str):
+    """Switch every caller of this module to another backend."""
+    global BACKEND, loads, dumps, DecodeError
+    if name not in _CODECS:
+        raise ValueError(f"JSON backend {name!r} is not available (have: {', '.join(BACKENDS)})")
+    BACKEND = name
+    loads, dumps, DecodeError = _CODECS[name]
+
+set_backend(os.environ.get("DATASET_JSON_BACKEND", BACKENDS[0]))
+
+def decode_conversation(raw: bytes) -> Optional["Conversation"]:
+    """Typed fast path: a Conversation if `raw` matches the messages schema.
+    
+    Returns None when msgspec isn't installed, the stdlib backend was picked
+    explicitly or the line doesn't match; callers then fall back to `loads`
+    and their own checks, which produce the detailed error messages.
+    """
+    if not msgspec or BACKEND == "json":
+        return None
+    try:
+        return _conversation_decoder.decode(raw)
+    except (msgspec.DecodeError, UnicodeDecodeError):
+        return None
+
+def benchmark(path: Path, max_lines: int) -> Dict[str, Dict[str, float]]:
+    """Lines/s and MB/s for loads and dumps of every available backend."""
+    lines = []
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                lines.append(line)
+            if len(lines) >= max_lines:
+                break
+    size_mb = sum(len(line) for line in lines) / 1e6
+    
+    results = {}
+    for name in BACKENDS:
+        backend_loads, backend_dumps, errors = _CODECS[name]
+        start = time.perf_counter()
+        entries = []
+        for line in lines:
+            try:
+                entries.append(backend_loads(line))
+            except errors:
+                pass
+        load_time = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        for entry in entries:
+            backend_dumps(entry)
+        dump_time = time.perf_counter() - start
+        
+        results[name] = {
+            "loads_lines_per_s": len(lines) / load_time,
+            "loads_mb_per_s": size_mb / load_time,
+            "dumps_lines_per_s": len(entries) / dump_time if dump_time else 0.0,
+        }
+    
+    if msgspec:
+        # Schema-typed decode, what the validator uses when msgspec is present
+        start = time.perf_counter()
+        for line in lines:
+            try:
+                _conversation_decoder.decode(line)
+            except msgspec.DecodeError:
+                pass
+        load_time = time.perf_counter() - start
+        results["msgspec-typed"] = {
+            "loads_lines_per_s": len(lines) / load_time,
+            "loads_mb_per_s": size_mb / load_time,
+            "dumps_lines_per_s": results["msgspec"]["dumps_lines_per_s"],
+        }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the available JSON backends on a JSONL file")
+    parser.add_argument("dataset_path", help="JSONL file to benchmark with")
+    parser.add_argument("--lines", type=int, default=100000,
+                        help="Read at most this many lines")
+    args = parser.parse_args()
+    
+    if not Path(args.dataset_path).exists():
+        print(f"❌ Dataset file not found: {args.dataset_path}")
+        sys.exit(1)
+    
+    print(f"⏱️  JSON backend benchmark on {args.dataset_path}")
+    print("=" * 60)
+    results = benchmark(Path(args.dataset_path), args.lines)
+    baseline = results["json"]
+    for name, result in results.items():
+        print(f"  {name:13s} loads: {result['loads_lines_per_s']:>10.0f} lines/s "
+              f"({result['loads_mb_per_s']:.1f} MB/s, {result['loads_lines_per_s'] / baseline['loads_lines_per_s']:.1f}x)  "
+              f"dumps: {result['dumps_lines_per_s']:>10.0f} lines/s "
+              f"({result['dumps_lines_per_s'] / baseline['dumps_lines_per_s']:.1f}x)")
+    print(f"\n  Active backend: {BACKEND}")
+
+if __name__ == "__main__":
+    main()
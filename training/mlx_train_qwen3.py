@@ -7,17 +7,21 @@ Optimized for flight-duration training with thinking model
 import argparse
 import json
 import os
+import signal
+import sys
 import time
 from pathlib import Path
 from datetime import datetime
-import mlx.core as mx
-import mlx.nn as nn
-import mlx.optimizers as optim
-from mlx_lm import load, generate
-from mlx_lm.utils import load_model
-from mlx_lm.tuner.trainer import TrainingArgs, train
-from mlx_lm.tuner.lora import LoRALinear
-import numpy as np
+from typing import Dict, List, Optional
+
+import instrumentation
+from telemetry import TELEMETRY_FILE, TelemetrySampler, format_sample
+
+# Backends (MLX, NumPy) and the data loader are imported when training starts,
+# so --help and --dry-run never pay for them
+BACKEND_NAMES = ["mlx", "numpy"]
+# Report, eval and final records of a run, one JSON object per line (what train_sweep.py follows)
+METRICS_FILE = "metrics.jsonl"
 
 class QwenThinkingTrainer:
     def __init__(self, args):
@@ -26,6 +30,7 @@ class QwenThinkingTrainer:
         
         # Training configuration optimized for 30B model
         self.config = {
+            "backend": args.backend,
             "model": args.model_path,
             "data": args.data_path,
             "adapter_path": args.output_dir,
@@ -34,127 +39,378 @@ class QwenThinkingTrainer:
             "val_batches": args.val_batches,
             "learning_rate": args.learning_rate,
             "batch_size": args.batch_size,
+            "max_seq_length": args.max_seq_length,
             "lora_rank": args.lora_rank,
             "lora_alpha": args.lora_alpha,
             "lora_dropout": args.lora_dropout,
             "lora_layers": args.lora_layers,
             "test": False,
             "test_batches": 100,
-            "seed": 42,
+            "seed": args.seed,
             "resume_adapter_file": None,
             "save_every": args.save_every,
+            "steps_per_report": args.steps_per_report,
+            "steps_per_eval": args.steps_per_eval or args.save_every,
+            "prefetch": args.prefetch,
+            "keep_checkpoints": args.keep_checkpoints,
+            "plan": args.plan,
             "grad_checkpoint": True,  # Memory efficient for 30B
         }
         
+        self.backend = None
+        self.sampler = None
+        self.checkpoints = None
+        self.loader = None
+        self.step = 0
+        self.trained_tokens = 0
+        self.stop_requested = False
+        self.metrics = None
+        
         print("🧠 Qwen3-30B-A3B-Thinking-2507 MLX Training")
         print("=" * 60)
+        print(f"Backend: {self.config['backend']}")
         print(f"Model: {self.config['model']}")
         print(f"Dataset: {self.config['data']}")
         print(f"Output: {self.config['adapter_path']}")
         print(f"Training for {self.config['iters']} iterations")
         print("=" * 60)
     
+    def validate_config(self) -> List[str]:
+        """Problems with the configuration, found without loading a backend."""
+        errors = []
+        for key in ("iters", "batch_size", "max_seq_length", "lora_rank", "save_every", "steps_per_report",
+                    "steps_per_eval"):
+            if self.config[key] <= 0:
+                errors.append(f"--{key.replace('_', '-')} must be positive")
+        if self.config["learning_rate"] <= 0:
+            errors.append("--learning-rate must be positive")
+        if self.config["keep_checkpoints"] < 1:
+            errors.append("--keep-checkpoints must be at least 1")
+        if self.config["prefetch"] < 0:
+            errors.append("--prefetch can't be negative")
+        if not 0 <= self.config["lora_dropout"] < 1:
+            errors.append("--lora-dropout must be in [0, 1)")
+        if self.config["max_seq_length"] < 2:
+            errors.append("--max-seq-length must be at least 2")
+        
+        data_dir = Path(self.config["data"])
+        if not data_dir.is_dir():
+            errors.append(f"Data directory not found: {data_dir}")
+        else:
+            for split in ("train", "valid"):
+                path = self.split_file(split)
+                if not path.exists():
+                    errors.append(f"{split} split not found: {path}")
+        if self.config["plan"] and not Path(self.config["plan"]).exists():
+            errors.append(f"Plan not found: {self.config['plan']} (build it with sampling_plan.py)")
+        elif self.config["plan"]:
+            import numpy as np
+            from sampling_plan import check_plan
+            
+            try:
+                if not len(np.load(self.config["plan"], mmap_mode='r')):
+                    errors.append(f"Plan {self.config['plan']} is empty (no entries to train on)")
+            except (OSError, ValueError) as e:
+                errors.append(f"Plan {self.config['plan']} can't be read: {e}")
+            if data_dir.is_dir() and self.split_file("train").exists():
+                try:
+                    check_plan(Path(self.config["plan"]), self.split_file("train"))
+                except ValueError as e:
+                    errors.append(str(e))
+        if self.args.resume and not self.resume_path():
+            errors.append(f"--resume: no checkpoint found at {self.args.resume if self.args.resume != 'latest' else self.config['adapter_path']}")
+        return errors
+    
+    def resume_path(self) -> Optional[Path]:
+        """Checkpoint `--resume` points at: the newest in the output dir, or an explicit one."""
+        from train_checkpoints import STATE_FILE, latest_checkpoint
+        
+        if self.args.resume == "latest":
+            return latest_checkpoint(Path(self.config["adapter_path"]))
+        path = Path(self.args.resume)
+        return path if (path / STATE_FILE).exists() else None
+    
+    def split_file(self, split: str) -> Path:
+        """Split file named in the dataset manifest, `<split>.jsonl` without one."""
+        data_dir = Path(self.config["data"])
+        manifest_file = data_dir / "dataset_manifest.json"
+        if manifest_file.exists():
+            with open(manifest_file, 'r') as f:
+                name = json.load(f).get("train_file" if split == "train" else "valid_file")
+            if name:
+                return data_dir / name
+        return data_dir / f"{split}.jsonl"
+    
     def prepare_data(self):
         """Load and prepare the dataset."""
         print("📚 Loading dataset...")
         
-        train_file = Path(self.args.data_path) / "train.jsonl"
-        valid_file = Path(self.args.data_path) / "valid.jsonl"
+        train_file = self.split_file("train")
+        valid_file = self.split_file("valid")
         
         if not train_file.exists() or not valid_file.exists():
             raise FileNotFoundError(f"Training data not found in {self.args.data_path}")
         
-        # Count entries
-        with open(train_file, 'r') as f:
-            train_count = sum(1 for _ in f)
-        with open(valid_file, 'r') as f:
-            valid_count = sum(1 for _ in f)
+        # Entry counts come from the prepare step's manifest when it has them; manifests
+        # started by tokenize_dataset.py or sampling_plan.py only hold their own keys
+        manifest = {}
+        manifest_file = Path(self.args.data_path) / "dataset_manifest.json"
+        if manifest_file.exists():
+            with open(manifest_file, 'r') as f:
+                manifest = json.load(f)
+        train_count = manifest.get("train_entries")
+        if train_count is None:
+            with open(train_file, 'rb') as f:
+                train_count = sum(1 for _ in f)
+        valid_count = manifest.get("val_entries")
+        if valid_count is None:
+            with open(valid_file, 'rb') as f:
+                valid_count = sum(1 for _ in f)
         
         print(f"✅ Train entries: {train_count}")
         print(f"✅ Validation entries: {valid_count}")
         
         return str(train_file), str(valid_file)
     
+    def load_backend(self):
+        """Build the training backend, importing its framework now."""
+        from train_backends import get_backend
+        
+        print(f"🔧 Loading {self.config['backend']} backend...")
+        load_start = time.time()
+        with instrumentation.span("load-backend", backend=self.config["backend"]):
+            self.backend = get_backend(self.config["backend"], self.config)
+        print(f"✅ Backend ready in {time.time() - load_start:.1f}s")
+    
     def monitor_memory(self):
-        """Monitor GPU memory usage."""
-        # MLX doesn't have direct memory reporting like CUDA
-        # But we can monitor system memory
-        import subprocess
+        """Print a one-off snapshot of process, system and backend memory."""
+        extra = self.backend.memory_stats if self.backend else None
+        sampler = self.sampler or TelemetrySampler(Path(self.args.output_dir) / TELEMETRY_FILE, extra=extra)
+        record = sampler.sample()
+        print(f"\n{format_sample(record)}")
+        if "mlx_active_mb" in record:
+            print(f"  Metal memory: {record['mlx_active_mb']:.0f} MB active, {record['mlx_peak_mb']:.0f} MB peak")
+    
+    def evaluate(self, batches) -> float:
+        """Token-weighted validation loss over the held-out batches."""
+        total_loss = 0.0
+        total_tokens = 0
+        for batch in batches:
+            loss, tokens = self.backend.eval_loss(batch)
+            total_loss += loss * tokens
+            total_tokens += tokens
+        return total_loss / total_tokens if total_tokens else float("nan")
+    
+    def log_metrics(self, event: str, **record):
+        """Append a record to <output-dir>/metrics.jsonl, flushed so it can be followed live."""
+        if self.metrics:
+            self.metrics.write(json.dumps({"event": event, "step": self.step, **record,
+                                           "time": round(time.time(), 3)}) + "\n")
+            self.metrics.flush()
+    
+    def token_ids(self, split_file: str):
+        """Pre-tokenized ids of a split when they match the backend's tokenizer, else None."""
+        from train_data import load_token_ids
         
         try:
-            result = subprocess.run(['top', '-l', '1', '-n', '10'], 
-                                  capture_output=True, text=True)
-            print("\n📊 System Memory Status:")
-            lines = result.stdout.split('\n')
-            for line in lines[:15]:
-                if 'PhysMem' in line or 'python' in line.lower():
-                    print(f"  {line.strip()}")
-        except:
-            pass
+            token_ids = load_token_ids(Path(split_file), self.backend.tokenizer_file)
+        except ValueError as e:
+            print(f"⚠️  Ignoring pre-tokenized ids: {e}; tokenizing on the fly")
+            return None
+        if token_ids is not None:
+            print(f"⚡ Pre-tokenized ids for {Path(split_file).name} ({len(token_ids)} entries)")
+        return token_ids
     
     def train_model(self):
         """Run the training loop."""
         train_file, valid_file = self.prepare_data()
         
-        # Update config with file paths
-        self.config["data"] = str(Path(self.args.data_path))
+        import numpy as np
+        from train_checkpoints import CheckpointWriter
+        from train_data import BatchLoader, PrefetchLoader, eval_batches
+        
+        self.load_backend()
+        resumed = self.resume() if self.args.resume else {}
+        plan = None
+        if self.config["plan"]:
+            # Memory-mapped: the loader reads only the slice of the plan it's at
+            plan = np.load(self.config["plan"], mmap_mode='r')
+            print(f"🎲 Sampling plan {self.config['plan']}: {len(plan)} samples "
+                  f"({len(plan) // self.config['batch_size']} steps at batch size {self.config['batch_size']})")
+            if len(plan) < self.config["iters"] * self.config["batch_size"]:
+                print(f"⚠️  The plan is shorter than {self.config['iters']} steps and will be repeated")
+        loader = BatchLoader(Path(train_file), self.backend.tokenizer, self.config["batch_size"],
+                             self.config["max_seq_length"], seed=self.config["seed"],
+                             position=resumed.get("position", 0), token_ids=self.token_ids(train_file), plan=plan)
+        self.train_entries = len(loader)
+        if resumed.get("train_entries", self.train_entries) != self.train_entries:
+            print(f"⚠️  The train split had {resumed['train_entries']} entries at the checkpoint, now "
+                  f"{self.train_entries}: the data order won't continue exactly")
+        val_set = eval_batches(Path(valid_file), self.backend.tokenizer, self.config["batch_size"],
+                               self.config["max_seq_length"], self.config["val_batches"],
+                               token_ids=self.token_ids(valid_file))
+        if self.config["prefetch"] > 0:
+            # Batches are tokenized and collated on a background thread while the step runs
+            loader = PrefetchLoader(loader, self.config["prefetch"])
+        self.loader = loader
+        self.checkpoints = CheckpointWriter(
+            self.backend, Path(self.config["adapter_path"]), self.config["keep_checkpoints"],
+            on_saved=lambda path, seconds: print(f"💾 Checkpoint written in the background: {path} ({seconds:.1f}s)"))
+        
+        if self.args.telemetry_interval > 0:
+            self.sampler = TelemetrySampler(Path(self.config["adapter_path"]) / TELEMETRY_FILE,
+                                            self.args.telemetry_interval, extra=self.backend.memory_stats)
+        
+        # Appended to, so a resumed run continues the same file
+        self.metrics = open(Path(self.config["adapter_path"]) / METRICS_FILE, 'a')
         
         print("\n🚀 Starting training...")
         print(f"⏰ Start time: {datetime.now().isoformat()}")
+        if self.sampler:
+            self.sampler.start()
+            print(f"📊 Telemetry every {self.args.telemetry_interval:g}s -> {self.sampler.output_path}")
         
-        # Create training arguments
-        training_args = TrainingArgs(
-            batch_size=self.config["batch_size"],
-            iters=self.config["iters"],
-            val_batches=self.config["val_batches"],
-            steps_per_report=10,
-            steps_per_eval=self.config["save_every"],
-            steps_per_save=self.config["save_every"],
-            adapter_path=self.config["adapter_path"],
-            grad_checkpoint=self.config["grad_checkpoint"],
-            seed=self.config["seed"],
-            learning_rate=self.config["learning_rate"],
-            lora_rank=self.config["lora_rank"],
-            lora_alpha=self.config["lora_alpha"],
-            lora_dropout=self.config["lora_dropout"],
-            lora_layers=self.config["lora_layers"],
-        )
-        
-        # Launch training
+        start_step = self.step
+        start_tokens = self.trained_tokens
+        # Time the loop spent blocked on the next batch instead of computing
+        data_wait = 0.0
+        train_start = time.perf_counter()
+        # Losses, tokens, data wait and time since the last report
+        window_losses = []
+        window_tokens = 0
+        window_wait = 0.0
+        window_start = train_start
+        # Ctrl-C / kill finish the current step and checkpoint it; a second Ctrl-C aborts
+        self.stop_requested = False
+        previous_handlers = {sig: signal.signal(sig, self.request_stop) for sig in (signal.SIGINT, signal.SIGTERM)}
         try:
-            # Import the actual training function from mlx_lm
-            from mlx_lm.tuner.trainer import train as mlx_train
-            
-            # Run training
-            mlx_train(
-                model=self.config["model"],
-                tokenizer=self.config["model"],  # Same path for tokenizer
-                args=training_args,
-                data_dir=self.config["data"],
-            )
-            
-            print("\n✅ Training completed successfully!")
+            while self.step < self.config["iters"] and not self.stop_requested:
+                wait_start = time.perf_counter()
+                with instrumentation.span("data-wait"):
+                    batch = next(loader)
+                waited = time.perf_counter() - wait_start
+                with instrumentation.span("train-step"):
+                    loss, tokens = self.backend.train_step(batch)
+                instrumentation.count("tokens", tokens)
+                self.step += 1
+                self.trained_tokens += tokens
+                data_wait += waited
+                window_losses.append(loss)
+                window_tokens += tokens
+                window_wait += waited
+                if self.sampler:
+                    self.sampler.record_step(self.step, self.trained_tokens, loss=loss, data_wait_s=round(data_wait, 3))
+                
+                last_step = self.step == self.config["iters"]
+                if self.step % self.config["steps_per_report"] == 0 or last_step:
+                    window = time.perf_counter() - window_start
+                    train_loss = sum(window_losses) / len(window_losses)
+                    print(f"  Iter {self.step}: train loss {train_loss:.3f}, "
+                          f"{len(window_losses) / window:.2f} it/s, {window_tokens / window:.0f} tok/s, "
+                          f"data wait {window_wait / window * 100:.1f}%, {self.trained_tokens} tokens")
+                    self.log_metrics("report", train_loss=round(train_loss, 4),
+                                     it_per_s=round(len(window_losses) / window, 3),
+                                     tokens_per_s=round(window_tokens / window, 1))
+                    window_losses = []
+                    window_tokens = 0
+                    window_wait = 0.0
+                    window_start = time.perf_counter()
+                if self.step % self.config["steps_per_eval"] == 0 or last_step:
+                    eval_start = time.perf_counter()
+                    with instrumentation.span("eval", step=self.step):
+                        val_loss = self.evaluate(val_set)
+                    print(f"  Iter {self.step}: val loss {val_loss:.3f} "
+                          f"({time.perf_counter() - eval_start:.1f}s)")
+                    self.log_metrics("eval", val_loss=round(val_loss, 4))
+                    # Evaluation time doesn't count toward training throughput
+                    window_start += time.perf_counter() - eval_start
+                if self.step % self.config["save_every"] == 0 or last_step or self.stop_requested:
+                    # Snapshot plus waiting for the previous write; the write itself is "save"
+                    with instrumentation.span("snapshot", step=self.step):
+                        self.save_checkpoint()
             
+            status = "interrupted" if self.stop_requested else "completed"
+            if self.stop_requested:
+                print(f"\n⚠️  Training interrupted at step {self.step}; continue with --resume")
+            else:
+                with instrumentation.span("save"):
+                    adapter_file = self.backend.save_adapter(Path(self.config["adapter_path"]))
+                print(f"💾 Saved adapter to: {adapter_file}")
+                print("\n✅ Training completed successfully!")
+        
         except KeyboardInterrupt:
-            print("\n⚠️  Training interrupted by user")
-            self.save_checkpoint("interrupted")
+            status = "aborted"
+            # Mid-step state may be torn, so the last complete checkpoint stands
+            print("\n⚠️  Training aborted; --resume continues from the last checkpoint")
         except Exception as e:
             print(f"\n❌ Training error: {e}")
             raise
+        finally:
+            for sig, handler in previous_handlers.items():
+                signal.signal(sig, handler)
+            if isinstance(loader, PrefetchLoader):
+                loader.close()
+            # Let the last checkpoint reach the disk before exiting
+            self.checkpoints.close()
+            if self.sampler:
+                self.sampler.stop()
         
         # Final stats
+        train_time = time.perf_counter() - train_start
+        throughput = {}
+        if self.step > start_step and train_time > 0:
+            throughput = {
+                "it_per_s": round((self.step - start_step) / train_time, 3),
+                "tokens_per_s": round((self.trained_tokens - start_tokens) / train_time, 1),
+                "data_wait_pct": round(data_wait / train_time * 100, 2),
+            }
+            print(f"📊 {throughput['it_per_s']:.2f} it/s, {throughput['tokens_per_s']:.0f} tokens/s overall, "
+                  f"{data_wait:.1f}s ({throughput['data_wait_pct']:.1f}%) waiting for data")
+        self.log_metrics("final", status=status, trained_tokens=self.trained_tokens,
+                         train_s=round(train_time, 2), **throughput)
+        self.metrics.close()
         elapsed = time.time() - self.start_time
         print(f"\n⏱️  Total training time: {elapsed/3600:.2f} hours")
+    
+    def request_stop(self, signum, frame):
+        """Signal handler: stop after the current step (a second Ctrl-C interrupts right away)."""
+        if self.stop_requested:
+            raise KeyboardInterrupt
+        self.stop_requested = True
+        print("\n⚠️  Stopping after this step and saving a checkpoint (Ctrl-C again to abort)")
+    
+    def resume(self) -> Dict:
+        """Restore the backend from the `--resume` checkpoint; returns its trainer state."""
+        from train_checkpoints import restore_checkpoint
+        
+        path = self.resume_path()
+        state = restore_checkpoint(self.backend, path)
+        self.step = state["step"]
+        self.trained_tokens = state["trained_tokens"]
+        self.config["resume_adapter_file"] = str(path / self.backend.adapter_file)
+        for key in ("seed", "batch_size", "max_seq_length", "plan"):
+            if state.get(key) is not None and state[key] != self.config[key]:
+                print(f"⚠️  {key} was {state[key]} in the checkpoint, now {self.config[key]}: "
+                      f"the data order won't continue exactly")
+        print(f"♻️  Resuming from {path} at step {self.step} (entry {state['position']})")
+        return state
+    
+    def save_checkpoint(self):
+        """Snapshot adapter, optimizer, RNG and data position; the disk write happens in the background."""
+        from train_checkpoints import take_snapshot
         
-    def save_checkpoint(self, suffix=""):
-        """Save a checkpoint."""
-        checkpoint_name = f"checkpoint_{self.config['iters']}_{suffix}"
-        checkpoint_path = Path(self.config["adapter_path"]) / checkpoint_name
-        print(f"💾 Saving checkpoint to: {checkpoint_path}")
-        # MLX will handle the actual saving
+        snapshot = take_snapshot(self.backend, self.step, self.loader.position, self.trained_tokens,
+                                 seed=self.config["seed"], batch_size=self.config["batch_size"],
+                                 max_seq_length=self.config["max_seq_length"], train_entries=self.train_entries,
+                                 plan=self.config["plan"])
+        self.checkpoints.save(snapshot)
 
-def main():
+def build_parser() -> argparse.ArgumentParser:
+    """The trainer's arguments (train_sweep.py expands grids over them)."""
     parser = argparse.ArgumentParser(description="MLX Training for Qwen3 Thinking Model")
+    parser.add_argument("--backend", choices=BACKEND_NAMES, default="mlx",
+                        help="mlx: the real model on Apple silicon; numpy: a tiny CPU reference model "
+                             "(--model-path may hold a tokenizer.json) for testing and benchmarking anywhere")
     parser.add_argument("--model-path", type=str, required=True,
                         help="Path to the base Qwen3 model")
     parser.add_argument("--data-path", type=str, required=True,
@@ -165,6 +421,8 @@ def main():
                         help="Number of training iterations")
     parser.add_argument("--batch-size", type=int, default=1,
                         help="Batch size (use 1 for 30B model)")
+    parser.add_argument("--max-seq-length", type=int, default=8192,
+                        help="Longest tokenized entry; longer ones are cut")
     parser.add_argument("--learning-rate", type=float, default=2e-5,
                         help="Learning rate")
     parser.add_argument("--lora-rank", type=int, default=64,
@@ -177,19 +435,50 @@ def main():
                         help="Number of layers to apply LoRA to")
     parser.add_argument("--save-every", type=int, default=250,
                         help="Save checkpoint every N steps")
+    parser.add_argument("--steps-per-report", type=int, default=10,
+                        help="Print train loss and throughput every N steps")
+    parser.add_argument("--steps-per-eval", type=int, default=None,
+                        help="Compute validation loss every N steps (default: --save-every)")
+    parser.add_argument("--keep-checkpoints", type=int, default=3,
+                        help="Resumable checkpoints kept in the output dir (older ones are deleted)")
+    parser.add_argument("--resume", nargs="?", const="latest", default=None,
+                        help="Continue from the newest checkpoint in --output-dir, or from the given checkpoint dir")
     parser.add_argument("--val-batches", type=int, default=25,
                         help="Number of validation batches")
+    parser.add_argument("--prefetch", type=int, default=4,
+                        help="Batches built ahead on a background thread (0 = build them inline)")
+    parser.add_argument("--plan", type=str, default=None,
+                        help="Iteration plan from sampling_plan.py (train.plan.npy) to draw samples from instead of epochs")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Seed for data order, LoRA init and dropout")
+    parser.add_argument("--telemetry-interval", type=float, default=5.0,
+                        help="Seconds between resource samples in <output-dir>/telemetry.jsonl (0 disables)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Validate the configuration and data paths, then exit without loading a backend")
+    instrumentation.add_arguments(parser)
+    return parser
+
+def main():
+    args = build_parser().parse_args()
+    instrumentation.setup(args)
+    
+    # Initialize trainer
+    trainer = QwenThinkingTrainer(args)
     
-    args = parser.parse_args()
+    errors = trainer.validate_config()
+    if errors:
+        for error in errors:
+            print(f"❌ {error}")
+        sys.exit(1)
+    if args.dry_run:
+        print("✅ Configuration valid (dry run, nothing trained)")
+        return
     
     # Create output directory
     Path(args.output_dir).mkdir(parents=True, exist_ok=True)
     
-    # Initialize trainer
-    trainer = QwenThinkingTrainer(args)
-    
     # Start training
     trainer.train_model()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
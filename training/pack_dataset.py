@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Sequence Packing for Qwen3 Thinking Model Training
+Bin-packs short conversations into max_seq_length training sequences
+"""
+
+import argparse
+import bisect
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import instrumentation
+import jsonl_codec as codec
+from tokenize_dataset import update_dataset_manifest
+
+# One row per packed sequence: where it starts in the packed JSONL, how many
+# conversations it holds and how many real tokens it carries
+PACK_INDEX_DTYPE = np.dtype([("offset", "<u8"), ("segments", "<u4"), ("tokens", "<u4")])
+
+def line_offsets(split_path: Path) -> np.ndarray:
+    """Byte offset of every line of a split."""
+    offsets = []
+    pos = 0
+    with open(split_path, 'rb') as f:
+        for line in f:
+            offsets.append(pos)
+            pos += len(line)
+    return np.asarray(offsets, dtype=np.uint64)
+
+def pack_sequences(lengths: np.ndarray, capacity: int, seed: int) -> Tuple[List[List[int]], List[int]]:
+    """Best-fit decreasing bin packing of entry indices into `capacity` tokens.
+    
+    Ties in length are broken by a seeded shuffle and the resulting packs are
+    shuffled with the same seed, so a given seed always yields the same plan.
+    Lines tokenize_dataset.py couldn't parse (0 tokens) are left out.
+    Returns the packs and the indices that don't fit in any sequence.
+    """
+    rng = np.random.default_rng(seed)
+    candidates = rng.permutation(len(lengths))
+    candidates = candidates[np.argsort(-lengths[candidates].astype(np.int64), kind="stable")]
+    
+    packs = []
+    # Sorted (remaining capacity, pack id) of the packs that still have room
+    open_packs = []
+    overlength = []
+    for idx in candidates.tolist():
+        length = int(lengths[idx])
+        if length == 0:
+            continue
+        if length > capacity:
+            overlength.append(idx)
+            continue
+        slot = bisect.bisect_left(open_packs, (length, -1))
+        if slot < len(open_packs):
+            remaining, pack_id = open_packs.pop(slot)
+            packs[pack_id].append(idx)
+            remaining -= length
+        else:
+            pack_id = len(packs)
+            packs.append([idx])
+            remaining = capacity - length
+        if remaining > 0:
+            bisect.insort(open_packs, (remaining, pack_id))
+    
+    order = rng.permutation(len(packs))
+    return [packs[i] for i in order], sorted(overlength)
+
+def write_packed(split_path: Path, packs: List[List[int]], lengths: np.ndarray,
+                 packed_path: Path, index_path: Path):
+    """Write one JSONL line per pack plus a binary index of the packs.
+    
+    Each packed line concatenates the conversations' messages and records
+    `segment_lengths` (tokens per conversation, in order) so the trainer can
+    reset positions and mask attention at conversation boundaries.
+    """
+    with instrumentation.span("read", file=split_path.name):
+        offsets = line_offsets(split_path)
+    index = np.zeros(len(packs), dtype=PACK_INDEX_DTYPE)
+    
+    with instrumentation.span("write", file=packed_path.name), \
+            open(split_path, 'rb') as src, open(packed_path, 'wb') as dest:
+        pos = 0
+        for pack_id, pack in enumerate(packs):
+            messages = []
+            for idx in pack:
+                src.seek(int(offsets[idx]))
+                with instrumentation.span("parse"):
+                    messages.extend(codec.loads(src.readline())["messages"])
+            packed = {
+                "messages": messages,
+                "segment_lengths": [int(lengths[idx]) for idx in pack],
+                "source_lines": [idx + 1 for idx in pack],
+            }
+            line = codec.dumps(packed) + b'\n'
+            dest.write(line)
+            index[pack_id] = (pos, len(pack), sum(packed["segment_lengths"]))
+            pos += len(line)
+    
+    np.save(index_path, index)
+
+def pack_split(data_dir: Path, split: str, capacity: int, seed: int) -> Dict:
+    """Pack one split and return its packing stats."""
+    split_path = data_dir / f"{split}.jsonl"
+    tokens_path = data_dir / f"{split}.tokens.npy"
+    if not tokens_path.exists():
+        raise FileNotFoundError(f"{tokens_path} not found, run tokenize_dataset.py first")
+    
+    lengths = np.load(tokens_path)
+    print(f"\n📦 Packing {len(lengths)} entries from {split_path} into {capacity}-token sequences...")
+    with instrumentation.span("pack"):
+        packs, overlength = pack_sequences(lengths, capacity, seed)
+    
+    packed_path = data_dir / f"{split}.packed.jsonl"
+    index_path = data_dir / f"{split}.packed.index.npy"
+    write_packed(split_path, packs, lengths, packed_path, index_path)
+    
+    packed_tokens = int(sum(int(lengths[idx]) for pack in packs for idx in pack))
+    unparsed = int((lengths == 0).sum())
+    packed_entries = len(lengths) - len(overlength) - unparsed
+    efficiency = packed_tokens / (len(packs) * capacity) if packs else 0.0
+    unpacked = packed_tokens / (packed_entries * capacity) if packs else 0.0
+    stats = {
+        "capacity": capacity,
+        "seed": seed,
+        "entries": int(len(lengths)),
+        "packs": len(packs),
+        "real_tokens": packed_tokens,
+        "efficiency": efficiency,
+        "unpacked_efficiency": unpacked,
+        "overlength": len(overlength),
+        "unparsed": unparsed,
+    }
+    
+    print(f"  Packs: {len(packs)} ({packed_entries / max(len(packs), 1):.1f} conversations each)")
+    print(f"  Packing efficiency: {efficiency*100:.1f}% real tokens "
+          f"(vs {unpacked*100:.1f}% one conversation per sequence)")
+    if overlength:
+        print(f"  ⚠️  {len(overlength)} entries exceed {capacity} tokens and were left out")
+    if unparsed:
+        print(f"  ⚠️  {unparsed} lines could not be parsed and were left out")
+    print(f"💾 Saved packed data to: {packed_path}")
+    print(f"💾 Saved pack index to: {index_path}")
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack short conversations into full training sequences")
+    parser.add_argument("data_dir", help="Directory with the prepared splits and their .tokens.npy sidecars")
+    parser.add_argument("--max-seq-length", type=int, default=8192,
+                        help="Token capacity of one packed sequence")
+    parser.add_argument("--splits", nargs="+", default=["train"],
+                        help="Splits to pack")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Seed for tie-breaking and pack order")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.setup(args)
+    
+    data_dir = Path(args.data_dir)
+    print("📦 Sequence Packing")
+    print("=" * 60)
+    
+    packing = {}
+    for split in args.splits:
+        try:
+            packing[split] = pack_split(data_dir, split, args.max_seq_length, args.seed)
+        except FileNotFoundError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+    
+    update_dataset_manifest(data_dir, {"packing": packing})
+    
+    print("\n" + "=" * 60)
+    print("✅ Packing complete!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Dataset Queries over the Metadata Index
+Filters a split's metadata index (see dataset_meta.py) and cuts the matching
+entries out by seeking to their byte offsets, without parsing the JSONL
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from dataset_meta import META_DTYPE, ROLE_BITS, OTHER_ROLE, load_metadata, summarize
+
+NAMED_FIELDS = {"language": "languages", "source": "sources"}
+_CONDITION = re.compile(r'^\s*(\w+)\s*(==|!=|>=|<=|=|>|<)\s*(.+?)\s*$')
+_OPERATORS = {
+    "=": np.equal, "==": np.equal, "!=": np.not_equal,
+    ">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal,
+}
+
+def parse_condition(text: str, info: Dict) -> Tuple[str, str, object]:
+    """`chars>4000` -> ("chars", ">", 4000); names in language/source/role become ids or bits."""
+    match = _CONDITION.match(text)
+    if not match:
+        raise ValueError(f"Expected FIELD OP VALUE (e.g. chars>4000, language=polish), got {text!r}")
+    field, op, value = match.groups()
+    if field == "role":
+        if op not in ("=", "==", "!="):
+            raise ValueError(f"role only supports = and != (got {text!r})")
+        bit = ROLE_BITS.get(value, OTHER_ROLE if value == "other" else None)
+        if bit is None:
+            raise ValueError(f"Unknown role {value!r} (have: {', '.join(list(ROLE_BITS) + ['other'])})")
+        return field, op, bit
+    if field in NAMED_FIELDS:
+        if op not in ("=", "==", "!="):
+            raise ValueError(f"{field} only supports = and != (got {text!r})")
+        names = info[NAMED_FIELDS[field]]
+        if value not in names:
+            raise ValueError(f"No {field} {value!r} in this split (have: {', '.join(names)})")
+        return field, op, names.index(value)
+    if field not in META_DTYPE.names:
+        raise ValueError(f"Unknown field {field!r} (have: role, {', '.join(META_DTYPE.names)})")
+    try:
+        number = int(value)
+    except ValueError:
+        try:
+            number = float(value)
+        except ValueError:
+            raise ValueError(f"{field} compares against numbers, got {value!r}") from None
+    return field, op, number
+
+def select(meta: np.ndarray, conditions: List[Tuple[str, str, object]]) -> np.ndarray:
+    """Indices of the entries matching every condition, in file order."""
+    mask = np.ones(len(meta), dtype=bool)
+    for field, op, value in conditions:
+        if field == "role":
+            has_role = (meta["roles"] & value) != 0
+            mask &= has_role if op != "!=" else ~has_role
+        else:
+            mask &= _OPERATORS[op](meta[field], value)
+    return np.flatnonzero(mask)
+
+def materialize(split_path: Path, meta: np.ndarray, indices: np.ndarray, output_path: Path) -> int:
+    """Copy the selected lines verbatim to `output_path` by offset; returns bytes written."""
+    written = 0
+    fd = os.open(split_path, os.O_RDONLY)
+    try:
+        with open(output_path, 'wb') as out:
+            for i in indices:
+                line = os.pread(fd, int(meta["size"][i]), int(meta["offset"][i]))
+                if not line.endswith(b"\n"):
+                    line += b"\n"
+                out.write(line)
+                written += len(line)
+    finally:
+        os.close(fd)
+    return written
+
+def describe(meta: np.ndarray, indices: np.ndarray, info: Dict) -> List[str]:
+    """Summary lines of the selection: languages, sources, think share, length percentiles."""
+    selected = meta[indices]
+    summary = summarize(selected, info)
+    lines = [
+        f"  Languages: {summary['languages']}",
+        f"  Sources: {dict(list(summary['sources'].items())[:10])}",
+        f"  With <think>: {summary['with_think']} ({summary['with_think'] / max(len(selected), 1) * 100:.1f}%)",
+    ]
+    if len(selected):
+        p50, p90, p99 = np.percentile(selected["chars"], [50, 90, 99])
+        lines.append(f"  Chars p50/p90/p99: {p50:.0f} / {p90:.0f} / {p99:.0f}")
+        if info.get("tokens"):
+            p50, p90, p99 = np.percentile(selected["tokens"], [50, 90, 99])
+            lines.append(f"  Tokens p50/p90/p99: {p50:.0f} / {p90:.0f} / {p99:.0f}, total {int(selected['tokens'].sum())}")
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description="Filter a split by its metadata index and slice out the matches")
+    parser.add_argument("path", help="Prepared run directory or a JSONL file with a .meta.npy index")
+    parser.add_argument("--split", choices=["train", "valid"], default="train",
+                        help="Split to query when PATH is a directory")
+    parser.add_argument("--where", nargs="+", default=[], metavar="CONDITION",
+                        help="Conditions that must all hold, e.g. language=polish has_think=1 think_chars>4000 "
+                             "role=system tokens<=8192")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Keep the first N matches")
+    parser.add_argument("--sample", type=int, default=None, metavar="N",
+                        help="Keep N random matches (in file order)")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Seed for --sample")
+    parser.add_argument("--show", type=int, default=0, metavar="N",
+                        help="Print the index rows of the first N matches")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Write the matching lines to this JSONL file")
+    parser.add_argument("--indices", type=str, default=None,
+                        help="Save the matching entry indices as .npy (usable as the trainer's --plan)")
+    args = parser.parse_args()
+    
+    path = Path(args.path)
+    split_path = path / f"{args.split}.jsonl" if path.is_dir() else path
+    try:
+        meta, info = load_metadata(split_path)
+        conditions = [parse_condition(text, info) for text in args.where]
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    
+    start = time.perf_counter()
+    indices = select(meta, conditions)
+    matched = len(indices)
+    if args.sample is not None and args.sample < len(indices):
+        rng = np.random.default_rng(args.seed)
+        indices = np.sort(rng.choice(indices, size=args.sample, replace=False))
+    if args.limit is not None:
+        indices = indices[:args.limit]
+    elapsed = time.perf_counter() - start
+    
+    print(f"🔍 {matched} of {len(meta)} entries in {split_path.name} match "
+          f"{' and '.join(args.where) or 'everything'} ({elapsed * 1000:.1f} ms)")
+    if len(indices) != matched:
+        print(f"🎲 Keeping {len(indices)}")
+    for line in describe(meta, indices, info):
+        print(line)
+    
+    if args.show:
+        print(f"\n  {'entry':>8} {'offset':>12} {'chars':>7} {'tokens':>7} {'think':>7} {'language':>10} {'source':>12}")
+        for i in indices[:args.show]:
+            row = meta[i]
+            print(f"  {i:>8} {int(row['offset']):>12} {int(row['chars']):>7} {int(row['tokens']):>7} "
+                  f"{int(row['think_chars']) if row['has_think'] else '-':>7} "
+                  f"{info['languages'][row['language']]:>10} {info['sources'][row['source']][:12]:>12}")
+    
+    if args.indices:
+        np.save(args.indices, indices.astype(np.uint32))
+        print(f"💾 Saved {len(indices)} entry indices to: {args.indices}")
+    if args.output:
+        start = time.perf_counter()
+        written = materialize(split_path, meta, indices, Path(args.output))
+        print(f"💾 Wrote {len(indices)} entries ({written / (1 << 20):.1f} MB) to {args.output} "
+              f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+if __name__ == "__main__":
+    main()
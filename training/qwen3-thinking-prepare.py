@@ -4,15 +4,34 @@ Qwen3-30B-A3B-Thinking-2507 Training Preparation Script
 Perfect setup for flight-duration training jak dla DANII!
 """
 
+import argparse
 import json
 import random
 import os
 import sys
+from array import array
+from collections import Counter
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import Callable, List, Dict, Optional, Tuple
 import hashlib
+import shutil
 from datetime import datetime
 
+import dataset_io
+import instrumentation
+import jsonl_codec as codec
+from dataset_meta import build_metadata, meta_info_path, save_metadata
+from validate_dataset import DatasetValidator, scan_think_blocks
+
+TRAINING_RUNS_DIR = Path("/Users/polyversai/training_runs")
+PREP_CACHE_DIR = TRAINING_RUNS_DIR / ".prep_cache"
+SPLIT_MANIFEST = "split_manifest.json"
+DATASET_MANIFEST = "dataset_manifest.json"
+CACHE_INFO = "cache_info.json"
+# Bytes before the last processed offset that must be unchanged for --append
+APPEND_FINGERPRINT_BYTES = 4096
+HASH_BUFFER_SIZE = 1 << 20
+
 # Training configuration for Qwen3-30B thinking model
 CONFIG = {
     "model_name": "qwen3-30b-a3b-thinking-2507",
@@ -43,28 +62,45 @@ CONFIG = {
     "top_p": 0.95,
 }
 
+# CONFIG entries that change the split artifacts (part of the cache key)
+CACHE_CONFIG_KEYS = ("train_split", "val_split")
+SPLIT_SUFFIXES = {None: "", "gz": ".gz", "zst": ".zst"}
+
 def validate_thinking_entry(entry: Dict) -> bool:
     """Validate that entry has proper thinking tags."""
     if "messages" not in entry:
         return False
     
-    # Check if assistant responses contain <think> tags
+    # Check if assistant responses contain a think block, by the validator's definition
     for msg in entry.get("messages", []):
-        if msg.get("role") == "assistant" and "<think>" in msg.get("content", ""):
+        if not isinstance(msg, dict) or msg.get("role") != "assistant" or not isinstance(msg.get("content"), str):
+            continue
+        if scan_think_blocks(msg["content"])[0]:
             return True
     return False
 
-def shuffle_and_split_dataset(dataset_path: str) -> Tuple[List[Dict], List[Dict]]:
-    """Load, validate, shuffle and split the dataset."""
+def shuffle_and_split_dataset(dataset_path: str, seed: int = 42) -> Tuple[List[Dict], List[Dict], int]:
+    """Load, validate, shuffle and split the dataset.
+    
+    Also returns the number of lines dropped because they aren't JSON objects.
+    """
     print(f"🔄 Loading dataset from: {dataset_path}")
     
     entries = []
     thinking_count = 0
+    skipped = 0
     
-    with open(dataset_path, 'r', encoding='utf-8') as f:
+    with instrumentation.span("read"), dataset_io.open_dataset(dataset_path) as f:
         for line_num, line in enumerate(f, 1):
+            if not line.strip():
+                continue
             try:
-                entry = json.loads(line.strip())
+                with instrumentation.span("parse"):
+                    entry = codec.loads(line)
+                if not isinstance(entry, dict):
+                    print(f"⚠️  Line {line_num} is not a JSON object, skipping")
+                    skipped += 1
+                    continue
                 entries.append(entry)
                 
                 if validate_thinking_entry(entry):
@@ -73,16 +109,21 @@ def shuffle_and_split_dataset(dataset_path: str) -> Tuple[List[Dict], List[Dict]
                 if line_num % 1000 == 0:
                     print(f"  Loaded {line_num} entries...")
                     
-            except json.JSONDecodeError as e:
+            except codec.DecodeError as e:
                 print(f"⚠️  Error parsing line {line_num}: {e}")
+                skipped += 1
                 continue
     
+    instrumentation.count("lines", len(entries))
     print(f"✅ Loaded {len(entries)} entries total")
+    if skipped:
+        print(f"⚠️  Skipped {skipped} lines that aren't JSON objects")
     print(f"🧠 {thinking_count} entries have <think> tags ({thinking_count/len(entries)*100:.1f}%)")
     
     # Shuffle with fixed seed for reproducibility
-    random.seed(42)
-    random.shuffle(entries)
+    with instrumentation.span("shuffle"):
+        random.seed(seed)
+        random.shuffle(entries)
     print("🔀 Dataset shuffled!")
     
     # Split into train/val
@@ -92,26 +133,296 @@ def shuffle_and_split_dataset(dataset_path: str) -> Tuple[List[Dict], List[Dict]
     
     print(f"📊 Split: {len(train_data)} train, {len(val_data)} validation")
     
-    return train_data, val_data
+    return train_data, val_data, skipped
 
-def save_split_datasets(train_data: List[Dict], val_data: List[Dict], output_dir: str):
-    """Save train and validation splits."""
+def split_paths(output_dir, compress: Optional[str] = None) -> Tuple[Path, Path]:
+    """train/valid JSONL paths in `output_dir`, with a .gz/.zst suffix when compressing."""
     output_path = Path(output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
-    
-    train_path = output_path / "train.jsonl"
-    val_path = output_path / "valid.jsonl"
+    suffix = SPLIT_SUFFIXES[compress]
+    return output_path / f"train.jsonl{suffix}", output_path / f"valid.jsonl{suffix}"
+
+def save_split_datasets(train_data: List[Dict], val_data: List[Dict], output_dir: str,
+                        compress: Optional[str] = None, skipped: int = 0):
+    """Save train and validation splits."""
+    train_path, val_path = split_paths(output_dir, compress)
     
     # Save training data
-    with open(train_path, 'w', encoding='utf-8') as f:
+    with instrumentation.span("write", file=train_path.name), dataset_io.open_dataset(train_path, 'wb') as f:
         for entry in train_data:
-            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.write(json.dumps(entry, ensure_ascii=False).encode('utf-8') + b'\n')
     
     # Save validation data
-    with open(val_path, 'w', encoding='utf-8') as f:
+    with instrumentation.span("write", file=val_path.name), dataset_io.open_dataset(val_path, 'wb') as f:
         for entry in val_data:
-            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.write(json.dumps(entry, ensure_ascii=False).encode('utf-8') + b'\n')
+    
+    report_saved_splits(train_path, val_path, len(train_data), len(val_data), skipped)
+    return train_path, val_path
+
+def index_line_offsets(dataset_path: str, line_filter: Optional[Callable[[bytes, int], bool]] = None) -> array:
+    """Record the byte offset of every non-blank line in one pass.
+    
+    `line_filter(line, line_num)` sees every raw line (e.g. a validator's
+    `check_line`) and drops the ones it returns False for.
+    """
+    offsets = array('Q')
+    pos = 0
+    with instrumentation.span("read"), open(dataset_path, 'rb') as f:
+        for line_num, line in enumerate(f, 1):
+            keep = line_filter(line, line_num) if line_filter else True
+            if keep and line.strip():
+                offsets.append(pos)
+            pos += len(line)
+            
+            if line_num % 1000 == 0:
+                print(f"  Indexed {line_num} lines...")
+    instrumentation.count("bytes", pos)
+    return offsets
+
+def stream_shuffle_and_split(dataset_path: str, output_dir: str, seed: int = 42,
+                             line_filter: Optional[Callable[[bytes, int], bool]] = None,
+                             compress: Optional[str] = None) -> Tuple[Path, Path]:
+    """Shuffle and split without parsing JSON or holding entries in memory.
+    
+    Only the line offsets are shuffled (with the same permutation that
+    `shuffle_and_split_dataset` applies to its entries), then the raw line
+    bytes are copied into the splits. For valid JSONL already in
+    `json.dumps(..., ensure_ascii=False)` form the output is identical to the
+    in-memory path.
+    
+    Compressed input can't seek back cheaply, so its raw lines are held in
+    memory instead of offsets (still unparsed; use the hash split to stay
+    out of core).
+    """
+    if dataset_io.is_compressed(dataset_path):
+        print(f"🔄 Reading compressed dataset from: {dataset_path}")
+        offsets = read_raw_lines(dataset_path, line_filter)
+        print(f"✅ Read {len(offsets)} entries total")
+    else:
+        print(f"🔄 Indexing dataset from: {dataset_path}")
+        offsets = index_line_offsets(dataset_path, line_filter)
+        print(f"✅ Indexed {len(offsets)} entries total")
+    
+    with instrumentation.span("shuffle"):
+        random.Random(seed).shuffle(offsets)
+    instrumentation.count("lines", len(offsets))
+    print("🔀 Dataset shuffled!")
+    
+    split_idx = int(len(offsets) * CONFIG["train_split"])
+    print(f"📊 Split: {split_idx} train, {len(offsets) - split_idx} validation")
+    
+    train_path, val_path = split_paths(output_dir, compress)
+    
+    if isinstance(offsets, list):
+        write_lines(offsets[:split_idx], train_path)
+        write_lines(offsets[split_idx:], val_path)
+    else:
+        with open(dataset_path, 'rb') as src:
+            copy_lines(src, offsets[:split_idx], train_path)
+            copy_lines(src, offsets[split_idx:], val_path)
     
+    report_saved_splits(train_path, val_path, split_idx, len(offsets) - split_idx)
+    return train_path, val_path
+
+def read_raw_lines(dataset_path: str, line_filter: Optional[Callable[[bytes, int], bool]] = None) -> List[bytes]:
+    """Every non-blank raw line that passes `line_filter`, as in `index_line_offsets`."""
+    lines = []
+    with instrumentation.span("read"), dataset_io.open_dataset(dataset_path) as f:
+        for line_num, line in enumerate(f, 1):
+            keep = line_filter(line, line_num) if line_filter else True
+            if keep and line.strip():
+                lines.append(line)
+            
+            if line_num % 1000 == 0:
+                print(f"  Read {line_num} lines...")
+    return lines
+
+def copy_lines(src, offsets: array, dest_path: Path):
+    """Copy the raw lines starting at `offsets` from `src` into `dest_path`."""
+    with instrumentation.span("write", file=dest_path.name), dataset_io.open_dataset(dest_path, 'wb') as dest:
+        for offset in offsets:
+            src.seek(offset)
+            line = src.readline()
+            dest.write(line if line.endswith(b'\n') else line + b'\n')
+
+def write_lines(lines: List[bytes], dest_path: Path):
+    """Write raw lines into `dest_path`, newline-terminated."""
+    with instrumentation.span("write", file=dest_path.name), dataset_io.open_dataset(dest_path, 'wb') as dest:
+        for line in lines:
+            dest.write(line if line.endswith(b'\n') else line + b'\n')
+
+def hash_split_fraction(line: bytes, seed: int, key_field: Optional[str] = None) -> Optional[float]:
+    """Map an entry to a stable number in [0, 1) from its content or key field.
+    
+    None for lines that aren't JSON objects, which the in-memory split drops too.
+    """
+    data = line.strip()
+    entry = codec.loads(data)
+    if not isinstance(entry, dict):
+        return None
+    if key_field:
+        value = entry.get(key_field)
+        if value is not None:
+            data = json.dumps(value, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    digest = hashlib.blake2b(f"{seed}:".encode() + data, digest_size=8).digest()
+    return int.from_bytes(digest, 'big') / 2**64
+
+def hash_split_dataset(dataset_path: str, output_dir: str, seed: int = 42,
+                       key_field: Optional[str] = None, append: bool = False,
+                       line_filter: Optional[Callable[[bytes, int], bool]] = None,
+                       compress: Optional[str] = None) -> Tuple[Path, Path]:
+    """Assign every entry to train/valid by a stable hash instead of shuffle order.
+    
+    Membership of an entry never depends on the rest of the dataset, so with
+    `append=True` only the lines past the offset recorded in the split
+    manifest are read and appended to the existing splits.
+    """
+    output_path = Path(output_dir)
+    train_path, val_path = split_paths(output_path, compress)
+    manifest_path = output_path / SPLIT_MANIFEST
+    
+    params = {"strategy": "hash", "seed": seed, "key_field": key_field,
+              "train_split": CONFIG["train_split"], "compress": compress}
+    manifest = {"params": params, "sources": {}, "train_entries": 0, "val_entries": 0, "skipped_lines": 0}
+    
+    source_key = str(Path(dataset_path).resolve())
+    start = 0
+    first_line = 1
+    if append:
+        if not manifest_path.exists():
+            raise ValueError(f"No {SPLIT_MANIFEST} in {output_path} to append to")
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        # Manifests from before compressed splits and skip counts existed
+        manifest["params"].setdefault("compress", None)
+        manifest.setdefault("skipped_lines", 0)
+        if manifest["params"] != params:
+            raise ValueError(f"Split parameters differ from {manifest_path}: {manifest['params']}")
+        source = manifest["sources"].get(source_key)
+        if source is None:
+            source = adopt_moved_source(manifest["sources"], source_key, dataset_path)
+        if source:
+            start = source["bytes"]
+            first_line = source.get("line_count", 0) + 1
+            if file_fingerprint(dataset_path, start) != source["fingerprint"]:
+                raise ValueError(f"{dataset_path} changed before byte {start}; re-run without --append")
+    
+    print(f"🔄 Hash-splitting dataset from: {dataset_path} (from byte {start})")
+    
+    mode = 'ab' if append else 'wb'
+    if append:
+        # Never append through a link into the preparation cache
+        unshare_file(train_path)
+        unshare_file(val_path)
+    train_count = val_count = skipped = 0
+    next_line = first_line
+    pos = start
+    with instrumentation.span("read"), dataset_io.open_dataset(dataset_path) as src, \
+            dataset_io.open_dataset(train_path, mode) as train_f, \
+            dataset_io.open_dataset(val_path, mode) as val_f:
+        if start:
+            dataset_io.seek_forward(src, start)
+        for line_num, line in enumerate(src, first_line):
+            pos += len(line)
+            next_line = line_num + 1
+            if line_num % 1000 == 0:
+                print(f"  Split {line_num} lines...")
+            
+            keep = line_filter(line, line_num) if line_filter else True
+            if not (keep and line.strip()):
+                continue
+            if not line.endswith(b'\n'):
+                line += b'\n'
+            
+            try:
+                with instrumentation.span("hash"):
+                    fraction = hash_split_fraction(line, seed, key_field)
+            except codec.DecodeError as e:
+                print(f"⚠️  Error parsing line {line_num}: {e}")
+                skipped += 1
+                continue
+            if fraction is None:
+                print(f"⚠️  Line {line_num} is not a JSON object, skipping")
+                skipped += 1
+                continue
+            
+            if fraction < CONFIG["train_split"]:
+                train_f.write(line)
+                train_count += 1
+            else:
+                val_f.write(line)
+                val_count += 1
+    
+    instrumentation.count("lines", next_line - first_line)
+    instrumentation.count("bytes", pos - start)
+    source = manifest["sources"].setdefault(source_key, {"lines": 0, "train_entries": 0, "val_entries": 0})
+    source["skipped_lines"] = source.get("skipped_lines", 0) + skipped
+    source["line_count"] = next_line - 1
+    source["bytes"] = pos
+    source["fingerprint"] = file_fingerprint(dataset_path, pos)
+    source["lines"] += train_count + val_count
+    source["train_entries"] += train_count
+    source["val_entries"] += val_count
+    source["updated"] = datetime.now().isoformat()
+    manifest["train_entries"] += train_count
+    manifest["val_entries"] += val_count
+    manifest["skipped_lines"] += skipped
+    write_json_atomic(manifest_path, manifest)
+    
+    print(f"📊 Split: +{train_count} train, +{val_count} validation "
+          f"({manifest['train_entries']} / {manifest['val_entries']} total)")
+    
+    if skipped:
+        print(f"⚠️  Skipped {skipped} lines that aren't JSON objects")
+    
+    report_saved_splits(train_path, val_path, manifest["train_entries"], manifest["val_entries"],
+                        manifest["skipped_lines"], merge=append)
+    return train_path, val_path
+
+def adopt_moved_source(sources: Dict[str, Dict], source_key: str, dataset_path: str) -> Optional[Dict]:
+    """Re-key a recorded source whose split prefix `dataset_path` starts with.
+    
+    Sources are keyed by resolved path, so the same file moved, or a split
+    restored from the prep cache that another path filled, would otherwise
+    be appended again from byte 0.
+    """
+    for key, source in list(sources.items()):
+        try:
+            matches = file_fingerprint(dataset_path, source["bytes"]) == source["fingerprint"]
+        except (OSError, EOFError):
+            continue
+        if matches:
+            print(f"♻️  {dataset_path} continues the source split from {key}")
+            sources[source_key] = sources.pop(key)
+            return sources[source_key]
+    return None
+
+def file_fingerprint(file_path: str, end: int) -> str:
+    """Hash the bytes just before `end` to detect edits to an already-split prefix.
+    
+    For compressed sources offsets count decompressed bytes.
+    """
+    start = max(0, end - APPEND_FINGERPRINT_BYTES)
+    with dataset_io.open_dataset(file_path) as f:
+        dataset_io.seek_forward(f, start)
+        return hashlib.sha256(f.read(end - start)).hexdigest()
+
+def write_json_atomic(path: Path, data: Dict):
+    """Write JSON to a temp file and rename it into place."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+def report_saved_splits(train_path: Path, val_path: Path, train_count: int, val_count: int,
+                        skipped: int = 0, merge: bool = False) -> Dict:
+    """Print where the splits went and record them in the dataset manifest.
+    
+    The manifest holds entry counts and checksums so the trainer doesn't have
+    to recount the split files, and how many input lines weren't JSON objects.
+    With `merge` (appends) the keys earlier runs and tools wrote are kept.
+    """
     print(f"💾 Saved train data to: {train_path}")
     print(f"💾 Saved validation data to: {val_path}")
     
@@ -122,15 +433,136 @@ def save_split_datasets(train_data: List[Dict], val_data: List[Dict], output_dir
     print(f"🔐 Train checksum: {train_checksum}")
     print(f"🔐 Validation checksum: {val_checksum}")
     
-    return train_path, val_path
+    manifest = {
+        "train_file": train_path.name,
+        "valid_file": val_path.name,
+        "train_entries": train_count,
+        "val_entries": val_count,
+        "skipped_lines": skipped,
+        "checksums": {train_path.name: train_checksum, val_path.name: val_checksum},
+        "created": datetime.now().isoformat(),
+    }
+    manifest_path = train_path.parent / DATASET_MANIFEST
+    if merge and manifest_path.exists():
+        with open(manifest_path, 'r') as f:
+            manifest = {**json.load(f), **manifest}
+    write_json_atomic(manifest_path, manifest)
+    return manifest
+
+def merge_validation(previous: Dict, current: Dict) -> Dict:
+    """Validation summary of an appended split: the earlier runs' counts plus this one's."""
+    merged = {key: previous.get(key, 0) + value for key, value in current.items() if key != "error_types"}
+    error_types = Counter(previous.get("error_types", {}))
+    error_types.update(current["error_types"])
+    merged["error_types"] = dict(error_types.most_common())
+    return merged
 
 def calculate_checksum(file_path: Path) -> str:
     """Calculate SHA256 checksum of a file."""
+    return file_sha256(file_path)[:16]
+
+def file_sha256(file_path: Path) -> str:
+    """Full SHA256 hex digest, read in large blocks into a reused buffer."""
     sha256_hash = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()[:16]
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with instrumentation.span("hash", file=Path(file_path).name), open(file_path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            sha256_hash.update(view[:n])
+    return sha256_hash.hexdigest()
+
+def prep_cache_key(dataset_sha256: str, args: argparse.Namespace) -> str:
+    """Cache key over everything that determines the split artifacts."""
+    strategy = "hash" if args.split_strategy == "hash" else ("stream" if args.stream or args.validate else "shuffle")
+    key_data = {
+        "input_sha256": dataset_sha256,
+        "strategy": strategy,
+        "seed": args.seed,
+        "split_key": args.split_key if strategy == "hash" else None,
+        # Only the in-memory shuffle re-encodes entries, and orjson parses big integers as floats
+        "json_backend": codec.BACKEND if strategy == "shuffle" else None,
+        "validate": args.validate,
+        "compress": args.compress,
+        "columnar": args.columnar,
+        "metadata": args.metadata,
+        "config": {key: CONFIG[key] for key in CACHE_CONFIG_KEYS},
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()[:32]
+
+def restore_from_cache(cache_entry: Path, output_dir: Path) -> Optional[Tuple[Path, Path]]:
+    """Link cached split artifacts into `output_dir`; None on a cache miss."""
+    info_path = cache_entry / CACHE_INFO
+    if not info_path.exists():
+        return None
+    with open(info_path, 'r') as f:
+        info = json.load(f)
+    
+    for name in info["files"]:
+        link_file(cache_entry / name, output_dir / name)
+    
+    with open(output_dir / DATASET_MANIFEST, 'r') as f:
+        manifest = json.load(f)
+    
+    train_path = output_dir / manifest["train_file"]
+    val_path = output_dir / manifest["valid_file"]
+    print(f"♻️  Reusing cached split: {cache_entry}")
+    print(f"💾 Linked train data to: {train_path}")
+    print(f"💾 Linked validation data to: {val_path}")
+    print(f"📊 Split: {manifest['train_entries']} train, {manifest['val_entries']} validation")
+    print(f"🔐 Train checksum: {manifest['checksums'][train_path.name]}")
+    print(f"🔐 Validation checksum: {manifest['checksums'][val_path.name]}")
+    if "validation" in manifest:
+        validation = manifest["validation"]
+        print(f"🔍 Cached validation: {validation['valid_entries']}/{validation['total_entries']} "
+              f"valid entries, {validation['error_count']} errors")
+    return train_path, val_path
+
+def store_in_cache(cache_entry: Path, output_dir: Path):
+    """Hardlink freshly written split artifacts into the cache."""
+    with open(output_dir / DATASET_MANIFEST, 'r') as f:
+        manifest = json.load(f)
+    names = [manifest["train_file"], manifest["valid_file"], SPLIT_MANIFEST, DATASET_MANIFEST]
+    names += manifest.get("columnar", {}).get("files", [])
+    names += manifest.get("metadata", {}).get("files", [])
+    files = [name for name in names if (output_dir / name).exists()]
+    tmp_entry = cache_entry.with_name(cache_entry.name + ".tmp")
+    shutil.rmtree(tmp_entry, ignore_errors=True)
+    tmp_entry.mkdir(parents=True)
+    
+    for name in files:
+        link_file(output_dir / name, tmp_entry / name)
+    info = {"files": files, "created": datetime.now().isoformat()}
+    write_json_atomic(tmp_entry / CACHE_INFO, info)
+    
+    shutil.rmtree(cache_entry, ignore_errors=True)
+    os.replace(tmp_entry, cache_entry)
+    print(f"🗄️  Cached split as: {cache_entry}")
+
+def link_file(src: Path, dest: Path):
+    """Hardlink `src` to `dest`, falling back to a symlink across filesystems."""
+    tmp_dest = dest.with_name(dest.name + ".link")
+    if tmp_dest.is_symlink() or tmp_dest.exists():
+        tmp_dest.unlink()
+    try:
+        os.link(src, tmp_dest)
+    except OSError:
+        os.symlink(Path(src).resolve(), tmp_dest)
+    os.replace(tmp_dest, dest)
+
+def unlink_shared(path: Path):
+    """Remove a file that is hardlinked or symlinked elsewhere."""
+    if path.is_symlink() or (path.exists() and path.stat().st_nlink > 1):
+        path.unlink()
+
+def unshare_file(path: Path):
+    """Replace a hardlinked or symlinked file with a private copy."""
+    if path.is_symlink() or (path.exists() and path.stat().st_nlink > 1):
+        tmp_path = path.with_name(path.name + ".copy")
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, path)
 
 def create_mlx_config(train_path: Path, val_path: Path, output_dir: Path):
     """Create MLX training configuration."""
@@ -225,31 +657,172 @@ def main():
     print("🧠 Qwen3-30B-A3B-Thinking-2507 Training Preparation")
     print("=" * 60)
     
+    parser = argparse.ArgumentParser(description="Prepare Qwen3 thinking training data")
+    parser.add_argument("dataset_path", nargs="?",
+                        help="Path to the dataset .jsonl file (.jsonl.gz / .jsonl.zst are read directly)")
+    parser.add_argument("--validate", action="store_true",
+                        help="Validate every entry in the same pass and keep only valid lines (implies --stream)")
+    parser.add_argument("--max-invalid", type=float, default=None, metavar="FRACTION",
+                        help="Fail when more than this fraction of entries is dropped as invalid (with --validate)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Shuffle line offsets and copy raw lines instead of loading entries into memory")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Shuffle seed")
+    parser.add_argument("--split-strategy", choices=["shuffle", "hash"], default="shuffle",
+                        help="Split by shuffle order or by a stable hash of each entry")
+    parser.add_argument("--split-key", type=str, default=None,
+                        help="Hash this entry field instead of the whole line (hash strategy)")
+    parser.add_argument("--append", action="store_true",
+                        help="Hash-split only lines not yet recorded in the output dir's manifest")
+    parser.add_argument("--output-dir", type=str, default=None,
+                        help="Output directory (default: a new timestamped training run)")
+    parser.add_argument("--cache-dir", type=str, default=str(PREP_CACHE_DIR),
+                        help="Content-addressed cache of prepared splits")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always re-split instead of reusing a cached split")
+    parser.add_argument("--compress", choices=["gz", "zst"], default=None,
+                        help="Write compressed splits (train.jsonl.gz / .zst) for archiving")
+    parser.add_argument("--columnar", choices=dataset_io.COLUMNAR_FORMATS, default=None,
+                        help="Also write a memory-mappable sidecar for O(1) random access "
+                             "(offsets: <split>.jsonl.idx, arrow: <split>.arrow)")
+    parser.add_argument("--metadata", action="store_true",
+                        help="Also build the per-entry metadata index (<split>.meta.npy) used by query_dataset.py "
+                             "and sampling_plan.py; a second parse of every entry")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.setup(args)
+    
     # Check for dataset path argument
-    if len(sys.argv) < 2:
+    if not args.dataset_path:
         print("⚠️  Usage: python qwen3-thinking-prepare.py <path_to_7600_dataset.jsonl>")
         print("   Looking for the 7342-entry megadataset with thinking tags...")
         sys.exit(1)
     
-    dataset_path = sys.argv[1]
+    dataset_path = args.dataset_path
     if not Path(dataset_path).exists():
         print(f"❌ Dataset not found at: {dataset_path}")
         sys.exit(1)
     
+    if args.append and not args.output_dir:
+        print("❌ --append needs the --output-dir of an existing hash split")
+        sys.exit(1)
+    
+    if args.max_invalid is not None and not args.validate:
+        print("❌ --max-invalid needs --validate")
+        sys.exit(1)
+    
+    if args.columnar == "offsets" and args.compress:
+        print("❌ An offsets index needs plain splits, use --columnar arrow with --compress")
+        sys.exit(1)
+    
+    # Offsets into compressed splits don't seek, so those go without an index
+    if args.metadata and args.compress:
+        print("❌ The metadata index needs plain splits, drop --metadata or --compress")
+        sys.exit(1)
+    
     # Create output directory
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_dir = Path(f"/Users/polyversai/training_runs/qwen3_thinking_{timestamp}")
+    if args.output_dir:
+        output_dir = Path(args.output_dir)
+    else:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_dir = TRAINING_RUNS_DIR / f"qwen3_thinking_{timestamp}"
     output_dir.mkdir(parents=True, exist_ok=True)
     
     print(f"📁 Output directory: {output_dir}")
     
+    # Appends mutate the splits in place, so they bypass the cache
+    cache_entry = None
+    restored = None
+    if not (args.no_cache or args.append):
+        print(f"🔐 Hashing input dataset...")
+        cache_entry = Path(args.cache_dir) / prep_cache_key(file_sha256(Path(dataset_path)), args)
+        restored = restore_from_cache(cache_entry, output_dir)
+    
+    # Fresh splits must not write through links into the cache
+    if not (restored or args.append):
+        for name in (SPLIT_MANIFEST, DATASET_MANIFEST):
+            unlink_shared(output_dir / name)
+        for split in ("train", "valid"):
+            for path in output_dir.glob(f"{split}.*"):
+                unlink_shared(path)
+    
+    validator = DatasetValidator(dataset_path) if args.validate else None
+    line_filter = validator.check_line if validator else None
+    
     # Process dataset
-    train_data, val_data = shuffle_and_split_dataset(dataset_path)
-    train_path, val_path = save_split_datasets(train_data, val_data, output_dir)
+    if restored:
+        train_path, val_path = restored
+    elif args.split_strategy == "hash" or args.append:
+        try:
+            train_path, val_path = hash_split_dataset(dataset_path, output_dir, args.seed,
+                                                      args.split_key, args.append, line_filter,
+                                                      args.compress)
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+    elif args.stream or args.validate:
+        train_path, val_path = stream_shuffle_and_split(dataset_path, output_dir, args.seed,
+                                                        line_filter, args.compress)
+    else:
+        train_data, val_data, skipped = shuffle_and_split_dataset(dataset_path, args.seed)
+        train_path, val_path = save_split_datasets(train_data, val_data, output_dir, args.compress, skipped)
+    
+    manifest_updates = {}
+    validation = None
+    if validator and not restored:
+        validator.print_report()
+        validation = validator.summary()
+        if args.append:
+            with open(output_dir / DATASET_MANIFEST, 'r') as f:
+                validation = merge_validation(json.load(f).get("validation", {}), validation)
+        manifest_updates["validation"] = validation
+    elif validator:
+        # A cached split was validated when it was made, its counts are in the manifest
+        with open(output_dir / DATASET_MANIFEST, 'r') as f:
+            validation = json.load(f).get("validation")
+    
+    if validation:
+        total, invalid = validation["total_entries"], validation["invalid_entries"]
+        print(f"🗑️  Dropped {invalid} of {total} entries that failed validation")
+        if args.max_invalid is not None and total and invalid / total > args.max_invalid:
+            print(f"❌ {invalid / total:.1%} of entries are invalid, above --max-invalid {args.max_invalid:.1%}")
+            sys.exit(1)
+    
+    if args.columnar and not restored:
+        try:
+            with instrumentation.span("columnar"):
+                sidecars = [dataset_io.write_columnar(path, args.columnar) for path in (train_path, val_path)]
+        except ImportError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        for sidecar in sidecars:
+            print(f"💾 Saved {args.columnar} sidecar to: {sidecar}")
+        manifest_updates["columnar"] = {"format": args.columnar, "files": [path.name for path in sidecars]}
+    
+    if args.metadata and not restored:
+        files = []
+        for path in (train_path, val_path):
+            with instrumentation.span("metadata", file=path.name):
+                meta, info = build_metadata(path, os.cpu_count() or 1)
+            files += [save_metadata(path, meta, info).name, meta_info_path(path).name]
+            print(f"🗂️  Indexed {info['entries']} entries of {path.name}")
+        manifest_updates["metadata"] = {"files": files}
+    
+    if manifest_updates:
+        manifest_path = output_dir / DATASET_MANIFEST
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        manifest.update(manifest_updates)
+        write_json_atomic(manifest_path, manifest)
+    
+    if cache_entry and not restored:
+        store_in_cache(cache_entry, output_dir)
     
     # Create configurations
     config_path = create_mlx_config(train_path, val_path, output_dir)
     launch_script = create_launch_script(config_path, output_dir)
+    if args.compress:
+        print(f"⚠️  mlx_lm reads plain JSONL, decompress the splits before training from them")
     
     print("\n" + "=" * 60)
     print("✅ PREPARATION COMPLETE! Ready for takeoff!")
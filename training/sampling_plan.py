@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Sampling Scheduler for the Qwen3 Trainer
+Turns the per-entry metadata index into an iteration plan (entry index per
+training sample) with weighting, stratified mixes, per-source caps,
+dedup-aware weights and a length curriculum, without reading the JSONL
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from dataset_meta import load_metadata
+from tokenize_dataset import DATASET_MANIFEST, file_signature, matches_signature, update_dataset_manifest
+
+FIELDS = ("language", "source", "has_think")
+PLAN_SUFFIX = ".plan.npy"
+CAP_ITERATIONS = 20
+
+def plan_path(split_path: Path) -> Path:
+    """`train.jsonl` -> `train.plan.npy`."""
+    split_path = Path(split_path)
+    return split_path.with_name(split_path.name.split(".")[0] + PLAN_SUFFIX)
+
+def check_plan(plan_file: Path, split_path: Path):
+    """Raise ValueError unless the manifest records `plan_file` as built from `split_path` as it is now."""
+    plan_file, split_path = Path(plan_file), Path(split_path)
+    manifest_path = split_path.parent / DATASET_MANIFEST
+    plan = {}
+    if manifest_path.exists():
+        with open(manifest_path, 'r') as f:
+            plan = json.load(f).get("plan") or {}
+    if plan.get("file") != plan_file.name or "split" not in plan:
+        raise ValueError(f"{manifest_path} has no record of the {split_path.name} {plan_file.name} was built from, "
+                         f"rebuild it with sampling_plan.py")
+    if not matches_signature(split_path, plan["split"]):
+        raise ValueError(f"{split_path.name} changed after {plan_file.name} was built, rebuild it with sampling_plan.py")
+
+def field_value(field: str, value: str, info: Dict) -> int:
+    """The stored code of a FIELD=VALUE selector."""
+    if field == "has_think":
+        return int(value.lower() in ("1", "true", "yes"))
+    names = info["languages" if field == "language" else "sources"]
+    if value not in names:
+        raise ValueError(f"No entries with {field}={value} (have: {', '.join(names)})")
+    return names.index(value)
+
+def parse_assignments(specs: List[str], info: Dict, field: Optional[str] = None) -> List[Tuple[str, int, float]]:
+    """'language=polish:2' -> ('language', code, 2.0); with `field` set, 'polish=0.5' works too."""
+    parsed = []
+    for spec in specs:
+        selector, sep, number = spec.rpartition(":" if field is None else "=")
+        if not sep:
+            raise ValueError(f"Can't parse {spec!r}")
+        if field is None:
+            name, sep, value = selector.partition("=")
+            if not sep or name not in FIELDS:
+                raise ValueError(f"Can't parse {spec!r}, expected FIELD=VALUE:NUMBER with FIELD in {', '.join(FIELDS)}")
+        else:
+            name, value = field, selector
+        parsed.append((name, field_value(name, value, info), float(number)))
+    return parsed
+
+def entry_weights(meta: np.ndarray, weights: List[Tuple[str, int, float]], dedup: bool,
+                  max_tokens: Optional[int]) -> np.ndarray:
+    """Relative sampling weight of every entry; 0 for entries that can't be drawn."""
+    w = meta["parsed"].astype(np.float64)
+    if max_tokens:
+        w[meta["tokens"] > max_tokens] = 0.0
+    for field, value, factor in weights:
+        w[meta[field] == value] *= factor
+    if dedup:
+        # Near-duplicates share one entry's worth of weight
+        _, inverse, sizes = np.unique(meta["cluster"], return_inverse=True, return_counts=True)
+        w /= sizes[inverse]
+    return w
+
+def largest_remainder(shares: np.ndarray, total: int) -> np.ndarray:
+    """Integer counts summing to `total`, proportional to `shares`."""
+    if shares.sum() <= 0:
+        return np.zeros(len(shares), dtype=np.int64)
+    exact = shares / shares.sum() * total
+    counts = np.floor(exact).astype(np.int64)
+    counts[np.argsort(counts - exact)[:total - counts.sum()]] += 1
+    return counts
+
+def stratum_quotas(strata: np.ndarray, w: np.ndarray, total: int, mix: Dict[int, float]) -> Dict[int, int]:
+    """Draws per stratum: the --mix shares, unlisted strata split what's left by weight.
+    
+    Without a mix every stratum gets an equal share.
+    """
+    present = [int(s) for s in np.unique(strata[w > 0])]
+    mass = {s: w[strata == s].sum() for s in present}
+    if not mix:
+        shares = np.ones(len(present))
+    else:
+        shares = np.array([mix.get(s, 0.0) for s in present])
+        leftover = 1.0 - shares.sum()
+        unlisted = [i for i, s in enumerate(present) if s not in mix]
+        if leftover > 0 and unlisted:
+            unlisted_mass = sum(mass[present[i]] for i in unlisted)
+            for i in unlisted:
+                shares[i] = leftover * mass[present[i]] / unlisted_mass
+    return dict(zip(present, largest_remainder(shares, total)))
+
+def systematic_counts(w: np.ndarray, total: int, rng: np.random.Generator) -> np.ndarray:
+    """Draw counts proportional to `w`, as even as possible: floor(expected) plus systematic sampling."""
+    counts = np.zeros(len(w), dtype=np.int64)
+    if total <= 0 or w.sum() <= 0:
+        return counts
+    expected = total * w / w.sum()
+    counts[:] = np.floor(expected)
+    remainder = total - int(counts.sum())
+    if remainder > 0:
+        order = rng.permutation(len(w))
+        cumulative = np.cumsum((expected - counts)[order])
+        points = rng.random() + np.arange(remainder)
+        picks = np.minimum(np.searchsorted(cumulative, points, side='right'), len(w) - 1)
+        np.add.at(counts, order[picks], 1)
+    return counts
+
+def allocate(meta: np.ndarray, w: np.ndarray, total: int, stratify: Optional[str], mix: Dict[int, float],
+             caps: Dict[int, int], rng: np.random.Generator) -> np.ndarray:
+    """How many times each entry is drawn.
+    
+    Counts follow the weights within each stratum's quota. Sources over
+    their cap get their weight scaled down and the freed draws go to the
+    other sources, repeated until the caps hold (or nothing else is left).
+    """
+    strata = meta[stratify] if stratify else np.zeros(len(meta), dtype=np.int64)
+    quotas = stratum_quotas(strata, w, total, mix)
+    sources = meta["source"]
+    w = w.copy()
+    for _ in range(CAP_ITERATIONS):
+        counts = np.zeros(len(meta), dtype=np.int64)
+        for stratum, quota in quotas.items():
+            members = np.flatnonzero((strata == stratum) & (w > 0))
+            counts[members] = systematic_counts(w[members], quota, rng)
+        over = {src: cap for src, cap in caps.items() if counts[sources == src].sum() > cap}
+        if not over:
+            return counts
+        for src, cap in over.items():
+            w[sources == src] *= cap / counts[sources == src].sum()
+    # Couldn't satisfy caps and quotas together: the caps win, the plan gets shorter
+    for src, cap in caps.items():
+        members = np.flatnonzero((sources == src) & (counts > 0))
+        excess = int(counts[members].sum()) - cap
+        if excess > 0:
+            drops = rng.choice(np.repeat(members, counts[members]), size=excess, replace=False)
+            np.subtract.at(counts, drops, 1)
+    return counts
+
+def curriculum_order(plan: np.ndarray, lengths: np.ndarray, phases: int, rng: np.random.Generator) -> np.ndarray:
+    """Short entries first: sort by length, cut into `phases`, shuffle inside each phase."""
+    plan = plan[np.argsort(lengths[plan], kind="stable")]
+    for chunk in np.array_split(np.arange(len(plan)), phases):
+        plan[chunk] = plan[chunk][rng.permutation(len(chunk))]
+    return plan
+
+def build_plan(meta: np.ndarray, total: int, weights: List[Tuple[str, int, float]] = (),
+               stratify: Optional[str] = None, mix: Optional[Dict[int, float]] = None,
+               caps: Optional[Dict[int, int]] = None, dedup: bool = True, max_tokens: Optional[int] = None,
+               curriculum: Optional[str] = None, phases: int = 4, seed: int = 42) -> np.ndarray:
+    """Entry index of every training sample, in training order."""
+    rng = np.random.default_rng(seed)
+    w = entry_weights(meta, list(weights), dedup, max_tokens)
+    if not (w > 0).any():
+        raise ValueError("No entries left to sample after weighting and filtering")
+    counts = allocate(meta, w, total, stratify, mix or {}, caps or {}, rng)
+    plan = rng.permutation(np.repeat(np.arange(len(meta)), counts)).astype(np.uint32)
+    if curriculum == "length":
+        lengths = meta["tokens"] if meta["tokens"].any() else meta["chars"]
+        plan = curriculum_order(plan, np.asarray(lengths), phases, rng)
+    return plan
+
+def plan_summary(plan: np.ndarray, meta: np.ndarray, info: Dict, w: np.ndarray) -> Dict:
+    drawn = meta[plan]
+    unique = np.unique(plan)
+    eligible = int((w > 0).sum())
+    
+    def shares(column: str, names: List[str]) -> Dict[str, float]:
+        counts = np.bincount(drawn[column], minlength=len(names))
+        return {names[i]: round(float(n) / len(plan), 4) for i, n in enumerate(counts) if n}
+    
+    summary = {
+        "samples": int(len(plan)),
+        "unique_entries": int(len(unique)),
+        "eligible_entries": eligible,
+        "coverage": round(len(unique) / eligible, 4) if eligible else 0.0,
+        "max_repeats": int(np.bincount(plan).max()) if len(plan) else 0,
+        "think_share": round(float(drawn["has_think"].mean()), 4) if len(plan) else 0.0,
+        "languages": shares("language", info["languages"]),
+        "sources": shares("source", info["sources"]),
+    }
+    if info.get("tokens") and len(plan):
+        summary["tokens"] = int(drawn["tokens"].sum())
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an iteration plan over the train split from its metadata index")
+    parser.add_argument("data_dir", help="Directory with train.jsonl and train.meta.npy (see dataset_meta.py)")
+    parser.add_argument("--steps", type=int, default=1000,
+                        help="Training steps the plan covers")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Entries per step")
+    parser.add_argument("--weight", nargs="+", default=[], metavar="FIELD=VALUE:FACTOR",
+                        help="Multiply sampling weights, e.g. language=polish:2 has_think=0:0 source=forum:0.5")
+    parser.add_argument("--stratify", choices=FIELDS, default=None,
+                        help="Give every value of this field a fixed share of the samples")
+    parser.add_argument("--mix", nargs="+", default=[], metavar="VALUE=SHARE",
+                        help="Shares for --stratify (default: equal); unlisted values split the rest by weight")
+    parser.add_argument("--source-cap", nargs="+", default=[], metavar="SOURCE=N",
+                        help="At most N samples from a source")
+    parser.add_argument("--max-source-share", type=float, default=None,
+                        help="At most this fraction of the samples from any one source")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Don't split weight across dedup clusters (train.clusters.npy)")
+    parser.add_argument("--max-tokens", type=int, default=None,
+                        help="Never draw entries longer than this (needs token counts)")
+    parser.add_argument("--curriculum", choices=["none", "length"], default="none",
+                        help="length: shortest entries first, in shuffled phases")
+    parser.add_argument("--curriculum-phases", type=int, default=4,
+                        help="Length phases of the curriculum")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Sampling seed")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Plan file (default: <data_dir>/train.plan.npy)")
+    args = parser.parse_args()
+    
+    data_dir = Path(args.data_dir)
+    split_path = data_dir / "train.jsonl"
+    if args.mix and not args.stratify:
+        print("❌ --mix needs --stratify")
+        sys.exit(1)
+    try:
+        meta, info = load_metadata(split_path)
+        meta = np.asarray(meta)
+        weights = parse_assignments(args.weight, info)
+        mix = {code: share for _, code, share in parse_assignments(args.mix, info, args.stratify)} if args.mix else {}
+        caps = {code: int(n) for _, code, n in parse_assignments(args.source_cap, info, "source")}
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if args.max_tokens and not info.get("tokens"):
+        print("❌ --max-tokens needs token counts: run tokenize_dataset.py, then dataset_meta.py again")
+        sys.exit(1)
+    
+    total = args.steps * args.batch_size
+    if args.max_source_share is not None:
+        share_cap = int(args.max_source_share * total)
+        for code in range(len(info["sources"])):
+            caps[code] = min(caps.get(code, share_cap), share_cap)
+    
+    print("🎲 Sampling Plan")
+    print("=" * 60)
+    print(f"📁 {split_path} ({len(meta)} entries)")
+    print(f"📊 {args.steps} steps x {args.batch_size} = {total} samples")
+    
+    try:
+        plan = build_plan(meta, total, weights, args.stratify, mix, caps, dedup=not args.no_dedup,
+                          max_tokens=args.max_tokens, curriculum=args.curriculum,
+                          phases=args.curriculum_phases, seed=args.seed)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    w = entry_weights(meta, weights, not args.no_dedup, args.max_tokens)
+    summary = plan_summary(plan, meta, info, w)
+    if len(plan) < total:
+        print(f"⚠️  Source caps leave only {len(plan)} samples; the trainer will cycle through the plan")
+    
+    print(f"  Unique entries: {summary['unique_entries']} of {summary['eligible_entries']} eligible "
+          f"({summary['coverage']*100:.1f}% coverage, up to {summary['max_repeats']}x repeats)")
+    print(f"  <think> share: {summary['think_share']*100:.1f}%")
+    print(f"  Languages: {summary['languages']}")
+    print(f"  Sources: {dict(list(summary['sources'].items())[:10])}")
+    
+    out_path = Path(args.output) if args.output else plan_path(split_path)
+    np.save(out_path, plan)
+    update_dataset_manifest(data_dir, {"plan": {
+        "file": out_path.name,
+        # Lets the trainer tell whether the plan's entry numbers still fit the split
+        "split": file_signature(split_path),
+        "params": {"steps": args.steps, "batch_size": args.batch_size, "weight": args.weight,
+                   "stratify": args.stratify, "mix": args.mix, "source_cap": args.source_cap,
+                   "max_source_share": args.max_source_share, "dedup": not args.no_dedup,
+                   "max_tokens": args.max_tokens, "curriculum": args.curriculum,
+                   "curriculum_phases": args.curriculum_phases, "seed": args.seed},
+        **summary,
+    }})
+    print(f"💾 Saved plan to: {out_path} ({out_path.stat().st_size / 1024:.0f} KB)")
+    print("\n" + "=" * 60)
+    print("✅ Plan ready! Train with: mlx_train_qwen3.py ... --plan " + str(out_path))
+
+if __name__ == "__main__":
+    main()
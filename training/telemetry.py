@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Resource Telemetry for Training Runs
+Samples RSS, CPU and system memory on a background thread and writes a
+JSONL time series with iteration timing (it/s, tokens/s, step time) attached.
+Uses psutil when installed, else /proc on Linux and ps/vm_stat on macOS
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+TELEMETRY_FILE = "telemetry.jsonl"
+DEFAULT_INTERVAL = 5.0
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+# ru_maxrss is in bytes on macOS and in kilobytes on Linux
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+MB = 1 << 20
+
+def _proc_stat(pid: int) -> Optional[List[str]]:
+    """Fields of /proc/<pid>/stat after the command name, None without /proc."""
+    try:
+        with open(f"/proc/{pid}/stat", 'r') as f:
+            return f.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+
+def _ps(columns: List[str], pid: Optional[int] = None) -> List[List[str]]:
+    """Rows of `ps -o` columns for one process or all of them; the fallback without /proc."""
+    command = ["ps", "-o", ",".join(f"{column}=" for column in columns)]
+    command += ["-p", str(pid)] if pid is not None else ["-A"]
+    try:
+        output = subprocess.run(command, capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return []
+    return [line.split() for line in output.splitlines() if line.strip()]
+
+def _ps_seconds(text: str) -> float:
+    """`ps` CPU time, `[[dd-]hh:]mm:ss[.cc]`, in seconds."""
+    days, _, clock = text.rpartition("-")
+    seconds = 0.0
+    for part in clock.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds + int(days or 0) * 86400
+
+def process_tree(pid: int) -> List[int]:
+    """`pid` and all of its descendants."""
+    if psutil:
+        try:
+            return [pid] + [child.pid for child in psutil.Process(pid).children(recursive=True)]
+        except psutil.Error:
+            return [pid]
+    children = {}
+    try:
+        entries = [entry for entry in os.listdir("/proc") if entry.isdigit()]
+    except OSError:
+        entries = None
+    if entries is None:
+        for row in _ps(["pid", "ppid"]):
+            if len(row) == 2 and row[0].isdigit() and row[1].isdigit():
+                children.setdefault(int(row[1]), []).append(int(row[0]))
+    else:
+        for entry in entries:
+            fields = _proc_stat(int(entry))
+            if fields:
+                children.setdefault(int(fields[1]), []).append(int(entry))
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children.get(parent, []))
+    return tree
+
+def process_rss(pid: int) -> Optional[int]:
+    """Current resident set size in bytes (psutil, /proc, then ps); None when unknown."""
+    if psutil:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/statm", 'r') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        pass
+    rows = _ps(["rss"], pid)
+    # ps reports kilobytes
+    return int(rows[0][0]) * 1024 if rows and rows[0][0].isdigit() else None
+
+def process_cpu_seconds(pid: int) -> Optional[float]:
+    """User + system CPU time of a process in seconds; None when unknown."""
+    if pid == os.getpid():
+        times = os.times()
+        return times.user + times.system
+    if psutil:
+        try:
+            times = psutil.Process(pid).cpu_times()
+            return times.user + times.system
+        except psutil.Error:
+            return None
+    fields = _proc_stat(pid)
+    if fields:
+        # utime and stime are fields 14 and 15 of stat, counted from the pid
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    rows = _ps(["time"], pid)
+    try:
+        return _ps_seconds(rows[0][0]) if rows else None
+    except ValueError:
+        return None
+
+def system_memory() -> Dict[str, Optional[int]]:
+    """Total and available system memory in bytes (available is None if unknown)."""
+    if psutil:
+        memory = psutil.virtual_memory()
+        return {"total": memory.total, "available": memory.available}
+    try:
+        meminfo = {}
+        with open("/proc/meminfo", 'r') as f:
+            for line in f:
+                key, value = line.split(":", 1)
+                meminfo[key] = int(value.split()[0]) * 1024
+        return {"total": meminfo["MemTotal"], "available": meminfo.get("MemAvailable")}
+    except (OSError, KeyError, ValueError):
+        pass
+    total = os.sysconf("SC_PHYS_PAGES") * PAGE_SIZE if hasattr(os, "sysconf") else None
+    return {"total": total, "available": vm_stat_available()}
+
+def vm_stat_available() -> Optional[int]:
+    """Free plus inactive pages from macOS's vm_stat (what psutil calls available); None elsewhere."""
+    try:
+        output = subprocess.run(["vm_stat"], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    page_size = PAGE_SIZE
+    pages = {}
+    for line in output.splitlines():
+        if "page size of" in line:
+            page_size = int(line.split("page size of")[1].split()[0])
+        elif ":" in line:
+            key, value = line.split(":", 1)
+            pages[key.strip()] = value.strip().rstrip(".")
+    try:
+        return (int(pages["Pages free"]) + int(pages["Pages inactive"])) * page_size
+    except (KeyError, ValueError):
+        return None
+
+def peak_rss() -> Optional[int]:
+    """Peak RSS of this process in bytes."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT
+
+def _mb(value: Optional[int]) -> Optional[float]:
+    return round(value / MB, 1) if value is not None else None
+
+class TelemetrySampler:
+    """Background thread appending resource samples to a JSONL time series.
+    
+    The training loop reports progress through `record_step` (cumulative
+    step and token counts plus any metrics such as loss); every sample then
+    carries the iteration rate, token rate and step time since the previous
+    sample next to RSS, CPU use and system memory headroom. `extra` adds
+    backend metrics (e.g. accelerator memory) and `on_sample` sees every
+    written sample.
+    """
+    
+    def __init__(self, output_path: Path, interval: float = DEFAULT_INTERVAL, pid: Optional[int] = None,
+                 include_children: bool = False, extra: Optional[Callable[[], Dict]] = None,
+                 on_sample: Optional[Callable[[Dict], None]] = None):
+        self.output_path = Path(output_path)
+        self.interval = interval
+        self.pid = pid or os.getpid()
+        self.include_children = include_children
+        self.extra = extra
+        self.on_sample = on_sample
+        self.start_time = time.time()
+        
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._file = None
+        self._step = 0
+        self._tokens = 0
+        self._step_time = time.perf_counter()
+        self._metrics = {}
+        # Counters as of the previous sample
+        self._last = {"time": time.perf_counter(), "step": 0, "tokens": 0, "step_time": self._step_time,
+                      "cpu": self._cpu_seconds()}
+    
+    def _pids(self) -> List[int]:
+        if not self.include_children:
+            return [self.pid]
+        # Watching a parent (the launcher's shell) also finds this sampler, which isn't the run's usage
+        own = os.getpid()
+        return [pid for pid in process_tree(self.pid) if pid != own or pid == self.pid]
+    
+    def _cpu_seconds(self) -> Optional[float]:
+        seconds = [process_cpu_seconds(pid) for pid in self._pids()]
+        known = [s for s in seconds if s is not None]
+        return sum(known) if known else None
+    
+    def record_step(self, step: int, tokens: int = 0, **metrics):
+        """Report training progress: cumulative steps and tokens, latest metrics."""
+        with self._lock:
+            self._step = step
+            self._tokens = tokens
+            self._step_time = time.perf_counter()
+            self._metrics.update(metrics)
+    
+    def sample(self) -> Dict:
+        """Take one sample now (also what the thread writes every interval)."""
+        now = time.perf_counter()
+        rss_values = [process_rss(pid) for pid in self._pids()]
+        known_rss = [rss for rss in rss_values if rss is not None]
+        memory = system_memory()
+        cpu = self._cpu_seconds()
+        
+        with self._lock:
+            step, tokens, step_time = self._step, self._tokens, self._step_time
+            metrics = dict(self._metrics)
+        last = self._last
+        wall = now - last["time"]
+        step_window = step_time - last["step_time"]
+        steps = step - last["step"]
+        
+        record = {
+            "time": datetime.now().isoformat(),
+            "elapsed_s": round(time.time() - self.start_time, 3),
+            "rss_mb": _mb(sum(known_rss)) if known_rss else None,
+            "peak_rss_mb": _mb(peak_rss()) if self.pid == os.getpid() else None,
+            "cpu_percent": round((cpu - last["cpu"]) / wall * 100, 1) if cpu is not None and last["cpu"] is not None and wall > 0 else None,
+            "system_total_mb": _mb(memory["total"]),
+            "system_available_mb": _mb(memory["available"]),
+            "step": step,
+            "tokens": tokens,
+            "it_per_s": round(steps / step_window, 4) if steps and step_window > 0 else 0.0,
+            "tokens_per_s": round((tokens - last["tokens"]) / step_window, 1) if steps and step_window > 0 else 0.0,
+            "step_time_s": round(step_window / steps, 4) if steps else None,
+            **metrics,
+        }
+        if self.extra:
+            record.update(self.extra())
+        self._last = {"time": now, "step": step, "tokens": tokens, "step_time": step_time, "cpu": cpu}
+        return record
+    
+    def write_sample(self) -> Dict:
+        record = self.sample()
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        if self.on_sample:
+            self.on_sample(record)
+        return record
+    
+    def start(self) -> "TelemetrySampler":
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        # Append, so a resumed run continues the same series
+        self._file = open(self.output_path, 'a')
+        self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self._thread.start()
+        return self
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write_sample()
+    
+    def stop(self):
+        """Stop the thread and write a final sample."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.write_sample()
+        self._file.close()
+    
+    def __enter__(self) -> "TelemetrySampler":
+        return self.start()
+    
+    def __exit__(self, *exc):
+        self.stop()
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def format_sample(record: Dict) -> str:
+    """One-line summary of a sample for logs."""
+    parts = [f"📊 [{record['time'][11:19]}]"]
+    if record["rss_mb"] is not None:
+        parts.append(f"RSS {record['rss_mb']:.0f} MB")
+    if record["cpu_percent"] is not None:
+        parts.append(f"CPU {record['cpu_percent']:.0f}%")
+    if record["system_available_mb"] is not None:
+        parts.append(f"free {record['system_available_mb']:.0f}/{record['system_total_mb']:.0f} MB")
+    elif record["system_total_mb"] is not None:
+        parts.append(f"total {record['system_total_mb']:.0f} MB")
+    if record["step"]:
+        parts.append(f"step {record['step']} ({record['it_per_s']:.2f} it/s, {record['tokens_per_s']:.0f} tok/s)")
+    return "  ".join(parts)
+
+def main():
+    parser = argparse.ArgumentParser(description="Record resource telemetry of a running process tree")
+    parser.add_argument("--pid", type=int, default=None,
+                        help="Process to watch, with its children (default: this process)")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+                        help="Seconds between samples")
+    parser.add_argument("--output", type=str, default=TELEMETRY_FILE,
+                        help="JSONL file to append samples to")
+    parser.add_argument("--quiet", action="store_true",
+                        help="Don't print a line per sample")
+    parser.add_argument("--once", action="store_true",
+                        help="Print one sample of the watched process (or just system memory) and exit")
+    args = parser.parse_args()
+    
+    if args.once:
+        record = TelemetrySampler(Path(args.output), pid=args.pid, include_children=True).sample()
+        if not args.pid:
+            record["rss_mb"] = record["cpu_percent"] = None
+        print(format_sample(record))
+        return
+    
+    on_sample = None if args.quiet else lambda record: print(format_sample(record), flush=True)
+    sampler = TelemetrySampler(Path(args.output), args.interval, pid=args.pid,
+                               include_children=True, on_sample=on_sample)
+    sampler.start()
+    # The launcher stops us with kill; exit through `finally` to write the last sample
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        # Until the watched process exits (or Ctrl-C)
+        while args.pid is None or pid_alive(args.pid):
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sampler.stop()
+
+if __name__ == "__main__":
+    main()
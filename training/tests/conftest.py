@@ -0,0 +1,54 @@
+"""
+Shared fixtures: a tiny prepared run directory and a runner for the scripts.
+Everything trains and generates on the NumPy backend, so no MLX is needed.
+The training directory is put on sys.path so tests can import its modules.
+"""
+
+import json
+import random
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+TRAINING_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(TRAINING_DIR))
+WORDS = "alpha beta gamma delta zażółć gęślą jaźń think answer".split()
+
+def run_script(script: str, *args, cwd: Path) -> subprocess.CompletedProcess:
+    """Run one of the training scripts, failing the test with its output if it exits non-zero."""
+    result = subprocess.run([sys.executable, str(TRAINING_DIR / script), *map(str, args)],
+                            cwd=cwd, capture_output=True, text=True)
+    assert result.returncode == 0, f"{script} failed:\n{result.stdout}\n{result.stderr}"
+    return result
+
+@pytest.fixture
+def run_dir(tmp_path: Path) -> Path:
+    """`data/` with train/valid splits of short thinking conversations and an empty `model/`.
+    
+    Without a tokenizer.json or base_model.npz the NumPy backend uses byte
+    tokens and a fixed-seed base model.
+    """
+    rng = random.Random(0)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (tmp_path / "model").mkdir()
+    for split, count in (("train", 40), ("valid", 8)):
+        with open(data_dir / f"{split}.jsonl", 'w') as f:
+            for _ in range(count):
+                question = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+                answer = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 20)))
+                entry = {"messages": [
+                    {"role": "user", "content": question},
+                    {"role": "assistant", "content": f"<think>{question}</think>{answer}"},
+                ]}
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return tmp_path
+
+def train(run_dir: Path, output: str, iters: int, *extra) -> Path:
+    """Train a NumPy-backend LoRA for `iters` steps into `run_dir/output`."""
+    run_script("mlx_train_qwen3.py", "--backend", "numpy", "--model-path", run_dir / "model",
+               "--data-path", run_dir / "data", "--output-dir", run_dir / output,
+               "--iters", iters, "--batch-size", 2, *extra, cwd=run_dir)
+    return run_dir / output
@@ -0,0 +1,22 @@
+"""The per-entry metadata index of dataset_meta.py."""
+
+import json
+
+from dataset_meta import build_metadata, load_metadata, save_metadata
+
+def write_entries(path, entries):
+    with open(path, 'w') as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return path
+
+def entry(language):
+    return {"messages": [{"role": "user", "content": "q"}, {"role": "assistant", "content": "a"}],
+            "language": language}
+
+def test_index_holds_more_than_256_languages(tmp_path):
+    path = write_entries(tmp_path / "train.jsonl", [entry(f"lang{i}") for i in range(300)])
+    save_metadata(path, *build_metadata(path))
+    meta, info = load_metadata(path)
+    
+    assert [info["languages"][code] for code in meta["language"]] == [f"lang{i}" for i in range(300)]
@@ -0,0 +1,24 @@
+"""dedup_dataset.py --apply keeps the files built on the splits consistent."""
+
+import json
+
+import dataset_io
+from conftest import run_script, train
+
+def test_apply_refreshes_files_built_on_line_numbers(run_dir):
+    data_dir = run_dir / "data"
+    split = data_dir / "train.jsonl"
+    lines = split.read_bytes().splitlines(keepends=True)
+    split.write_bytes(b"".join(lines + lines[:5]))
+    dataset_io.write_offsets_index(split)
+    run_script("dataset_meta.py", data_dir, cwd=run_dir)
+    run_script("sampling_plan.py", data_dir, "--steps", 4, "--batch-size", 2, cwd=run_dir)
+    
+    run_script("dedup_dataset.py", data_dir, "--apply", cwd=run_dir)
+    
+    with dataset_io.IndexedDataset(split) as dataset:
+        assert len(dataset) == len(split.read_bytes().splitlines()) <= len(lines)
+    assert not (data_dir / "train.plan.npy").exists()
+    with open(data_dir / "dataset_manifest.json", 'r') as f:
+        assert "plan" not in json.load(f)
+    train(run_dir, "adapter", 2)
@@ -0,0 +1,37 @@
+"""eval_adapters.py end to end on the NumPy backend."""
+
+import json
+
+from conftest import run_script, train
+
+def read_completions(path):
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f]
+
+def evaluate(run_dir, adapters, output, *extra):
+    run_script("eval_adapters.py", "--model-path", run_dir / "model", "--adapter-path", *adapters,
+               "--data-path", run_dir / "data", "--num-prompts", 4, "--max-tokens", 8,
+               "--output", run_dir / f"{output}.json", "--completions", run_dir / f"{output}.jsonl",
+               *extra, cwd=run_dir)
+    with open(run_dir / f"{output}.json", 'r') as f:
+        return json.load(f), read_completions(run_dir / f"{output}.jsonl")
+
+def test_report_covers_every_adapter(run_dir):
+    adapter = train(run_dir, "adapter", 3, "--save-every", 3)
+    report, completions = evaluate(run_dir, [adapter], "eval", "--include-base", "--batch-size", 2)
+    
+    assert [result["adapter"] for result in report["results"]] == ["base", str(adapter)]
+    for result in report["results"]:
+        assert result["prompts"] == 4
+        assert 0 < result["generated_tokens"] <= 4 * 8
+        assert result["tokens_per_s"] > 0
+        assert 0 <= result["answer_f1"] <= 1
+    assert len(completions) == 2 * 4
+    assert {record["prompt"] for record in completions} == set(range(4))
+
+def test_greedy_completions_match_with_and_without_prefix_cache(run_dir):
+    adapter = train(run_dir, "adapter", 3, "--save-every", 3)
+    _, cached = evaluate(run_dir, [adapter], "cached", "--batch-size", 2)
+    _, uncached = evaluate(run_dir, [adapter], "uncached", "--batch-size", 1, "--no-prefix-cache")
+    
+    assert [record["completion"] for record in cached] == [record["completion"] for record in uncached]
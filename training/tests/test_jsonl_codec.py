@@ -0,0 +1,32 @@
+"""Every JSON backend reads and writes dataset lines the same way."""
+
+import pytest
+
+import jsonl_codec as codec
+
+ENTRIES = [
+    {"messages": [{"role": "user", "content": "zażółć gęślą jaźń"},
+                  {"role": "assistant", "content": "<think>\"quoted\"\n\ttab</think>答え 🚀"}]},
+    {"messages": [], "source": "books", "tags": ["a", "b"], "score": 3, "ok": True, "missing": None},
+    {"nested": {"list": [1, [2, {"deep": "x"}]], "empty": {}}},
+]
+
+@pytest.fixture(params=codec.BACKENDS)
+def backend(request):
+    previous = codec.BACKEND
+    codec.set_backend(request.param)
+    yield request.param
+    codec.set_backend(previous)
+
+@pytest.mark.parametrize("entry", ENTRIES)
+def test_backends_write_identical_bytes(backend, entry):
+    written = codec.dumps(entry)
+    codec.set_backend("json")
+    
+    assert written == codec.dumps(entry)
+    assert codec.loads(written) == entry
+
+@pytest.mark.parametrize("raw", [b'{"a": 1', b'not json', b'{"a": "\xff"}'])
+def test_backends_reject_broken_lines(backend, raw):
+    with pytest.raises(codec.DecodeError):
+        codec.loads(raw)
@@ -0,0 +1,93 @@
+"""qwen3-thinking-prepare.py split strategies agree with each other."""
+
+import json
+
+import pytest
+
+from conftest import run_script
+
+NOT_OBJECTS = b'[1, 2]\n"text"\n5\n{"messages": \n'
+
+def prepare(run_dir, output, *extra):
+    run_script("qwen3-thinking-prepare.py", run_dir / "dataset.jsonl", "--no-cache",
+               "--output-dir", run_dir / output, *extra, cwd=run_dir)
+    return run_dir / output
+
+@pytest.fixture
+def dataset(run_dir):
+    data_dir = run_dir / "data"
+    (run_dir / "dataset.jsonl").write_bytes((data_dir / "train.jsonl").read_bytes() +
+                                            (data_dir / "valid.jsonl").read_bytes())
+    return run_dir
+
+@pytest.mark.parametrize("backend", ["json", "orjson", "msgspec"])
+def test_stream_split_matches_in_memory_split(dataset, monkeypatch, backend):
+    pytest.importorskip(backend)
+    monkeypatch.setenv("DATASET_JSON_BACKEND", backend)
+    in_memory = prepare(dataset, "in_memory")
+    streamed = prepare(dataset, "streamed", "--stream")
+    
+    for split in ("train.jsonl", "valid.jsonl"):
+        assert (streamed / split).read_bytes() == (in_memory / split).read_bytes()
+
+def read_split(output):
+    entries = []
+    for split in ("train.jsonl", "valid.jsonl"):
+        with open(output / split, 'r') as f:
+            entries += [json.loads(line) for line in f]
+    return sorted(entries, key=lambda entry: json.dumps(entry, sort_keys=True))
+
+def test_hash_split_drops_the_lines_the_in_memory_split_drops(dataset):
+    path = dataset / "dataset.jsonl"
+    lines = path.read_bytes().splitlines(keepends=True)
+    path.write_bytes(b"".join(lines[:10]) + NOT_OBJECTS + b"".join(lines[10:]))
+    in_memory = prepare(dataset, "in_memory")
+    hashed = prepare(dataset, "hashed", "--split-strategy", "hash")
+    
+    assert read_split(hashed) == read_split(in_memory)
+    for output in (in_memory, hashed):
+        with open(output / "dataset_manifest.json", 'r') as f:
+            assert json.load(f)["skipped_lines"] == 4
+
+def test_append_keeps_the_manifest_of_earlier_runs(dataset):
+    path = dataset / "dataset.jsonl"
+    lines = path.read_bytes().splitlines(keepends=True)
+    path.write_bytes(b"".join(lines[:30]))
+    output = prepare(dataset, "hashed", "--split-strategy", "hash", "--validate", "--columnar", "offsets")
+    path.write_bytes(b"".join(lines) + NOT_OBJECTS)
+    prepare(dataset, "hashed", "--split-strategy", "hash", "--validate", "--append")
+    
+    with open(output / "dataset_manifest.json", 'r') as f:
+        manifest = json.load(f)
+    assert manifest["columnar"]["format"] == "offsets"
+    assert manifest["validation"]["total_entries"] == len(lines) + 4
+    assert manifest["validation"]["invalid_entries"] == 4
+    assert manifest["train_entries"] + manifest["val_entries"] == len(lines)
+
+def test_hash_split_is_stable_under_append(dataset):
+    path = dataset / "dataset.jsonl"
+    lines = path.read_bytes().splitlines(keepends=True)
+    whole = prepare(dataset, "whole", "--split-strategy", "hash")
+    path.write_bytes(b"".join(lines[:20]))
+    appended = prepare(dataset, "appended", "--split-strategy", "hash")
+    path.write_bytes(b"".join(lines))
+    prepare(dataset, "appended", "--split-strategy", "hash", "--append")
+    
+    for split in ("train.jsonl", "valid.jsonl"):
+        assert (appended / split).read_bytes() == (whole / split).read_bytes()
+
+def test_cache_hits_for_the_same_input_and_options_only(dataset):
+    def cached_prepare(output, *extra):
+        result = run_script("qwen3-thinking-prepare.py", dataset / "dataset.jsonl", "--cache-dir", dataset / "cache",
+                            "--output-dir", dataset / output, *extra, cwd=dataset)
+        return "Reusing cached split" in result.stdout
+    
+    assert not cached_prepare("first")
+    assert cached_prepare("second")
+    assert not cached_prepare("third", "--seed", 7)
+    for split in ("train.jsonl", "valid.jsonl"):
+        assert (dataset / "second" / split).read_bytes() == (dataset / "first" / split).read_bytes()
+    
+    with open(dataset / "dataset.jsonl", 'a') as f:
+        f.write(json.dumps({"messages": [{"role": "user", "content": "new"}]}) + "\n")
+    assert not cached_prepare("fourth")
@@ -0,0 +1,37 @@
+"""Resuming from a checkpoint continues the run exactly."""
+
+import json
+
+import numpy as np
+import pytest
+
+from conftest import train
+
+def load(path):
+    with np.load(path) as arrays:
+        return dict(arrays)
+
+def train_losses(output_dir):
+    with open(output_dir / "metrics.jsonl", 'r') as f:
+        records = [json.loads(line) for line in f]
+    return {record["step"]: record["train_loss"] for record in records if record["event"] == "report"}
+
+@pytest.mark.parametrize("extra", [(), ("--lora-dropout", "0.2", "--prefetch", "0")])
+def test_resumed_run_matches_uninterrupted_run(run_dir, extra):
+    common = ("--save-every", 3, "--steps-per-report", 1, *extra)
+    full = train(run_dir, "full", 6, *common)
+    train(run_dir, "resumed", 3, *common)
+    resumed = train(run_dir, "resumed", 6, *common, "--resume")
+    
+    for name in ("adapters.npz", "checkpoint_0000006/optimizer.npz"):
+        expected, actual = load(full / name), load(resumed / name)
+        assert expected.keys() == actual.keys()
+        for key in expected:
+            np.testing.assert_array_equal(actual[key], expected[key], err_msg=f"{name}:{key}")
+    with open(full / "checkpoint_0000006/trainer_state.json", 'r') as f:
+        expected_state = json.load(f)
+    with open(resumed / "checkpoint_0000006/trainer_state.json", 'r') as f:
+        actual_state = json.load(f)
+    for key in ("step", "position", "trained_tokens", "rng"):
+        assert actual_state[key] == expected_state[key]
+    assert train_losses(resumed) == train_losses(full)
@@ -0,0 +1,29 @@
+"""The trainer only follows a sampling plan built from the split as it is now."""
+
+import subprocess
+import sys
+
+from conftest import TRAINING_DIR, run_script, train
+
+def build_plan(run_dir):
+    data_dir = run_dir / "data"
+    run_script("dataset_meta.py", data_dir, cwd=run_dir)
+    run_script("sampling_plan.py", data_dir, "--steps", 4, "--batch-size", 2, cwd=run_dir)
+    return data_dir / "train.plan.npy"
+
+def test_trainer_follows_a_current_plan(run_dir):
+    plan = build_plan(run_dir)
+    train(run_dir, "adapter", 2, "--plan", plan)
+
+def test_trainer_refuses_a_plan_built_before_the_split_changed(run_dir):
+    plan = build_plan(run_dir)
+    split = run_dir / "data" / "train.jsonl"
+    # Same size, different line numbers
+    split.write_bytes(b"".join(reversed(split.read_bytes().splitlines(keepends=True))))
+    
+    result = subprocess.run([sys.executable, str(TRAINING_DIR / "mlx_train_qwen3.py"), "--backend", "numpy",
+                             "--model-path", str(run_dir / "model"), "--data-path", str(run_dir / "data"),
+                             "--output-dir", str(run_dir / "adapter"), "--iters", "2", "--plan", str(plan)],
+                            cwd=run_dir, capture_output=True, text=True)
+    assert result.returncode != 0
+    assert "changed after train.plan.npy was built" in result.stdout
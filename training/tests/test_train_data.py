@@ -0,0 +1,55 @@
+"""Split reading and batch collation in train_data.py."""
+
+import numpy as np
+
+import dataset_io
+from train_data import BatchLoader, PrefetchLoader, SplitReader, collate
+
+class ByteTokenizer:
+    pad_token_id = 0
+    
+    def encode(self, text):
+        return list(text.encode('utf-8'))
+
+def loader(run_dir, **kwargs):
+    return BatchLoader(run_dir / "data" / "train.jsonl", ByteTokenizer(), batch_size=3, max_seq_length=64, **kwargs)
+
+def test_split_reader_ignores_a_stale_index(run_dir):
+    split = run_dir / "data" / "train.jsonl"
+    dataset_io.write_offsets_index(split)
+    lines = split.read_bytes().splitlines(keepends=True)
+    # Rewritten after indexing, as dedup --apply or --drop-overlength do
+    split.write_bytes(b"".join(lines[::2]))
+    
+    reader = SplitReader(split)
+    assert len(reader) == len(lines[::2])
+    assert [reader.raw(i) for i in range(len(reader))] == lines[::2]
+
+def test_collate_masks_only_real_targets():
+    batch = collate([[5, 6, 7, 8], [9], []], pad_id=0)
+    
+    np.testing.assert_array_equal(batch.inputs, [[5, 6, 7], [9, 0, 0], [0, 0, 0]])
+    np.testing.assert_array_equal(batch.targets, [[6, 7, 8], [0, 0, 0], [0, 0, 0]])
+    np.testing.assert_array_equal(batch.mask, [[1, 1, 1], [0, 0, 0], [0, 0, 0]])
+    assert batch.tokens == 3
+
+def test_every_entry_once_per_epoch(run_dir):
+    batches = loader(run_dir, seed=1)
+    entries = len(batches)
+    indices = batches._indices(0, 2 * entries)
+    
+    assert sorted(indices[:entries]) == list(range(entries))
+    assert sorted(indices[entries:]) == list(range(entries))
+    assert indices[:entries] != indices[entries:]
+
+def test_prefetch_yields_the_loader_batches_in_order(run_dir):
+    expected = loader(run_dir, position=5)
+    prefetched = PrefetchLoader(loader(run_dir, position=5), depth=2)
+    try:
+        for _ in range(20):
+            want, got = next(expected), next(prefetched)
+            for name in ("inputs", "targets", "mask"):
+                np.testing.assert_array_equal(getattr(got, name), getattr(want, name))
+        assert prefetched.position == expected.position
+    finally:
+        prefetched.close()
@@ -0,0 +1,135 @@
+"""DatasetValidator rules and the equivalence of its scan modes."""
+
+import json
+import random
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from benchmark_pipeline import load_prepare_module
+from conftest import TRAINING_DIR
+from dataset_meta import build_metadata
+import validate_dataset
+from validate_dataset import DatasetValidator, StreamingStats, chunk_index_path, scan_think_blocks
+
+def write_lines(path, entries):
+    with open(path, 'w') as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return path
+
+def conversation(answer, question="pytanie"):
+    return {"messages": [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]}
+
+@pytest.fixture
+def mixed_dataset(tmp_path):
+    """Valid conversations of random lengths with a share of broken lines between them."""
+    rng = random.Random(0)
+    broken = ['not json', '{"messages": "text"}', json.dumps(conversation("<think>unclosed")),
+              json.dumps({"messages": [{"content": "no role"}]})]
+    path = tmp_path / "data.jsonl"
+    with open(path, 'w') as f:
+        for _ in range(600):
+            if rng.random() < 0.1:
+                f.write(rng.choice(broken) + "\n")
+            else:
+                answer = f"<think>{'myśl ' * rng.randint(0, 50)}</think>{'odp ' * rng.randint(1, 80)}"
+                f.write(json.dumps(conversation(answer), ensure_ascii=False) + "\n")
+    return path
+
+def test_parallel_validation_matches_serial(mixed_dataset):
+    serial = DatasetValidator(mixed_dataset)
+    serial.validate_dataset(workers=1)
+    parallel = DatasetValidator(mixed_dataset)
+    parallel.validate_dataset(workers=3)
+    
+    assert parallel.report() == serial.report()
+    assert parallel.summary()["invalid_entries"] > 0
+
+def test_incremental_validation_matches_full_scan(mixed_dataset, monkeypatch):
+    # Small chunks, so an edit leaves most of them cached
+    monkeypatch.setattr(validate_dataset, "CHUNK_MIN_BYTES", 2000)
+    monkeypatch.setattr(validate_dataset, "CHUNK_MAX_BYTES", 8000)
+    monkeypatch.setattr(validate_dataset, "CHUNK_ANCHOR_MASK", 0x7)
+    DatasetValidator(mixed_dataset).validate_incremental()
+    lines = mixed_dataset.read_bytes().splitlines(keepends=True)
+    # An inserted broken line shifts the line numbers of every cached chunk after it
+    mixed_dataset.write_bytes(b"".join(lines[:100] + [b"not json\n"] + lines[100:]))
+    
+    full = DatasetValidator(mixed_dataset)
+    full.validate_dataset()
+    incremental = DatasetValidator(mixed_dataset)
+    incremental.validate_incremental()
+    assert incremental.report() == full.report()
+
+def test_streaming_stats_match_exact_stats():
+    values = np.random.default_rng(0).lognormal(6, 1.5, 20000).astype(int) + 1
+    halves = StreamingStats(), StreamingStats()
+    for i, value in enumerate(values):
+        halves[i % 2].add(int(value))
+    stats = halves[0]
+    stats.merge(halves[1])
+    
+    assert (stats.count, stats.min, stats.max) == (len(values), values.min(), values.max())
+    assert stats.mean() == pytest.approx(values.mean())
+    for q in (0.5, 0.9, 0.99):
+        # Within the sketch's 1% relative accuracy of a value in the data
+        assert stats.percentile(q) == pytest.approx(np.quantile(values, q, method="lower"), rel=0.02)
+
+def test_incremental_cache_from_older_rules_is_not_reused(tmp_path):
+    path = write_lines(tmp_path / "data.jsonl", [conversation("reasoning</think>answer")] * 20)
+    DatasetValidator(path).validate_incremental()
+    index_path = chunk_index_path(path)
+    with open(index_path, 'r') as f:
+        index = json.load(f)
+    # What a cache from before the version was recorded, under the old think rules, looks like
+    del index["params"]["validator_version"]
+    for chunk in index["chunks"]:
+        chunk["stats"]["valid_entries"] = 0
+    with open(index_path, 'w') as f:
+        json.dump(index, f)
+    
+    validator = DatasetValidator(path)
+    validator.validate_incremental()
+    assert validator.summary()["valid_entries"] == 20
+
+@pytest.mark.parametrize("content, lengths, problem", [
+    ("<think>abc</think>answer", [3], None),
+    ("abc</think>answer", [3], None),
+    ("plain answer", [], None),
+    ("<think>abc", [], "Unclosed <think> tag"),
+    ("<think>a<think>b</think>", [9], "Nested <think> tag"),
+    ("<think>a</think>b</think>", [1], "Unbalanced </think> without <think>"),
+])
+def test_scan_think_blocks(content, lengths, problem):
+    assert scan_think_blocks(content) == (lengths, problem)
+
+def test_think_blocks_counted_alike_everywhere(tmp_path):
+    answers = ["<think>abc</think>answer", "abc</think>answer", "plain answer", "<think>unclosed"]
+    path = write_lines(tmp_path / "data.jsonl", [conversation(answer) for answer in answers])
+    validator = DatasetValidator(path)
+    validator.validate_dataset()
+    meta, _ = build_metadata(path)
+    prepare = load_prepare_module()
+    
+    assert list(meta["has_think"]) == [1, 1, 0, 0]
+    assert list(meta["think_chars"]) == [3, 3, 0, 0]
+    assert [prepare.validate_thinking_entry(conversation(answer)) for answer in answers] == [True, True, False, False]
+    assert validator.summary()["thinking_entries"] == 2
+
+def test_language_scan(tmp_path):
+    path = write_lines(tmp_path / "data.jsonl", [conversation("<think>x</think>zażółć", "pytanie"),
+                                                  conversation("<think>x</think>hello", "question")])
+    validator = DatasetValidator(path)
+    validator.validate_dataset()
+    assert validator.stats["language_stats"] == {"polish": 1, "other": 3}
+
+def test_sample_of_zero_lines_is_rejected(tmp_path):
+    path = write_lines(tmp_path / "data.jsonl", [conversation("<think>x</think>y")] * 5)
+    result = subprocess.run([sys.executable, str(TRAINING_DIR / "validate_dataset.py"), str(path), "--sample", "0"],
+                            capture_output=True, text=True)
+    
+    assert result.returncode == 1
+    assert "--sample must be a positive number of lines" in result.stdout
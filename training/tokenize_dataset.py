@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+Token-Length Precomputation for Qwen3 Thinking Model Training
+Counts tokens per entry, flags over-length entries and emits a
+length-bucketed ordering so batches carry minimal padding
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import dataset_io
+import instrumentation
+import jsonl_codec as codec
+from validate_dataset import chunk_boundaries
+
+DEFAULT_TOKENIZER = "/Users/polyversai/.lmstudio/models/Qwen3-30B-A3B-Thinking-2507/tokenizer.json"
+DATASET_MANIFEST = "dataset_manifest.json"
+SPLITS = ("train", "valid")
+# Manifest entry count of each split file
+SPLIT_COUNT_KEYS = {"train.jsonl": "train_entries", "valid.jsonl": "val_entries"}
+ENCODE_BATCH_SIZE = 256
+# Built from a split's line numbers by sampling_plan.py and pack_dataset.py
+LINE_DERIVED_SUFFIXES = (".plan.npy", ".packed.jsonl", ".packed.index.npy")
+# Batches sorted together, as a multiple of the batch size
+BUCKET_MULTIPLIER = 50
+
+_tokenizer = None
+
+def render_chat(entry: Dict) -> str:
+    """Render messages the way Qwen's chat template does."""
+    return "".join(
+        f"<|im_start|>{msg.get('role', '')}\n{msg.get('content', '')}<|im_end|>\n"
+        for msg in entry.get("messages", [])
+        if isinstance(msg, dict)
+    )
+
+def _init_tokenizer(tokenizer_path: str):
+    """Process pool initializer: load the tokenizer once per worker."""
+    global _tokenizer
+    # Workers already run in parallel; keep the Rust side single-threaded
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    from tokenizers import Tokenizer
+    _tokenizer = Tokenizer.from_file(tokenizer_path)
+
+def _count_chunk(path: str, start: int, end: int, keep_ids: bool = False) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Token count of every line in [start, end); 0 for lines that don't parse.
+    
+    With `keep_ids` the token ids of all lines come back too, concatenated.
+    """
+    counts = []
+    ids = []
+    texts = []
+    
+    def flush():
+        if texts:
+            encodings = _tokenizer.encode_batch(texts, add_special_tokens=False)
+            counts.extend(len(encoding.ids) for encoding in encodings)
+            if keep_ids:
+                ids.extend(np.asarray(encoding.ids, dtype=np.uint32) for encoding in encodings)
+            texts.clear()
+    
+    with open(path, 'rb') as f:
+        f.seek(start)
+        pos = start
+        for raw in f:
+            if pos >= end:
+                break
+            pos += len(raw)
+            try:
+                texts.append(render_chat(codec.loads(raw)))
+            except codec.DecodeError + (AttributeError,):
+                flush()
+                counts.append(0)
+                continue
+            if len(texts) >= ENCODE_BATCH_SIZE:
+                flush()
+    flush()
+    counts = np.asarray(counts, dtype=np.uint32)
+    if not keep_ids:
+        return counts, None
+    return counts, np.concatenate(ids) if ids else np.zeros(0, dtype=np.uint32)
+
+def count_tokens(split_path: Path, tokenizer_path: str, workers: int,
+                 keep_ids: bool = False) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Token counts for every line of a split, computed in a process pool.
+    
+    With `keep_ids` also returns every line's token ids back to back, so
+    line i is ids[sum(counts[:i]):sum(counts[:i + 1])].
+    """
+    boundaries = chunk_boundaries(split_path, max(workers, 1) * 4)
+    starts = boundaries[:-1]
+    ends = boundaries[1:]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_tokenizer,
+                             initargs=(tokenizer_path,)) as pool:
+        chunks = list(pool.map(_count_chunk, [str(split_path)] * len(starts), starts, ends,
+                               [keep_ids] * len(starts)))
+    empty = np.zeros(0, dtype=np.uint32)
+    counts = np.concatenate([c for c, _ in chunks]) if chunks else empty
+    if not keep_ids:
+        return counts, None
+    return counts, np.concatenate([i for _, i in chunks]) if chunks else empty
+
+def length_bucketed_order(lengths: np.ndarray, batch_size: int, seed: int) -> np.ndarray:
+    """Shuffle, sort by length within large buckets, then shuffle whole batches.
+    
+    Neighbouring entries end up with similar lengths (little padding per
+    batch) while the batch order stays random.
+    """
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(lengths))
+    bucket = batch_size * BUCKET_MULTIPLIER
+    for start in range(0, len(order), bucket):
+        chunk = order[start:start + bucket]
+        order[start:start + bucket] = chunk[np.argsort(lengths[chunk], kind="stable")]
+    
+    batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+    rng.shuffle(batches)
+    return np.concatenate(batches).astype(np.uint32) if batches else order.astype(np.uint32)
+
+def padding_efficiency(lengths: np.ndarray, order: np.ndarray, batch_size: int) -> float:
+    """Real tokens / padded tokens when batching `lengths` in `order`."""
+    real = padded = 0
+    for start in range(0, len(order), batch_size):
+        batch = lengths[order[start:start + batch_size]]
+        real += int(batch.sum())
+        padded += int(batch.max()) * len(batch)
+    return real / padded if padded else 1.0
+
+def length_summary(lengths: np.ndarray, max_seq_length: int) -> Dict:
+    if len(lengths) == 0:
+        return {"entries": 0}
+    p50, p90, p99 = np.percentile(lengths, [50, 90, 99])
+    return {
+        "entries": int(len(lengths)),
+        "total_tokens": int(lengths.sum()),
+        "mean": float(lengths.mean()),
+        "p50": float(p50),
+        "p90": float(p90),
+        "p99": float(p99),
+        "max": int(lengths.max()),
+        "overlength": int((lengths > max_seq_length).sum()),
+        "unparsed": int((lengths == 0).sum()),
+    }
+
+def drop_lines(split_path: Path, keep: np.ndarray):
+    """Rewrite a split keeping only the lines where `keep` is True."""
+    tmp_path = split_path.with_name(split_path.name + ".tmp")
+    with open(split_path, 'rb') as src, open(tmp_path, 'wb') as dest:
+        for line, kept in zip(src, keep):
+            if kept:
+                dest.write(line)
+    # Replace rather than truncate, the split may be hardlinked into the prep cache
+    os.replace(tmp_path, split_path)
+
+def file_checksum(file_path: Path) -> str:
+    """Short SHA256, same format as the prepare step's checksums."""
+    sha256_hash = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256_hash.update(block)
+    return sha256_hash.hexdigest()[:16]
+
+def file_signature(file_path: Path) -> Dict:
+    """Size, mtime and checksum of a file, recorded by sidecars that describe it."""
+    stat = Path(file_path).stat()
+    return {"bytes": stat.st_size, "mtime_ns": stat.st_mtime_ns, "checksum": file_checksum(file_path)}
+
+def matches_signature(file_path: Path, signature: Dict) -> bool:
+    """Whether `file_path` is still the file a `file_signature` was taken of.
+    
+    Only a changed mtime (a copy, a touch, a same-size rewrite) pays for the
+    checksum. Signatures from before mtimes were recorded compare by size.
+    """
+    stat = Path(file_path).stat()
+    if signature.get("bytes") != stat.st_size:
+        return False
+    if signature.get("mtime_ns") in (None, stat.st_mtime_ns):
+        return True
+    return signature.get("checksum") == file_checksum(file_path)
+
+def update_dataset_manifest(data_dir: Path, updates: Dict, drop: Sequence[str] = ()):
+    """Merge `updates` into the dataset manifest written by the prepare step, removing the `drop` keys."""
+    manifest_path = data_dir / DATASET_MANIFEST
+    manifest = {}
+    if manifest_path.exists():
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    manifest.update(updates)
+    for key in drop:
+        manifest.pop(key, None)
+    tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def record_rewritten_split(split_path: Path, entries: int):
+    """Record a rewritten split's entry count and checksum, keeping the other split's checksum."""
+    manifest_path = split_path.parent / DATASET_MANIFEST
+    checksums = {}
+    if manifest_path.exists():
+        with open(manifest_path, 'r') as f:
+            checksums = json.load(f).get("checksums", {})
+    checksums[split_path.name] = file_checksum(split_path)
+    updates = {"checksums": checksums}
+    if split_path.name in SPLIT_COUNT_KEYS:
+        updates[SPLIT_COUNT_KEYS[split_path.name]] = entries
+    update_dataset_manifest(split_path.parent, updates)
+
+def invalidate_derived_files(split_path: Path) -> List[str]:
+    """Bring the files built on a split's line numbers up to date after it was rewritten.
+    
+    Offsets and Arrow sidecars are rebuilt, that needs no parsing. Sampling
+    plans and packs depend on options only their tools know, so they are
+    deleted along with their manifest entries. Returns the deleted file names.
+    """
+    stem = split_path.name.split(".")[0]
+    manifest_path = split_path.parent / DATASET_MANIFEST
+    manifest = {}
+    if manifest_path.exists():
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    
+    stale = [split_path.with_name(stem + suffix) for suffix in LINE_DERIVED_SUFFIXES]
+    if dataset_io.index_path(split_path).exists():
+        dataset_io.write_offsets_index(split_path)
+    arrow_path = dataset_io.arrow_path(split_path)
+    if arrow_path.exists():
+        try:
+            dataset_io.write_arrow(split_path)
+        except ImportError:
+            stale.append(arrow_path)
+    plan = manifest.get("plan")
+    if stem == "train" and plan:
+        stale.append(split_path.with_name(plan["file"]))
+    deleted = []
+    for path in stale:
+        if path.exists():
+            path.unlink()
+            deleted.append(path.name)
+    
+    updates, drop = {}, []
+    if stem == "train" and plan:
+        drop.append("plan")
+    packing = {split: info for split, info in manifest.get("packing", {}).items() if split != stem}
+    if packing:
+        updates["packing"] = packing
+    elif "packing" in manifest:
+        drop.append("packing")
+    if updates or drop:
+        update_dataset_manifest(split_path.parent, updates, drop)
+    return deleted
+
+def filter_token_sidecars(split_path: Path, keep: np.ndarray) -> bool:
+    """Drop the lines another tool removed from a split from its token sidecars too.
+    
+    Counts, ids and the bucketed order are cut with the same `keep` mask as
+    the split, so they stay valid without tokenizing again. Sidecars that
+    don't match the split's old line count are deleted instead; returns
+    whether the split still has them.
+    """
+    stem = split_path.name.split(".")[0]
+    tokens_path = split_path.with_name(f"{stem}.tokens.npy")
+    ids_path = split_path.with_name(f"{stem}.ids.npy")
+    order_path = split_path.with_name(f"{stem}.order.npy")
+    sidecars = [path for path in (tokens_path, ids_path, order_path) if path.exists()]
+    if not sidecars:
+        return False
+    manifest_path = split_path.parent / DATASET_MANIFEST
+    token_stats = None
+    if manifest_path.exists():
+        with open(manifest_path, 'r') as f:
+            token_stats = json.load(f).get("tokens")
+    
+    lengths = np.load(tokens_path) if tokens_path.exists() else None
+    if lengths is None or len(lengths) != len(keep):
+        for path in sidecars:
+            path.unlink()
+        if token_stats and stem in token_stats:
+            del token_stats[stem]
+            update_dataset_manifest(split_path.parent, {"tokens": token_stats})
+        return False
+    
+    if ids_path.exists():
+        ids = np.load(ids_path)
+        if len(ids) == int(lengths.sum()):
+            np.save(ids_path, ids[np.repeat(keep, lengths)])
+        else:
+            ids_path.unlink()
+    if order_path.exists():
+        order = np.load(order_path)
+        # Kept entries keep their place in the order, renumbered to their new line
+        new_index = np.cumsum(keep) - 1
+        np.save(order_path, new_index[order[keep[order]]].astype(np.uint32))
+    lengths = lengths[keep]
+    np.save(tokens_path, lengths)
+    if token_stats and stem in token_stats:
+        summary = length_summary(lengths, token_stats.get("max_seq_length", 8192))
+        token_stats[stem] = {**token_stats[stem], **summary, **file_signature(split_path)}
+        update_dataset_manifest(split_path.parent, {"tokens": token_stats})
+    return True
+
+def tokenize_split(data_dir: Path, split: str, args: argparse.Namespace) -> Optional[Dict]:
+    """Count, report, optionally drop over-length entries and write sidecars."""
+    split_path = data_dir / f"{split}.jsonl"
+    if not split_path.exists():
+        print(f"⚠️  No {split_path}, skipping")
+        return None
+    
+    print(f"\n🔢 Tokenizing {split_path} with {args.workers} workers...")
+    with instrumentation.span("tokenize", file=split_path.name, workers=args.workers):
+        lengths, ids = count_tokens(split_path, args.tokenizer, args.workers, keep_ids=args.save_ids)
+    instrumentation.count("lines", len(lengths))
+    instrumentation.count("tokens", int(lengths.sum()))
+    summary = length_summary(lengths, args.max_seq_length)
+    
+    print(f"  Entries: {summary['entries']}")
+    if summary["entries"]:
+        print(f"  Tokens: {summary['total_tokens']} (mean {summary['mean']:.0f})")
+        print(f"  Token length p50/p90/p99: {summary['p50']:.0f} / {summary['p90']:.0f} / {summary['p99']:.0f}")
+        print(f"  Max token length: {summary['max']}")
+    if summary.get("unparsed"):
+        print(f"  ⚠️  {summary['unparsed']} lines could not be parsed")
+    
+    overlength = lengths > args.max_seq_length
+    if overlength.any():
+        first = ", ".join(str(i + 1) for i in np.flatnonzero(overlength)[:10])
+        print(f"  ⚠️  {summary['overlength']} entries exceed {args.max_seq_length} tokens (lines {first}...)")
+        if args.drop_overlength:
+            with instrumentation.span("write", file=split_path.name):
+                drop_lines(split_path, ~overlength)
+            if ids is not None:
+                ids = ids[np.repeat(~overlength, lengths)]
+            lengths = lengths[~overlength]
+            dropped = summary["overlength"]
+            summary = length_summary(lengths, args.max_seq_length)
+            summary["dropped"] = dropped
+            # Right away, so the manifest never describes the file from before the rewrite
+            record_rewritten_split(split_path, len(lengths))
+            print(f"  🗑️  Dropped them from {split_path.name}")
+            deleted = invalidate_derived_files(split_path)
+            if deleted:
+                print(f"  🗑️  Deleted {', '.join(deleted)}, built on the old line numbers")
+    
+    tokens_path = data_dir / f"{split}.tokens.npy"
+    with instrumentation.span("write", file=tokens_path.name):
+        np.save(tokens_path, lengths)
+    print(f"💾 Saved token counts to: {tokens_path}")
+    if ids is not None:
+        ids_path = data_dir / f"{split}.ids.npy"
+        with instrumentation.span("write", file=ids_path.name):
+            np.save(ids_path, ids)
+        print(f"💾 Saved token ids to: {ids_path}")
+    # Lets the trainer tell whether the sidecars still describe this file
+    summary.update(file_signature(split_path))
+    # Imported here, dataset_meta builds on this module through dedup_dataset
+    from dataset_meta import refresh_metadata
+    with instrumentation.span("metadata", file=split_path.name):
+        refreshed = refresh_metadata(split_path, args.workers)
+    if refreshed:
+        print(f"🗂️  Refreshed the metadata index with token counts")
+    
+    if split == "train":
+        with instrumentation.span("order"):
+            order = length_bucketed_order(lengths, args.batch_size, args.seed)
+        order_path = data_dir / f"{split}.order.npy"
+        np.save(order_path, order)
+        shuffled = np.random.default_rng(args.seed).permutation(len(lengths))
+        before = padding_efficiency(lengths, shuffled, args.batch_size)
+        after = padding_efficiency(lengths, order, args.batch_size)
+        summary["padding_efficiency"] = {"shuffled": before, "bucketed": after}
+        print(f"💾 Saved length-bucketed order to: {order_path}")
+        print(f"  Padding efficiency at batch size {args.batch_size}: "
+              f"{before*100:.1f}% shuffled -> {after*100:.1f}% bucketed")
+    
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute token lengths for prepared splits")
+    parser.add_argument("data_dir", help="Directory containing train.jsonl and valid.jsonl")
+    parser.add_argument("--tokenizer", type=str, default=DEFAULT_TOKENIZER,
+                        help="Path to a Hugging Face tokenizer.json (or a model directory containing one)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Tokenizer processes")
+    parser.add_argument("--max-seq-length", type=int, default=8192,
+                        help="Entries longer than this are flagged")
+    parser.add_argument("--drop-overlength", action="store_true",
+                        help="Remove over-length entries from the splits instead of only flagging them")
+    parser.add_argument("--save-ids", action="store_true",
+                        help="Also save every entry's token ids (<split>.ids.npy) so the trainer skips tokenizing")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Batch size the length-bucketed order is built for")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Seed for the bucketed order")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.setup(args)
+    
+    if Path(args.tokenizer).is_dir():
+        args.tokenizer = str(Path(args.tokenizer) / "tokenizer.json")
+    if not Path(args.tokenizer).exists():
+        print(f"❌ Tokenizer not found at: {args.tokenizer}")
+        sys.exit(1)
+    
+    data_dir = Path(args.data_dir)
+    print("🔢 Token Length Precomputation")
+    print("=" * 60)
+    
+    token_stats = {}
+    for split in SPLITS:
+        summary = tokenize_split(data_dir, split, args)
+        if summary is not None:
+            token_stats[split] = summary
+    
+    updates = {"tokens": {"max_seq_length": args.max_seq_length, "tokenizer": args.tokenizer,
+                          "tokenizer_checksum": file_checksum(Path(args.tokenizer)), "ids": args.save_ids,
+                          **token_stats}}
+    update_dataset_manifest(data_dir, updates)
+    
+    print("\n" + "=" * 60)
+    print("✅ Token lengths ready!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,511 @@
+#!/usr/bin/env python3
+"""
+Training Backends for the Qwen3 Trainer
+MLX for real runs on Apple silicon and a NumPy reference engine that trains
+LoRA on a tiny model anywhere; each backend imports its framework only when built
+"""
+
+import copy
+import json
+import struct
+from abc import ABC, abstractmethod
+from functools import partial
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+BACKENDS = ("mlx", "numpy")
+ADAPTER_CONFIG = "adapter_config.json"
+# Special tokens that end a chat turn, when the vocabulary has them
+END_TOKENS = ("<|im_end|>", "<|endoftext|>")
+# mlx_lm pads batch widths to a multiple of this, so compiled steps see few distinct shapes
+MLX_PAD_TO = 32
+SAFETENSORS_DTYPES = {"F64": np.float64, "F32": np.float32, "F16": np.float16,
+                      "I64": np.int64, "I32": np.int32, "U32": np.uint32, "U8": np.uint8}
+
+def save_safetensors(path: Path, arrays: Dict[str, np.ndarray]):
+    """Write NumPy arrays as a .safetensors file (the format mlx_lm loads adapters from).
+    
+    Done by hand so adapters can be written from a NumPy snapshot on any
+    thread, without the framework or the safetensors package.
+    """
+    names = {np.dtype(dtype): name for name, dtype in SAFETENSORS_DTYPES.items()}
+    header = {}
+    blobs = []
+    offset = 0
+    for key, value in arrays.items():
+        # ascontiguousarray would turn 0-d arrays into 1-d ones
+        value = np.asarray(value)
+        if value.dtype not in names:
+            raise ValueError(f"{key}: dtype {value.dtype} can't be stored in safetensors here")
+        data = value.astype(value.dtype.newbyteorder('<'), copy=False).tobytes(order='C')
+        header[key] = {"dtype": names[value.dtype], "shape": list(value.shape),
+                       "data_offsets": [offset, offset + len(data)]}
+        blobs.append(data)
+        offset += len(data)
+    encoded = json.dumps(header, separators=(",", ":")).encode('utf-8')
+    # The data section starts 8-byte aligned
+    encoded += b" " * (-len(encoded) % 8)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<Q', len(encoded)))
+        f.write(encoded)
+        for data in blobs:
+            f.write(data)
+
+def load_safetensors(path: Path) -> Dict[str, np.ndarray]:
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        data = f.read()
+    arrays = {}
+    for key, info in header.items():
+        if key == "__metadata__":
+            continue
+        if info["dtype"] not in SAFETENSORS_DTYPES:
+            raise ValueError(f"{path}: unsupported dtype {info['dtype']} for {key}")
+        start, end = info["data_offsets"]
+        dtype = np.dtype(SAFETENSORS_DTYPES[info["dtype"]]).newbyteorder('<')
+        arrays[key] = np.frombuffer(data[start:end], dtype=dtype).reshape(info["shape"]).copy()
+    return arrays
+
+class TrainingBackend(ABC):
+    """What the trainer needs from an engine.
+    
+    `tokenizer.encode(text)` returns token ids and `tokenizer.decode(ids)`
+    text; steps take a train_data.Batch and return (mean loss, tokens).
+    Adapter and optimizer state travel as NumPy arrays and RNG state as JSON,
+    so checkpoints are snapshots that can be written off the training thread
+    and don't depend on the framework.
+    """
+    
+    name = ""
+    adapter_file = ""
+    
+    def __init__(self, config: Dict):
+        self.config = config
+        self.tokenizer = None
+        # tokenizer.json the tokenizer was loaded from, to match pre-tokenized data against
+        self.tokenizer_file = None
+    
+    @abstractmethod
+    def train_step(self, batch) -> Tuple[float, int]:
+        ...
+    
+    @abstractmethod
+    def eval_loss(self, batch) -> Tuple[float, int]:
+        ...
+    
+    @abstractmethod
+    def prefill(self, ids: List[int]):
+        """Run a shared prompt prefix once; `generate` continues every prompt from a copy."""
+    
+    @abstractmethod
+    def generate(self, prompts: List[List[int]], max_tokens: int, temperature: float = 0.0,
+                 cache=None) -> Iterator[List[Tuple[int, int]]]:
+        """Decode `prompts` as one batch, after `cache` (from `prefill`) when given.
+        
+        Yields one list of (row, token) per decoding step for the rows still
+        going; a row stops at an end-of-turn token (not yielded) or after
+        `max_tokens`.
+        """
+    
+    @abstractmethod
+    def adapter_state(self) -> Dict[str, np.ndarray]:
+        ...
+    
+    @abstractmethod
+    def load_adapter_state(self, state: Dict[str, np.ndarray]):
+        ...
+    
+    @abstractmethod
+    def optimizer_state(self) -> Dict[str, np.ndarray]:
+        ...
+    
+    @abstractmethod
+    def load_optimizer_state(self, state: Dict[str, np.ndarray]):
+        ...
+    
+    @abstractmethod
+    def rng_state(self) -> Dict:
+        """JSON-serialisable state of the RNG behind dropout."""
+    
+    @abstractmethod
+    def load_rng_state(self, state: Dict):
+        ...
+    
+    def write_adapter(self, directory: Path, state: Dict[str, np.ndarray]) -> Path:
+        """Write adapter weights (from `adapter_state`) plus adapter_config.json into `directory`."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / self.adapter_file
+        if path.suffix == ".safetensors":
+            save_safetensors(path, state)
+        else:
+            np.savez(path, **state)
+        self.write_adapter_config(directory)
+        return path
+    
+    def read_adapter(self, directory: Path) -> Dict[str, np.ndarray]:
+        path = Path(directory) / self.adapter_file
+        if path.suffix == ".safetensors":
+            return load_safetensors(path)
+        with np.load(path) as arrays:
+            return dict(arrays)
+    
+    def save_adapter(self, directory: Path) -> Path:
+        return self.write_adapter(directory, self.adapter_state())
+    
+    def memory_stats(self) -> Dict:
+        """Backend memory numbers for the telemetry samples."""
+        return {}
+    
+    def write_adapter_config(self, directory: Path):
+        config = {
+            "backend": self.name,
+            "fine_tune_type": "lora",
+            "num_layers": self.config["lora_layers"],
+            "lora_parameters": {
+                "rank": self.config["lora_rank"],
+                "scale": self.config["lora_alpha"] / self.config["lora_rank"],
+                "dropout": self.config["lora_dropout"],
+            },
+        }
+        with open(Path(directory) / ADAPTER_CONFIG, 'w') as f:
+            json.dump(config, f, indent=2)
+
+def get_backend(name: str, config: Dict) -> TrainingBackend:
+    """Build a backend by name, importing its framework now."""
+    if name == "mlx":
+        return MLXBackend(config)
+    if name == "numpy":
+        return NumpyBackend(config)
+    raise ValueError(f"Unknown backend {name!r} (have: {', '.join(BACKENDS)})")
+
+class MLXBackend(TrainingBackend):
+    """LoRA on an mlx_lm model, the same layers, loss and compiled step as `mlx_lm.lora`."""
+    
+    name = "mlx"
+    adapter_file = "adapters.safetensors"
+    
+    def __init__(self, config: Dict):
+        super().__init__(config)
+        import mlx.core as mx
+        import mlx.nn as nn
+        import mlx.optimizers as optim
+        from mlx.utils import tree_flatten, tree_unflatten
+        from mlx_lm import load
+        from mlx_lm.tuner.trainer import grad_checkpoint
+        from mlx_lm.tuner.utils import linear_to_lora_layers
+        
+        self.mx = mx
+        self.tree_flatten = tree_flatten
+        self.tree_unflatten = tree_unflatten
+        mx.random.seed(config["seed"])
+        self.model, self.tokenizer = load(config["model"])
+        tokenizer_file = Path(config["model"]) / "tokenizer.json"
+        self.tokenizer_file = tokenizer_file if tokenizer_file.exists() else None
+        self.model.freeze()
+        linear_to_lora_layers(self.model, config["lora_layers"], {
+            "rank": config["lora_rank"],
+            "scale": config["lora_alpha"] / config["lora_rank"],
+            "dropout": config["lora_dropout"],
+        })
+        if config.get("grad_checkpoint"):
+            grad_checkpoint(self.model.layers[0])
+        self.model.train()
+        self.optimizer = optim.Adam(learning_rate=config["learning_rate"])
+        
+        def loss_fn(model, inputs, targets, mask):
+            logits = model(inputs)
+            tokens = mask.sum()
+            loss = (nn.losses.cross_entropy(logits, targets) * mask).astype(mx.float32).sum() / mx.maximum(tokens, 1)
+            return loss, tokens
+        
+        self._loss_fn = loss_fn
+        self._loss_and_grad = nn.value_and_grad(self.model, loss_fn)
+        self._step = None
+    
+    def _compiled_step(self):
+        """mlx_lm's training step: loss, gradients and the optimizer update in one compiled graph.
+        
+        Built on first use and again after `load_optimizer_state`, which replaces
+        the optimizer state the graph reads and writes.
+        """
+        mx = self.mx
+        state = [self.model.state, self.optimizer.state, mx.random.state]
+        
+        @partial(mx.compile, inputs=state, outputs=state)
+        def step(inputs, targets, mask):
+            (loss, tokens), grads = self._loss_and_grad(self.model, inputs, targets, mask)
+            self.optimizer.update(self.model, grads)
+            return loss, tokens
+        
+        return step, state
+    
+    def _arrays(self, batch):
+        # Masked padding, so the loss is unchanged and the compiled step is retraced per width bucket only
+        pad = -batch.inputs.shape[1] % MLX_PAD_TO
+        arrays = (batch.inputs, batch.targets, batch.mask)
+        if pad:
+            arrays = [np.pad(array, ((0, 0), (0, pad))) for array in arrays]
+        return tuple(self.mx.array(array) for array in arrays)
+    
+    def train_step(self, batch) -> Tuple[float, int]:
+        if self._step is None:
+            self._step = self._compiled_step()
+        step, state = self._step
+        loss, tokens = step(*self._arrays(batch))
+        self.mx.eval(state, loss, tokens)
+        return loss.item(), int(tokens.item())
+    
+    def eval_loss(self, batch) -> Tuple[float, int]:
+        self.model.eval()
+        loss, tokens = self._loss_fn(self.model, *self._arrays(batch))
+        self.mx.eval(loss, tokens)
+        self.model.train()
+        return loss.item(), int(tokens.item())
+    
+    def prefill(self, ids: List[int]):
+        from mlx_lm.models.cache import make_prompt_cache
+        
+        self.model.eval()
+        cache = make_prompt_cache(self.model)
+        self.model(self.mx.array(ids)[None], cache=cache)
+        self.mx.eval([c.state for c in cache])
+        self.model.train()
+        return cache
+    
+    def generate(self, prompts: List[List[int]], max_tokens: int, temperature: float = 0.0,
+                 cache=None) -> Iterator[List[Tuple[int, int]]]:
+        from mlx_lm.generate import BatchGenerator
+        from mlx_lm.sample_utils import make_sampler
+        
+        self.model.eval()
+        generator = BatchGenerator(self.model, max_tokens=max_tokens,
+                                   stop_tokens=[[t] for t in self.tokenizer.eos_token_ids],
+                                   sampler=make_sampler(temp=temperature),
+                                   completion_batch_size=len(prompts), prefill_batch_size=len(prompts))
+        # BatchGenerator extends the caches it's given, so every row gets its own copy
+        caches = [copy.deepcopy(cache) for _ in prompts] if cache is not None else None
+        uids = generator.insert(prompts, [max_tokens] * len(prompts), caches=caches)
+        rows = {uid: row for row, uid in enumerate(uids)}
+        try:
+            while True:
+                responses = generator.next_generated()
+                if not responses:
+                    break
+                yield [(rows[r.uid], r.token) for r in responses if r.finish_reason != "stop"]
+        finally:
+            generator.close()
+            self.model.train()
+    
+    def adapter_state(self) -> Dict[str, np.ndarray]:
+        return {key: np.array(value) for key, value in self.tree_flatten(self.model.trainable_parameters())}
+    
+    def load_adapter_state(self, state: Dict[str, np.ndarray]):
+        self.model.load_weights([(key, self.mx.array(value)) for key, value in state.items()], strict=False)
+    
+    def optimizer_state(self) -> Dict[str, np.ndarray]:
+        return {key: np.array(value) for key, value in self.tree_flatten(self.optimizer.state)}
+    
+    def load_optimizer_state(self, state: Dict[str, np.ndarray]):
+        self.optimizer.init(self.model.trainable_parameters())
+        self.optimizer.state = self.tree_unflatten([(key, self.mx.array(value)) for key, value in state.items()])
+        self._step = None
+    
+    def rng_state(self) -> Dict:
+        return {"key": np.array(self.mx.random.state[0]).tolist()}
+    
+    def load_rng_state(self, state: Dict):
+        self.mx.random.state[0] = self.mx.array(np.array(state["key"], dtype=np.uint32))
+    
+    def memory_stats(self) -> Dict:
+        # Newer MLX exposes these at the top level, older releases under mx.metal
+        source = self.mx if hasattr(self.mx, "get_active_memory") else self.mx.metal
+        return {
+            "mlx_active_mb": round(source.get_active_memory() / (1 << 20), 1),
+            "mlx_peak_mb": round(source.get_peak_memory() / (1 << 20), 1),
+        }
+
+class ByteTokenizer:
+    """UTF-8 bytes as token ids, for the reference backend without a tokenizer.json."""
+    
+    vocab_size = 256
+    pad_token_id = 0
+    eos_token_ids = ()
+    
+    def encode(self, text: str):
+        return list(text.encode('utf-8'))
+    
+    def decode(self, ids) -> str:
+        return bytes(int(i) for i in ids).decode('utf-8', errors='replace')
+
+class FileTokenizer:
+    """A tokenizer.json behind the encode() -> ids interface of mlx_lm's tokenizer."""
+    
+    pad_token_id = 0
+    
+    def __init__(self, path: Path):
+        from tokenizers import Tokenizer
+        self._tokenizer = Tokenizer.from_file(str(path))
+        self.vocab_size = self._tokenizer.get_vocab_size()
+        self.eos_token_ids = tuple(i for i in map(self._tokenizer.token_to_id, END_TOKENS) if i is not None)
+    
+    def encode(self, text: str):
+        return self._tokenizer.encode(text, add_special_tokens=False).ids
+    
+    def decode(self, ids) -> str:
+        return self._tokenizer.decode([int(i) for i in ids], skip_special_tokens=False)
+
+class NumpyBackend(TrainingBackend):
+    """Reference engine: a frozen bigram language model with LoRA on its output projection.
+    
+    logits = E[x] @ (W + scale * A @ B), trained with Adam on the masked
+    next-token loss. `--model-path` may be a directory holding a
+    tokenizer.json and/or base_model.npz (`embedding`, `output`); otherwise
+    bytes are tokens and the base weights come from a fixed seed.
+    """
+    
+    name = "numpy"
+    adapter_file = "adapters.npz"
+    hidden_size = 64
+    
+    def __init__(self, config: Dict):
+        super().__init__(config)
+        model_dir = Path(config["model"])
+        tokenizer_path = model_dir / "tokenizer.json"
+        if tokenizer_path.exists():
+            self.tokenizer = FileTokenizer(tokenizer_path)
+            self.tokenizer_file = tokenizer_path
+        else:
+            self.tokenizer = ByteTokenizer()
+        vocab = self.tokenizer.vocab_size
+        
+        base_path = model_dir / "base_model.npz"
+        if base_path.exists():
+            weights = np.load(base_path)
+            self.embedding, self.output = weights["embedding"], weights["output"]
+        else:
+            # The base model is fixed; the run seed only drives LoRA init and dropout
+            init = np.random.default_rng(0)
+            self.embedding = init.normal(0, 1, (vocab, self.hidden_size)).astype(np.float32)
+            self.output = init.normal(0, self.hidden_size ** -0.5, (self.hidden_size, vocab)).astype(np.float32)
+        dim = self.embedding.shape[1]
+        
+        rank = config["lora_rank"]
+        self.scale = config["lora_alpha"] / rank
+        self.dropout = config["lora_dropout"]
+        self.learning_rate = config["learning_rate"]
+        self.rng = np.random.default_rng(config["seed"])
+        self.params = {
+            "lora_a": self.rng.uniform(-dim ** -0.5, dim ** -0.5, (dim, rank)).astype(np.float32),
+            "lora_b": np.zeros((rank, self.output.shape[1]), dtype=np.float32),
+        }
+        # Adam moments and step count
+        self.adam_step = 0
+        self.adam_m = {key: np.zeros_like(value) for key, value in self.params.items()}
+        self.adam_v = {key: np.zeros_like(value) for key, value in self.params.items()}
+    
+    def _forward(self, batch, train: bool):
+        hidden = self.embedding[batch.inputs]
+        lora_input = hidden
+        if train and self.dropout:
+            keep = self.rng.random(hidden.shape) >= self.dropout
+            lora_input = hidden * keep / (1 - self.dropout)
+        low_rank = lora_input @ self.params["lora_a"]
+        logits = hidden @ self.output + self.scale * (low_rank @ self.params["lora_b"])
+        logits -= logits.max(axis=-1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=-1, keepdims=True)
+        
+        tokens = float(batch.mask.sum())
+        target_probs = np.take_along_axis(probs, batch.targets[..., None], axis=-1)[..., 0]
+        loss = -(np.log(target_probs + 1e-12) * batch.mask).sum() / max(tokens, 1.0)
+        return float(loss), int(tokens), (lora_input, low_rank, probs)
+    
+    def train_step(self, batch) -> Tuple[float, int]:
+        loss, tokens, (lora_input, low_rank, probs) = self._forward(batch, train=True)
+        
+        # d loss / d logits = softmax - one_hot(target), masked and averaged
+        grad_logits = probs
+        np.put_along_axis(grad_logits, batch.targets[..., None],
+                          np.take_along_axis(grad_logits, batch.targets[..., None], axis=-1) - 1, axis=-1)
+        grad_logits *= (batch.mask / max(tokens, 1))[..., None]
+        grad_logits = grad_logits.reshape(-1, grad_logits.shape[-1])
+        
+        rank = self.params["lora_a"].shape[1]
+        grads = {
+            "lora_b": self.scale * low_rank.reshape(-1, rank).T @ grad_logits,
+            "lora_a": self.scale * lora_input.reshape(-1, lora_input.shape[-1]).T
+                      @ (grad_logits @ self.params["lora_b"].T),
+        }
+        self._adam_update(grads)
+        return loss, tokens
+    
+    def _adam_update(self, grads: Dict[str, np.ndarray], beta1: float = 0.9, beta2: float = 0.999,
+                     eps: float = 1e-8):
+        self.adam_step += 1
+        for key, grad in grads.items():
+            self.adam_m[key] = beta1 * self.adam_m[key] + (1 - beta1) * grad
+            self.adam_v[key] = beta2 * self.adam_v[key] + (1 - beta2) * grad * grad
+            m_hat = self.adam_m[key] / (1 - beta1 ** self.adam_step)
+            v_hat = self.adam_v[key] / (1 - beta2 ** self.adam_step)
+            self.params[key] = (self.params[key] - self.learning_rate * m_hat / (np.sqrt(v_hat) + eps)).astype(np.float32)
+    
+    def eval_loss(self, batch) -> Tuple[float, int]:
+        loss, tokens, _ = self._forward(batch, train=False)
+        return loss, tokens
+    
+    def _next_logits(self, last: np.ndarray) -> np.ndarray:
+        hidden = self.embedding[last]
+        return hidden @ self.output + self.scale * ((hidden @ self.params["lora_a"]) @ self.params["lora_b"])
+    
+    def prefill(self, ids: List[int]):
+        # A bigram model's whole state is the last token it has seen
+        return int(ids[-1])
+    
+    def generate(self, prompts: List[List[int]], max_tokens: int, temperature: float = 0.0,
+                 cache=None) -> Iterator[List[Tuple[int, int]]]:
+        last = np.array([prompt[-1] if len(prompt) else cache for prompt in prompts])
+        running = np.ones(len(prompts), dtype=bool)
+        stop = np.array(sorted(self.tokenizer.eos_token_ids), dtype=last.dtype)
+        for _ in range(max_tokens):
+            logits = self._next_logits(last)
+            if temperature > 0:
+                logits = logits / temperature
+                logits -= logits.max(axis=-1, keepdims=True)
+                probs = np.exp(logits)
+                probs /= probs.sum(axis=-1, keepdims=True)
+                tokens = (probs.cumsum(axis=-1) > self.rng.random((len(prompts), 1))).argmax(axis=-1)
+            else:
+                tokens = logits.argmax(axis=-1)
+            running &= ~np.isin(tokens, stop)
+            if not running.any():
+                return
+            yield [(row, int(tokens[row])) for row in np.flatnonzero(running)]
+            last = tokens
+    
+    def adapter_state(self) -> Dict[str, np.ndarray]:
+        return {key: value.copy() for key, value in self.params.items()}
+    
+    def load_adapter_state(self, state: Dict[str, np.ndarray]):
+        self.params = {key: np.asarray(state[key], dtype=np.float32) for key in self.params}
+    
+    def optimizer_state(self) -> Dict[str, np.ndarray]:
+        state = {"step": np.array(self.adam_step)}
+        for key in self.params:
+            state[f"m.{key}"] = self.adam_m[key].copy()
+            state[f"v.{key}"] = self.adam_v[key].copy()
+        return state
+    
+    def load_optimizer_state(self, state: Dict[str, np.ndarray]):
+        self.adam_step = int(state["step"])
+        self.adam_m = {key: np.asarray(state[f"m.{key}"], dtype=np.float32) for key in self.params}
+        self.adam_v = {key: np.asarray(state[f"v.{key}"], dtype=np.float32) for key in self.params}
+    
+    def rng_state(self) -> Dict:
+        return self.rng.bit_generator.state
+    
+    def load_rng_state(self, state: Dict):
+        self.rng.bit_generator.state = state
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Resumable Checkpoints for the Qwen3 Trainer
+Adapter, optimizer, RNG and data-position snapshots written on a background
+thread, published by atomic rename and pruned to the last K
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+import instrumentation
+
+CHECKPOINT_PREFIX = "checkpoint_"
+STATE_FILE = "trainer_state.json"
+OPTIMIZER_FILE = "optimizer.npz"
+DEFAULT_KEEP = 3
+
+def checkpoint_dir(output_dir: Path, step: int) -> Path:
+    return Path(output_dir) / f"{CHECKPOINT_PREFIX}{step:07d}"
+
+def list_checkpoints(output_dir: Path) -> List[Path]:
+    """Complete checkpoints in `output_dir`, oldest first.
+    
+    A checkpoint only gets its final name once every file is written, so
+    half-written `.tmp` directories from a crash never show up here.
+    """
+    output_dir = Path(output_dir)
+    if not output_dir.is_dir():
+        return []
+    found = []
+    for path in output_dir.glob(f"{CHECKPOINT_PREFIX}*"):
+        suffix = path.name[len(CHECKPOINT_PREFIX):]
+        if path.is_dir() and suffix.isdigit() and (path / STATE_FILE).exists():
+            found.append((int(suffix), path))
+    return [path for _, path in sorted(found)]
+
+def latest_checkpoint(output_dir: Path) -> Optional[Path]:
+    checkpoints = list_checkpoints(output_dir)
+    return checkpoints[-1] if checkpoints else None
+
+def take_snapshot(backend, step: int, position: int, trained_tokens: int, **extra) -> Dict:
+    """Copy everything a checkpoint needs, on the training thread, before it moves on."""
+    return {
+        "adapter": backend.adapter_state(),
+        "optimizer": backend.optimizer_state(),
+        "state": {
+            "step": step,
+            "position": position,
+            "trained_tokens": trained_tokens,
+            "backend": backend.name,
+            "rng": backend.rng_state(),
+            "created": datetime.now().isoformat(),
+            **extra,
+        },
+    }
+
+def write_checkpoint(backend, snapshot: Dict, output_dir: Path) -> Path:
+    """Write a snapshot to `<tmp dir>` and rename it into place."""
+    final_path = checkpoint_dir(output_dir, snapshot["state"]["step"])
+    tmp_path = final_path.with_name(final_path.name + ".tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    
+    backend.write_adapter(tmp_path, snapshot["adapter"])
+    np.savez(tmp_path / OPTIMIZER_FILE, **snapshot["optimizer"])
+    # Written last: its presence is what marks a checkpoint complete
+    with open(tmp_path / STATE_FILE, 'w') as f:
+        json.dump(snapshot["state"], f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    
+    # The same step saved twice (e.g. Ctrl-C right after a periodic save) replaces the older copy
+    if final_path.exists():
+        shutil.rmtree(final_path)
+    os.replace(tmp_path, final_path)
+    return final_path
+
+def prune_checkpoints(output_dir: Path, keep: int) -> List[Path]:
+    """Delete all but the newest `keep` checkpoints; returns what was removed."""
+    checkpoints = list_checkpoints(output_dir)
+    removed = checkpoints[:-keep] if keep > 0 else []
+    for path in removed:
+        shutil.rmtree(path, ignore_errors=True)
+    return removed
+
+def restore_checkpoint(backend, path: Path) -> Dict:
+    """Load adapter, optimizer and RNG state into `backend`; returns the trainer state."""
+    path = Path(path)
+    with open(path / STATE_FILE, 'r') as f:
+        state = json.load(f)
+    if state.get("backend") != backend.name:
+        raise ValueError(f"{path} was written by the {state.get('backend')} backend, not {backend.name}")
+    backend.load_adapter_state(backend.read_adapter(path))
+    with np.load(path / OPTIMIZER_FILE) as optimizer:
+        backend.load_optimizer_state(dict(optimizer))
+    backend.load_rng_state(state["rng"])
+    return state
+
+class CheckpointWriter:
+    """Writes checkpoint snapshots on a background thread, one at a time.
+    
+    `save` returns as soon as the write has started; a new save first waits
+    for the previous one so at most one snapshot is held in memory. Errors
+    from the thread are raised by the next `save` or by `close`.
+    """
+    
+    def __init__(self, backend, output_dir: Path, keep: int = DEFAULT_KEEP,
+                 on_saved: Optional[Callable[[Path, float], None]] = None):
+        self.backend = backend
+        self.output_dir = Path(output_dir)
+        self.keep = keep
+        self.on_saved = on_saved
+        self._thread = None
+        self._error = None
+    
+    def _write(self, snapshot: Dict):
+        start = time.perf_counter()
+        try:
+            with instrumentation.span("save", step=snapshot["state"]["step"]):
+                path = write_checkpoint(self.backend, snapshot, self.output_dir)
+                prune_checkpoints(self.output_dir, self.keep)
+        except Exception as e:
+            self._error = e
+            return
+        if self.on_saved:
+            self.on_saved(path, time.perf_counter() - start)
+    
+    def save(self, snapshot: Dict):
+        self.wait()
+        self._thread = threading.Thread(target=self._write, args=(snapshot,), name="checkpoint")
+        self._thread.start()
+    
+    def wait(self):
+        """Block until the write in flight (if any) is on disk."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+    
+    def close(self):
+        self.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="List the resumable checkpoints of a training run")
+    parser.add_argument("output_dir", help="The trainer's --output-dir")
+    args = parser.parse_args()
+    
+    checkpoints = list_checkpoints(Path(args.output_dir))
+    if not checkpoints:
+        print(f"❌ No checkpoints in {args.output_dir}")
+        sys.exit(1)
+    for path in checkpoints:
+        with open(path / STATE_FILE, 'r') as f:
+            state = json.load(f)
+        print(f"💾 {path.name}: step {state['step']}, {state['position']} entries read, "
+              f"{state['trained_tokens']} tokens, {state['created'][:19]}")
+
+if __name__ == "__main__":
+    main()
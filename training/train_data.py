@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Training Data Loading for the Qwen3 Trainer
+Random access to prepared splits, tokenisation and padded batch collation,
+with batches built ahead of the training loop on a background thread
+"""
+
+import json
+import queue
+import threading
+from array import array
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+import dataset_io
+import instrumentation
+import jsonl_codec as codec
+from tokenize_dataset import DATASET_MANIFEST, file_checksum, matches_signature, render_chat
+
+DEFAULT_PREFETCH = 4
+
+class Batch(NamedTuple):
+    """Next-token batch: predict `targets` from `inputs` where `mask` is 1."""
+    inputs: np.ndarray
+    targets: np.ndarray
+    mask: np.ndarray
+    tokens: int
+
+class SplitReader:
+    """Entry i of a prepared split, read by seeking to its byte offset.
+    
+    Uses the split's .idx sidecar when the prepare step wrote one and it still
+    matches the split, otherwise indexes the line offsets in one pass (no JSON
+    parsing). Compressed splits are read into memory once instead.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._indexed = None
+        self._lines = None
+        if dataset_io.is_compressed(self.path):
+            with dataset_io.open_dataset(self.path) as f:
+                self._lines = [line for line in f if line.strip()]
+            return
+        if dataset_io.index_path(self.path).exists():
+            try:
+                self._indexed = dataset_io.IndexedDataset(self.path)
+                return
+            except ValueError as e:
+                # A split rewritten after the index was built, e.g. by dedup --apply
+                print(f"⚠️  {e}, indexing its lines instead")
+        offsets = array('Q')
+        pos = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    offsets.append(pos)
+                pos += len(line)
+        self._offsets = offsets
+        self._file = open(self.path, 'rb')
+    
+    def __len__(self) -> int:
+        if self._lines is not None:
+            return len(self._lines)
+        if self._indexed is not None:
+            return len(self._indexed)
+        return len(self._offsets)
+    
+    def raw(self, i: int) -> bytes:
+        if self._lines is not None:
+            return self._lines[i]
+        if self._indexed is not None:
+            return self._indexed.raw(i)
+        self._file.seek(self._offsets[i])
+        return self._file.readline()
+    
+    def __getitem__(self, i: int) -> Dict:
+        return codec.loads(self.raw(i))
+
+class TokenizedSplit:
+    """Token ids of every entry of a split from tokenize_dataset.py --save-ids.
+    
+    `<split>.ids.npy` is memory-mapped and sliced with the offsets implied by
+    `<split>.tokens.npy`, so nothing is tokenized or parsed at train time.
+    """
+    
+    def __init__(self, ids_path: Path, lengths_path: Path):
+        lengths = np.load(lengths_path)
+        self.offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        self.ids = np.load(ids_path, mmap_mode='r')
+        if len(self.ids) != self.offsets[-1]:
+            raise ValueError(f"{ids_path} doesn't match {lengths_path}, re-run tokenize_dataset.py --save-ids")
+    
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+def load_token_ids(path: Path, tokenizer_file: Optional[Path]) -> Optional[TokenizedSplit]:
+    """Pre-tokenized ids of a split, if tokenize_dataset.py saved them.
+    
+    None when there are no sidecars; ValueError when they exist but were made
+    with a different tokenizer or before the split changed.
+    """
+    path = Path(path)
+    split = path.name.split(".")[0]
+    ids_path = path.with_name(f"{split}.ids.npy")
+    manifest_path = path.with_name(DATASET_MANIFEST)
+    if not ids_path.exists() or not manifest_path.exists():
+        return None
+    with open(manifest_path, 'r') as f:
+        tokens = json.load(f).get("tokens", {})
+    if tokenizer_file is None or not Path(tokenizer_file).exists():
+        raise ValueError("the backend's tokenizer has no tokenizer.json to compare against")
+    if tokens.get("tokenizer_checksum") != file_checksum(Path(tokenizer_file)):
+        raise ValueError(f"{ids_path.name} was made with a different tokenizer ({tokens.get('tokenizer')})")
+    if not matches_signature(path, tokens.get(split, {})):
+        raise ValueError(f"{path.name} changed after it was tokenized")
+    return TokenizedSplit(ids_path, path.with_name(f"{split}.tokens.npy"))
+
+def encode_entry(entry: Dict, tokenizer, max_seq_length: int) -> List[int]:
+    """Token ids of an entry in the chat template, cut to `max_seq_length`."""
+    return tokenizer.encode(render_chat(entry))[:max_seq_length]
+
+def collate(sequences: List[Sequence[int]], pad_id: int = 0) -> Batch:
+    """Pad to the longest sequence and shift into inputs/targets."""
+    # At least one input/target pair, even for empty entries
+    width = max(2, max(len(seq) for seq in sequences))
+    tokens = np.full((len(sequences), width), pad_id, dtype=np.int32)
+    mask = np.zeros((len(sequences), width - 1), dtype=np.float32)
+    for row, seq in enumerate(sequences):
+        tokens[row, :len(seq)] = seq
+        mask[row, :max(len(seq) - 1, 0)] = 1.0
+    return Batch(tokens[:, :-1], tokens[:, 1:], mask, int(mask.sum()))
+
+def epoch_order(num_entries: int, seed: int, epoch: int, order: Optional[np.ndarray] = None) -> np.ndarray:
+    """Entry order of one epoch: a precomputed order for the first, seeded shuffles after."""
+    if order is not None and epoch == 0:
+        return order
+    return np.random.default_rng([seed, epoch]).permutation(num_entries)
+
+class BatchLoader:
+    """Endless batches over a split, epoch after epoch.
+    
+    The first epoch follows `<split>.order.npy` (the length-bucketed order
+    from tokenize_dataset.py) when present. `position` is the number of
+    entries consumed so far, so a loader can restart where another stopped.
+    With `token_ids` entries come from the pre-tokenized sidecars and the
+    split itself is never read. A `plan` (from sampling_plan.py) replaces
+    epochs altogether: position i is entry plan[i], cycling if it runs out.
+    """
+    
+    def __init__(self, path: Path, tokenizer, batch_size: int, max_seq_length: int,
+                 seed: int = 42, position: int = 0, token_ids: Optional[TokenizedSplit] = None,
+                 plan: Optional[np.ndarray] = None):
+        self.token_ids = token_ids
+        self.reader = SplitReader(path) if token_ids is None else None
+        if not len(self):
+            raise ValueError(f"{path} has no entries")
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.max_seq_length = max_seq_length
+        self.seed = seed
+        self.position = position
+        self.pad_id = getattr(tokenizer, "pad_token_id", None) or 0
+        
+        order_path = Path(path).with_name(Path(path).name.split(".")[0] + ".order.npy")
+        self.order = np.load(order_path) if order_path.exists() else None
+        if self.order is not None and len(self.order) != len(self):
+            self.order = None
+        self.plan = plan
+        if plan is not None and not len(plan):
+            raise ValueError("The plan is empty")
+        if plan is not None and int(plan.max()) >= len(self):
+            raise ValueError(f"The plan refers to entry {int(plan.max())} but {path} has {len(self)} entries")
+        self._epoch = None
+        self._epoch_order = None
+    
+    def __len__(self) -> int:
+        return len(self.token_ids) if self.token_ids is not None else len(self.reader)
+    
+    def sequence(self, i: int) -> Sequence[int]:
+        """Token ids of entry i, cut to `max_seq_length`."""
+        if self.token_ids is not None:
+            return self.token_ids[i][:self.max_seq_length]
+        return encode_entry(self.reader[i], self.tokenizer, self.max_seq_length)
+    
+    def _indices(self, start: int, count: int) -> List[int]:
+        """Entry indices at loader positions [start, start + count)."""
+        if self.plan is not None:
+            return [int(self.plan[pos % len(self.plan)]) for pos in range(start, start + count)]
+        n = len(self)
+        indices = []
+        for pos in range(start, start + count):
+            epoch, offset = divmod(pos, n)
+            if epoch != self._epoch:
+                self._epoch = epoch
+                self._epoch_order = epoch_order(n, self.seed, epoch, self.order)
+            indices.append(int(self._epoch_order[offset]))
+        return indices
+    
+    def batch_at(self, position: int) -> Batch:
+        """The batch that starts at a loader position."""
+        with instrumentation.span("batch"):
+            return collate([self.sequence(i) for i in self._indices(position, self.batch_size)], self.pad_id)
+    
+    def __iter__(self) -> Iterator[Batch]:
+        return self
+    
+    def __next__(self) -> Batch:
+        batch = self.batch_at(self.position)
+        self.position += self.batch_size
+        return batch
+
+def eval_batches(path: Path, tokenizer, batch_size: int, max_seq_length: int,
+                 num_batches: int, token_ids: Optional[TokenizedSplit] = None) -> List[Batch]:
+    """The first `num_batches` batches of a split in file order (0 = all of it)."""
+    if token_ids is not None:
+        entries = len(token_ids)
+        def sequence(i):
+            return token_ids[i][:max_seq_length]
+    else:
+        reader = SplitReader(path)
+        entries = len(reader)
+        def sequence(i):
+            return encode_entry(reader[i], tokenizer, max_seq_length)
+    count = entries if num_batches <= 0 else min(entries, num_batches * batch_size)
+    batches = []
+    for start in range(0, count, batch_size):
+        sequences = [sequence(i) for i in range(start, min(start + batch_size, count))]
+        batches.append(collate(sequences, getattr(tokenizer, "pad_token_id", None) or 0))
+    return batches
+
+class PrefetchLoader:
+    """Builds a BatchLoader's batches on a background thread, up to `depth` ahead.
+    
+    Tokenization and collation overlap the training step instead of stalling
+    it; the bounded queue caps how much memory the batches ahead can take.
+    `position` is the loader position of the next batch handed out, as on
+    BatchLoader.
+    """
+    
+    def __init__(self, loader: BatchLoader, depth: int = DEFAULT_PREFETCH):
+        self.loader = loader
+        self.batch_size = loader.batch_size
+        self.position = loader.position
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+        self._thread.start()
+    
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _run(self):
+        position = self.position
+        try:
+            while self._put(self.loader.batch_at(position)):
+                position += self.batch_size
+        except Exception as e:
+            # Re-raised on the training thread by __next__
+            self._put(e)
+    
+    def __iter__(self) -> Iterator[Batch]:
+        return self
+    
+    def __next__(self) -> Batch:
+        item = self._queue.get()
+        if isinstance(item, Exception):
+            raise item
+        self.position += self.batch_size
+        return item
+    
+    def close(self):
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Hyperparameter Sweeps for the Qwen3 Trainer
+Expands a grid over mlx_train_qwen3.py arguments and runs it as parallel jobs
+within a memory/core budget on one shared tokenized dataset, stopping
+configurations that fall behind on validation loss
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from mlx_train_qwen3 import METRICS_FILE, QwenThinkingTrainer, build_parser
+from telemetry import system_memory
+from train_checkpoints import latest_checkpoint
+
+SWEEP_RESULTS = "sweep_results.json"
+TRAINER = Path(__file__).resolve().with_name("mlx_train_qwen3.py")
+TOKENIZER = Path(__file__).resolve().with_name("tokenize_dataset.py")
+# Shared by every run of a sweep, so not sweepable
+FIXED_ARGS = ("model_path", "data_path", "output_dir", "resume", "dry_run")
+# Thread pools a job's libraries size from these; each job gets its --job-cores
+THREAD_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS")
+GB = 1 << 30
+
+def parse_grid(specs: List[str], grid_file: Optional[str], parser: argparse.ArgumentParser) -> Dict[str, List]:
+    """`lora-rank=16,64` (and/or a JSON {"lora_rank": [16, 64]}) -> {dest: [typed values]}."""
+    raw = {}
+    if grid_file:
+        with open(grid_file, 'r') as f:
+            raw.update({key: value if isinstance(value, list) else [value] for key, value in json.load(f).items()})
+    for spec in specs:
+        if "=" not in spec:
+            raise ValueError(f"Expected NAME=V1,V2,... in --grid, got {spec!r}")
+        key, values = spec.split("=", 1)
+        raw[key] = values.split(",")
+    
+    actions = {action.dest: action for action in parser._actions}
+    grid = {}
+    for key, values in raw.items():
+        dest = key.lstrip("-").replace("-", "_")
+        if dest not in actions or dest == "help":
+            raise ValueError(f"mlx_train_qwen3.py has no --{dest.replace('_', '-')} to sweep")
+        if dest in FIXED_ARGS:
+            raise ValueError(f"--{dest.replace('_', '-')} is shared by the whole sweep and can't be swept")
+        action = actions[dest]
+        typed = [action.type(value) if action.type and isinstance(value, str) else value for value in values]
+        if action.choices is not None:
+            for value in typed:
+                if value not in action.choices:
+                    raise ValueError(f"{value!r} isn't a valid --{dest.replace('_', '-')} ({', '.join(map(str, action.choices))})")
+        grid[dest] = typed
+    return grid
+
+def expand_grid(grid: Dict[str, List]) -> List[Dict]:
+    """Every combination of the grid's values, in a stable order."""
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+def run_name(overrides: Dict) -> str:
+    """Directory name of a configuration, e.g. `learning_rate-2e-05_lora_rank-16`."""
+    if not overrides:
+        return "run"
+    return "_".join(f"{key}-{value}" for key, value in sorted(overrides.items())).replace("/", "-")
+
+def override_args(overrides: Dict) -> List[str]:
+    args = []
+    for key, value in overrides.items():
+        flag = "--" + key.replace("_", "-")
+        if isinstance(value, bool):
+            if value:
+                args.append(flag)
+        else:
+            args += [flag, str(value)]
+    return args
+
+def read_metrics(path: Path, offset: int = 0) -> Tuple[List[Dict], int]:
+    """Complete records appended to a metrics.jsonl since `offset`, and the new offset."""
+    if not path.exists():
+        return [], offset
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    # A line still being written has no newline yet; pick it up next time
+    end = data.rfind(b"\n") + 1
+    records = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+    return records, offset + end
+
+class SweepJob:
+    """One configuration of the sweep: its trainer process and what it has reported."""
+    
+    def __init__(self, overrides: Dict, base_args: List[str], sweep_dir: Path):
+        self.overrides = overrides
+        self.name = run_name(overrides)
+        self.output_dir = sweep_dir / self.name
+        self.args = base_args + override_args(overrides) + ["--output-dir", str(self.output_dir)]
+        self.process = None
+        self.log = None
+        self.status = "queued"
+        self.evals = {}
+        self.final = {}
+        self.started = None
+        self.finished = None
+        self._offset = 0
+        self._checked_step = 0
+    
+    def best_loss(self, up_to: Optional[int] = None) -> Optional[float]:
+        losses = [loss for step, loss in self.evals.items() if up_to is None or step <= up_to]
+        return min(losses) if losses else None
+    
+    def latest_eval_step(self) -> int:
+        return max(self.evals) if self.evals else 0
+    
+    def poll_metrics(self):
+        records, self._offset = read_metrics(self.output_dir / METRICS_FILE, self._offset)
+        for record in records:
+            if record["event"] == "eval":
+                self.evals[record["step"]] = record["val_loss"]
+            elif record["event"] == "final":
+                self.final = record
+    
+    def start(self, env: Dict[str, str]):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        args = list(self.args)
+        # An interrupted sweep picks its runs up where they stopped
+        if latest_checkpoint(self.output_dir):
+            args.append("--resume")
+            print(f"♻️  {self.name}: resuming from {latest_checkpoint(self.output_dir).name}")
+        self.poll_metrics()
+        self.log = open(self.output_dir / "train.log", 'ab')
+        # Own process group: the sweep decides when its jobs get a Ctrl-C
+        self.process = subprocess.Popen([sys.executable, str(TRAINER)] + args, stdout=self.log,
+                                        stderr=subprocess.STDOUT, env=env, start_new_session=True)
+        self.status = "running"
+        self.started = time.time()
+    
+    def stop(self, status: str):
+        """Ask the trainer to finish its step and checkpoint (it stays resumable)."""
+        if self.process and self.process.poll() is None:
+            self.process.send_signal(signal.SIGINT)
+            self.status = status
+    
+    def check_exit(self) -> bool:
+        """Update the status once the process has exited; True if it just did."""
+        if self.process is None or self.process.poll() is None:
+            return False
+        self.poll_metrics()
+        self.log.close()
+        self.finished = time.time()
+        if self.final.get("status") == "completed":
+            # Finished before a stop request got to it
+            self.status = "completed"
+        elif self.process.returncode != 0 and not self.final:
+            self.status = "failed"
+        elif self.status == "running":
+            self.status = self.final.get("status", "failed")
+        self.process = None
+        return True
+    
+    def result(self) -> Dict:
+        best = self.best_loss()
+        return {
+            "run": self.name,
+            "overrides": self.overrides,
+            "status": self.status,
+            "step": self.final.get("step", self.latest_eval_step()),
+            "best_val_loss": best,
+            "best_step": min((step for step, loss in self.evals.items() if loss == best), default=None),
+            "last_val_loss": self.evals[self.latest_eval_step()] if self.evals else None,
+            "it_per_s": self.final.get("it_per_s"),
+            "tokens_per_s": self.final.get("tokens_per_s"),
+            "wall_s": round(self.finished - self.started, 1) if self.started and self.finished else None,
+            "output_dir": str(self.output_dir),
+        }
+
+def should_stop(job: SweepJob, jobs: List[SweepJob], grace_steps: int, min_peers: int) -> bool:
+    """Median stopping rule: a run whose best loss so far is worse than the median of
+    the other runs' best losses at the same step is unlikely to catch up."""
+    step = job.latest_eval_step()
+    if step < grace_steps or step <= job._checked_step:
+        return False
+    peers = [other.best_loss(step) for other in jobs
+             if other is not job and other.status != "failed" and other.latest_eval_step() >= step]
+    peers = [loss for loss in peers if loss is not None]
+    # A run ahead of its peers is checked again once enough of them reach this step
+    if len(peers) < min_peers:
+        return False
+    job._checked_step = step
+    return job.best_loss(step) > statistics.median(peers)
+
+def job_env(cores: int) -> Dict[str, str]:
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    for var in THREAD_VARS:
+        env[var] = str(cores)
+    return env
+
+def tokenize_once(data_path: Path, model_path: Path, batch_size: int) -> bool:
+    """Save token ids next to the splits unless they're there; every run memory-maps the same ones."""
+    if (data_path / "train.ids.npy").exists():
+        print(f"⚡ Reusing pre-tokenized ids in {data_path}")
+        return True
+    tokenizer = model_path / "tokenizer.json" if model_path.is_dir() else model_path
+    if not tokenizer.exists():
+        print(f"⚠️  No tokenizer.json in {model_path}; every run tokenizes on the fly")
+        return True
+    print(f"🔢 Tokenizing {data_path} once for all runs...")
+    result = subprocess.run([sys.executable, str(TOKENIZER), str(data_path), "--tokenizer", str(tokenizer),
+                             "--save-ids", "--batch-size", str(batch_size)])
+    return result.returncode == 0
+
+def check_data(trainer_parser: argparse.ArgumentParser, job: SweepJob) -> List[str]:
+    """What the trainer would reject about the shared dataset, checked once before any run starts."""
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            trainer = QwenThinkingTrainer(trainer_parser.parse_args(job.args))
+            errors = trainer.validate_config()
+            if not errors:
+                trainer.prepare_data()
+    except (OSError, ValueError, KeyError) as e:
+        errors = [f"loading the dataset failed: {e!r}"]
+    return errors
+
+def print_table(results: List[Dict]):
+    print(f"  {'run':44s} {'status':>11} {'step':>6} {'best val':>9} {'last val':>9} {'it/s':>8} {'tok/s':>9} {'wall':>7}")
+    for result in results:
+        def number(key, fmt):
+            return format(result[key], fmt) if result[key] is not None else "-"
+        print(f"  {result['run'][-44:]:44s} {result['status']:>11} {result['step']:>6} "
+              f"{number('best_val_loss', '9.4f'):>9} {number('last_val_loss', '9.4f'):>9} "
+              f"{number('it_per_s', '8.2f'):>8} {number('tokens_per_s', '9.0f'):>9} "
+              f"{number('wall_s', '6.0f') + 's' if result['wall_s'] is not None else '-':>7}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a grid of mlx_train_qwen3.py configurations in parallel and compare them",
+        epilog="Arguments not listed here (e.g. --iters 500 --backend numpy) go to every run.")
+    parser.add_argument("--model-path", type=str, required=True,
+                        help="Base model shared by all runs")
+    parser.add_argument("--data-path", type=str, required=True,
+                        help="Prepared run directory shared by all runs")
+    parser.add_argument("--output-dir", type=str, required=True,
+                        help="Sweep directory; every run gets a subdirectory named after its settings")
+    parser.add_argument("--grid", nargs="+", default=[], metavar="NAME=V1,V2",
+                        help="Trainer argument values to sweep, e.g. lora-rank=16,64 learning-rate=1e-5,2e-5")
+    parser.add_argument("--grid-file", type=str, default=None,
+                        help='JSON grid, e.g. {"lora_rank": [16, 64], "learning_rate": [1e-5, 2e-5]}')
+    parser.add_argument("--max-jobs", type=int, default=None,
+                        help="Runs at the same time (default: as many as the budget allows)")
+    parser.add_argument("--cores", type=int, default=os.cpu_count() or 1,
+                        help="CPU cores the sweep may use")
+    parser.add_argument("--job-cores", type=int, default=1,
+                        help="Cores per run (also caps its BLAS/OpenMP threads)")
+    parser.add_argument("--memory-gb", type=float, default=None,
+                        help="Memory the sweep may use (default: 80%% of system memory)")
+    parser.add_argument("--job-memory-gb", type=float, default=0.0,
+                        help="Expected peak memory per run; runs only start while it fits")
+    parser.add_argument("--early-stop", choices=["median", "none"], default="median",
+                        help="Stop runs whose best val loss is worse than the median of the others at the same step")
+    parser.add_argument("--grace-steps", type=int, default=0,
+                        help="Never stop a run before this step")
+    parser.add_argument("--min-peers", type=int, default=2,
+                        help="Runs that must have reached a step before it's used to stop others")
+    parser.add_argument("--no-tokenize", action="store_true",
+                        help="Don't pre-tokenize the shared dataset before the runs start")
+    parser.add_argument("--poll-interval", type=float, default=1.0,
+                        help="Seconds between checks on the running jobs")
+    args, trainer_args = parser.parse_known_args()
+    
+    trainer_parser = build_parser()
+    base_args = ["--model-path", args.model_path, "--data-path", args.data_path] + trainer_args
+    try:
+        grid = parse_grid(args.grid, args.grid_file, trainer_parser)
+    except (ValueError, OSError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    configurations = expand_grid(grid)
+    sweep_dir = Path(args.output_dir)
+    jobs = [SweepJob(overrides, base_args, sweep_dir) for overrides in configurations]
+    
+    # Every configuration is checked up front, so a typo doesn't surface hours in
+    for job in jobs:
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                namespace = trainer_parser.parse_args(job.args)
+                errors = QwenThinkingTrainer(namespace).validate_config()
+        except SystemExit:
+            errors = [f"invalid trainer arguments: {' '.join(job.args)}"]
+        if errors:
+            for error in errors:
+                print(f"❌ {job.name}: {error}")
+            sys.exit(1)
+    
+    memory = system_memory()
+    memory_budget = args.memory_gb * GB if args.memory_gb else (memory["total"] or 0) * 0.8
+    if args.job_memory_gb * GB > memory_budget > 0:
+        print(f"❌ A run needs {args.job_memory_gb:g} GB but the budget is {memory_budget / GB:.1f} GB")
+        sys.exit(1)
+    max_jobs = max(1, args.cores // max(args.job_cores, 1))
+    if args.job_memory_gb and memory_budget:
+        max_jobs = min(max_jobs, max(1, int(memory_budget // (args.job_memory_gb * GB))))
+    if args.max_jobs:
+        max_jobs = min(max_jobs, args.max_jobs)
+    
+    print("🧪 Training Sweep")
+    print("=" * 60)
+    print(f"📁 Data: {args.data_path}")
+    print(f"🔧 {len(jobs)} configurations over {', '.join(grid) or 'nothing (single run)'}")
+    print(f"⚡ Up to {max_jobs} at a time, {args.job_cores} core(s) each"
+          + (f", {args.job_memory_gb:g} GB each of {memory_budget / GB:.1f} GB" if args.job_memory_gb else ""))
+    
+    sweep_dir.mkdir(parents=True, exist_ok=True)
+    batch_size = trainer_parser.parse_args(base_args + ["--output-dir", str(sweep_dir)]).batch_size
+    if not args.no_tokenize and not tokenize_once(Path(args.data_path), Path(args.model_path), batch_size):
+        print("❌ Tokenizing the shared dataset failed")
+        sys.exit(1)
+    # Again after tokenizing, which may have added or rewritten files in the data dir
+    for error in check_data(trainer_parser, jobs[0]):
+        print(f"❌ {error}")
+        sys.exit(1)
+    
+    # Runs an earlier invocation of this sweep completed or stopped early are kept as they are
+    previous = {}
+    if (sweep_dir / SWEEP_RESULTS).exists():
+        with open(sweep_dir / SWEEP_RESULTS, 'r') as f:
+            previous = {run["run"]: run["status"] for run in json.load(f)["runs"]}
+    for job in jobs:
+        job.poll_metrics()
+        if job.final.get("status") == "completed" or previous.get(job.name) == "stopped":
+            job.status = "completed" if job.final.get("status") == "completed" else "stopped"
+            print(f"✅ {job.name}: already {job.status}")
+    queue = [job for job in jobs if job.status == "queued"]
+    
+    env = job_env(args.job_cores)
+    interrupted = False
+    
+    def request_stop(signum, frame):
+        nonlocal interrupted
+        interrupted = True
+    
+    previous_handler = signal.signal(signal.SIGINT, request_stop)
+    print(f"\n🚀 Starting sweep at {datetime.now().isoformat()}")
+    try:
+        while queue or any(job.process for job in jobs):
+            running = [job for job in jobs if job.process]
+            for job in running:
+                job.poll_metrics()
+                if job.check_exit():
+                    best = job.best_loss()
+                    print(f"{'❌' if job.status == 'failed' else '✅'} {job.name}: {job.status}"
+                          + (f", best val loss {best:.4f}" if best is not None else "")
+                          + (f" (see {job.output_dir / 'train.log'})" if job.status == "failed" else ""))
+                elif args.early_stop == "median" and job.status == "running" \
+                        and should_stop(job, jobs, args.grace_steps, args.min_peers):
+                    print(f"✂️  {job.name}: val loss {job.best_loss():.4f} at step {job.latest_eval_step()} "
+                          f"is behind the median, stopping")
+                    job.stop("stopped")
+            
+            if interrupted:
+                for job in jobs:
+                    job.stop("interrupted")
+                queue = []
+            
+            running = [job for job in jobs if job.process]
+            while queue and len(running) < max_jobs:
+                if running and args.job_memory_gb:
+                    available = system_memory()["available"]
+                    if available is not None and available < args.job_memory_gb * GB:
+                        break
+                job = queue.pop(0)
+                print(f"▶️  {job.name}: starting ({len(running) + 1} running, {len(queue)} queued)")
+                job.start(env)
+                running.append(job)
+            time.sleep(args.poll_interval)
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+    
+    results = sorted((job.result() for job in jobs),
+                     key=lambda result: (result["best_val_loss"] is None, result["best_val_loss"] or 0.0))
+    print("\n📊 Comparison (best validation loss first)")
+    print_table(results)
+    
+    report = {
+        "created": datetime.now().isoformat(),
+        "model": args.model_path,
+        "data": args.data_path,
+        "grid": grid,
+        "trainer_args": trainer_args,
+        "early_stop": args.early_stop,
+        "runs": results,
+    }
+    with open(sweep_dir / SWEEP_RESULTS, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Saved results to: {sweep_dir / SWEEP_RESULTS}")
+    
+    print("\n" + "=" * 60)
+    if interrupted:
+        print("⚠️  Sweep interrupted; run the same command again to continue it")
+        sys.exit(1)
+    failed = [result["run"] for result in results if result["status"] == "failed"]
+    if failed:
+        print(f"❌ {len(failed)} of {len(results)} runs failed: {', '.join(failed)}")
+        sys.exit(1)
+    print("✅ Sweep complete!")
+
+if __name__ == "__main__":
+    main()
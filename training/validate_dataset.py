@@ -4,23 +4,244 @@ Dataset Validation Script for Qwen3 Thinking Model Training
 Ensures data quality and thinking tag presence
 """
 
+import argparse
+import contextlib
+import hashlib
 import json
+import math
+import os
+import random
 import sys
+import time
+import zlib
 from pathlib import Path
 from collections import Counter
-from typing import Dict, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+from typing import Dict, List, Optional, Tuple
 import re
 
+import dataset_io
+import instrumentation
+import jsonl_codec as codec
+
+# Chunks per worker, so one slow chunk doesn't leave the rest of the pool idle
+CHUNKS_PER_WORKER = 4
+# Error strings kept verbatim for the report; the rest are only counted
+MAX_KEPT_ERRORS = 100
+# Incremental validation: line-aligned chunks between these sizes, ended by a
+# line whose CRC32 has the anchor bits clear (about one line in 1024)
+CHUNK_MIN_BYTES = 8 << 20
+CHUNK_MAX_BYTES = 64 << 20
+CHUNK_ANCHOR_MASK = 0x3FF
+CHUNK_INDEX_SUFFIX = ".chunks.json"
+# Bump whenever a rule changes what an entry's stats or errors are, so cached
+# chunk stats from the old rules aren't reused (2: leading </think> accepted)
+VALIDATOR_VERSION = 2
+
+_ERROR_LOCATION = re.compile(r'^Line \d+(?:, Message \d+)?: ')
+_ERROR_LINE = re.compile(r'^Line (\d+)')
+_THINK_TAG = re.compile(r'<(/?)think>')
+_POLISH_CHAR = re.compile('[ąćęłńóśźżĄĆĘŁŃÓŚŹŻ]')
+
+class QuantileSketch:
+    """Log-bucketed histogram (DDSketch-style) for streaming percentiles.
+    
+    Estimates stay within `relative_accuracy` of the true value, memory is
+    bounded by the log of the value range, and merging two sketches is exact,
+    so chunked and sequential runs report the same percentiles.
+    """
+    
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = Counter()
+        self.zero_count = 0
+        self.count = 0
+    
+    def add(self, value: float):
+        if value <= 0:
+            self.zero_count += 1
+        else:
+            self.buckets[math.ceil(math.log(value) / self.log_gamma)] += 1
+        self.count += 1
+    
+    def merge(self, other: "QuantileSketch"):
+        self.buckets.update(other.buckets)
+        self.zero_count += other.zero_count
+        self.count += other.count
+    
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+    
+    def to_dict(self) -> Dict:
+        return {"gamma": self.gamma, "zero_count": self.zero_count, "count": self.count,
+                "buckets": sorted(self.buckets.items())}
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "QuantileSketch":
+        sketch = cls()
+        sketch.gamma = data["gamma"]
+        sketch.log_gamma = math.log(sketch.gamma)
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch.buckets = Counter({key: count for key, count in data["buckets"]})
+        return sketch
+
+class StreamingStats:
+    """Constant-memory count/sum/min/max plus percentiles of a value stream."""
+    
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.sketch = QuantileSketch()
+    
+    def add(self, value: int):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.sketch.add(value)
+    
+    def merge(self, other: "StreamingStats"):
+        if other.count == 0:
+            return
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.sketch.merge(other.sketch)
+    
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+    
+    def percentile(self, q: float) -> float:
+        """Approximate q-quantile (0..1), clamped to the exact min/max."""
+        if self.count == 0:
+            return 0.0
+        return min(max(self.sketch.quantile(q), self.min), self.max)
+    
+    def to_dict(self) -> Dict:
+        return {"count": self.count, "total": self.total, "min": self.min, "max": self.max,
+                "sketch": self.sketch.to_dict()}
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "StreamingStats":
+        stats = cls()
+        stats.count = data["count"]
+        stats.total = data["total"]
+        stats.min = data["min"]
+        stats.max = data["max"]
+        stats.sketch = QuantileSketch.from_dict(data["sketch"])
+        return stats
+
+class ErrorReservoir:
+    """Keeps the first `capacity` error strings and exact counts per error type."""
+    
+    def __init__(self, capacity: int = MAX_KEPT_ERRORS):
+        self.capacity = capacity
+        self.kept = []
+        self.total = 0
+        self.by_type = Counter()
+    
+    def add(self, error: str):
+        self.total += 1
+        self.by_type[error_type(error)] += 1
+        if len(self.kept) < self.capacity:
+            self.kept.append(error)
+    
+    def extend(self, errors: List[str]):
+        for error in errors:
+            self.add(error)
+    
+    def merge(self, other: "ErrorReservoir"):
+        self.total += other.total
+        self.by_type.update(other.by_type)
+        self.kept.extend(other.kept[:self.capacity - len(self.kept)])
+    
+    def __len__(self) -> int:
+        return self.total
+    
+    def rebase(self, delta: int):
+        """Shift the line numbers of the kept errors by `delta` lines."""
+        self.kept = [_ERROR_LINE.sub(lambda m: f"Line {int(m.group(1)) + delta}", error, count=1)
+                     for error in self.kept]
+    
+    def to_dict(self) -> Dict:
+        return {"capacity": self.capacity, "kept": self.kept, "total": self.total,
+                "by_type": dict(self.by_type)}
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ErrorReservoir":
+        reservoir = cls(data["capacity"])
+        reservoir.kept = list(data["kept"])
+        reservoir.total = data["total"]
+        reservoir.by_type = Counter(data["by_type"])
+        return reservoir
+
+def scan_think_blocks(content: str) -> Tuple[List[int], Optional[str]]:
+    """Find every <think>...</think> block in one pass over the tags.
+    
+    Returns the length of each complete block and a description of the
+    first unbalanced tag (stray close, nested or unclosed open), if any.
+    A leading </think> closes a block opened by the prompt, as the
+    Qwen3-Thinking-2507 chat template does.
+    """
+    lengths = []
+    problem = None
+    open_end = None
+    for tag in _THINK_TAG.finditer(content):
+        if tag.group(1):
+            if open_end is None and not (lengths or problem):
+                lengths.append(tag.start())
+            elif open_end is None:
+                problem = problem or "Unbalanced </think> without <think>"
+            else:
+                lengths.append(tag.start() - open_end)
+                open_end = None
+        elif open_end is not None:
+            problem = problem or "Nested <think> tag"
+        else:
+            open_end = tag.end()
+    if open_end is not None:
+        problem = problem or "Unclosed <think> tag"
+    return lengths, problem
+
+def error_type(error: str) -> str:
+    """Collapse an error message to its type, e.g. "JSON decode error"."""
+    return _ERROR_LOCATION.sub('', error, count=1).split(' - ', 1)[0]
+
 class DatasetValidator:
-    def __init__(self, dataset_path: str):
+    def __init__(self, dataset_path: str, max_errors: Optional[int] = None):
         self.dataset_path = Path(dataset_path)
-        self.stats = {
+        # Stop reading once this many errors were seen; None scans everything
+        self.max_errors = max_errors
+        self.stopped_early = False
+        self.stats = self.new_stats()
+    
+    @staticmethod
+    def new_stats() -> Dict:
+        return {
             "total_entries": 0,
             "valid_entries": 0,
             "thinking_entries": 0,
-            "errors": [],
-            "message_lengths": [],
-            "thinking_lengths": [],
+            "errors": ErrorReservoir(),
+            "message_lengths": StreamingStats(),
+            "thinking_lengths": StreamingStats(),
             "role_distribution": Counter(),
             "language_stats": Counter(),
         }
@@ -58,37 +279,55 @@ class DatasetValidator:
                 errors.append(f"Line {line_num}, Message {idx}: Missing 'content'")
                 continue
             
-            role = msg["role"]
-            content = msg["content"]
-            
-            # Track role distribution
-            self.stats["role_distribution"][role] += 1
-            
-            # Check for thinking tags in assistant messages
-            if role == "assistant":
-                if "<think>" in content and "</think>" in content:
-                    has_thinking = True
-                    # Extract thinking content
-                    thinking_match = re.search(r'<think>(.*?)</think>', content, re.DOTALL)
-                    if thinking_match:
-                        thinking_content = thinking_match.group(1)
-                        self.stats["thinking_lengths"].append(len(thinking_content))
-            
-            # Track message lengths
-            self.stats["message_lengths"].append(len(content))
-            
-            # Detect language (simplified check for Polish)
-            if any(char in content for char in "ąćęłńóśźżĄĆĘŁŃÓŚŹŻ"):
-                self.stats["language_stats"]["polish"] += 1
-            else:
-                self.stats["language_stats"]["other"] += 1
+            if self._record_message(msg["role"], msg["content"], line_num, idx, errors):
+                has_thinking = True
+        
+        if has_thinking:
+            self.stats["thinking_entries"] += 1
+        
+        return len(errors) == 0, errors
+    
+    def validate_conversation(self, conversation: "codec.Conversation", line_num: int) -> Tuple[bool, List[str]]:
+        """Validate an entry the typed decoder already checked structurally."""
+        errors = []
+        has_thinking = False
+        for idx, msg in enumerate(conversation.messages):
+            if self._record_message(msg.role, msg.content, line_num, idx, errors):
+                has_thinking = True
         
         if has_thinking:
             self.stats["thinking_entries"] += 1
         
         return len(errors) == 0, errors
     
-    def validate_dataset(self) -> Dict:
+    def _record_message(self, role, content, line_num: int, idx: int, errors: List[str]) -> bool:
+        """Check one well-formed message and track its stats; True if it thinks."""
+        has_thinking = False
+        
+        # Track role distribution
+        self.stats["role_distribution"][role] += 1
+        
+        # Check for thinking tags in assistant messages
+        if role == "assistant":
+            think_lengths, problem = scan_think_blocks(content)
+            if problem:
+                errors.append(f"Line {line_num}, Message {idx}: {problem}")
+            for think_length in think_lengths:
+                self.stats["thinking_lengths"].add(think_length)
+            has_thinking = bool(think_lengths)
+        
+        # Track message lengths
+        self.stats["message_lengths"].add(len(content))
+        
+        # Detect language (simplified check for Polish)
+        if _POLISH_CHAR.search(content):
+            self.stats["language_stats"]["polish"] += 1
+        else:
+            self.stats["language_stats"]["other"] += 1
+        
+        return has_thinking
+    
+    def validate_dataset(self, workers: int = 1) -> Dict:
         """Validate entire dataset and return statistics."""
         print(f"🔍 Validating dataset: {self.dataset_path}")
         print("=" * 60)
@@ -97,41 +336,311 @@ class DatasetValidator:
             print(f"❌ Dataset file not found: {self.dataset_path}")
             return self.stats
         
-        with open(self.dataset_path, 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f, 1):
-                self.stats["total_entries"] += 1
+        if workers > 1 and dataset_io.is_compressed(self.dataset_path):
+            print("⚠️  Compressed input can't be split into byte ranges, validating in one process")
+            workers = 1
+        
+        if workers > 1:
+            self._validate_parallel(workers)
+        else:
+            self.validate_range(0, None, 1)
+        
+        return self.stats
+    
+    def validate_range(self, start: int, end: Optional[int], first_line: int,
+                       show_progress: bool = True) -> int:
+        """Validate the lines in the byte range [start, end) of the dataset.
+        
+        `start` must sit on a line boundary and `first_line` is the 1-based
+        number of the line starting there. Returns the next line number.
+        """
+        line_num = first_line
+        with instrumentation.span("read"), dataset_io.open_dataset(self.dataset_path) as f:
+            if start:
+                dataset_io.seek_forward(f, start)
+            pos = start
+            for raw in f:
+                if end is not None and pos >= end:
+                    break
+                pos += len(raw)
+                self.check_line(raw, line_num)
                 
-                try:
-                    entry = json.loads(line.strip())
-                    is_valid, errors = self.validate_entry(entry, line_num)
-                    
-                    if is_valid:
-                        self.stats["valid_entries"] += 1
-                    else:
-                        self.stats["errors"].extend(errors)
-                    
-                    # Progress indicator
-                    if line_num % 1000 == 0:
-                        print(f"  Validated {line_num} entries...")
-                        
-                except json.JSONDecodeError as e:
-                    self.stats["errors"].append(f"Line {line_num}: JSON decode error - {e}")
-                except Exception as e:
-                    self.stats["errors"].append(f"Line {line_num}: Unexpected error - {e}")
+                # Progress indicator
+                if show_progress and line_num % 1000 == 0:
+                    print(f"  Validated {line_num} entries...")
+                line_num += 1
+                
+                if self.error_limit_reached():
+                    self.stopped_early = True
+                    break
+        
+        instrumentation.count("lines", line_num - first_line)
+        instrumentation.count("bytes", pos - start)
+        return line_num
+    
+    def validate_incremental(self, workers: int = 1, index_path: Optional[Path] = None) -> Dict:
+        """Re-parse only the chunks whose digest isn't in the chunk index sidecar.
+        
+        Unchanged chunks reuse their cached stats, with error line numbers
+        moved to where the chunk sits now, and everything is merged in file
+        order, so the report matches a full scan. A small edit then costs a
+        hash pass plus parsing the chunk or two around it.
+        """
+        print(f"🔍 Validating dataset: {self.dataset_path} (incremental)")
+        print("=" * 60)
+        
+        index_path = index_path or chunk_index_path(self.dataset_path)
+        # Error messages depend on the JSON backend, so a backend switch invalidates the cache
+        params = {"min_bytes": CHUNK_MIN_BYTES, "max_bytes": CHUNK_MAX_BYTES,
+                  "anchor_mask": CHUNK_ANCHOR_MASK, "json_backend": codec.BACKEND,
+                  "validator_version": VALIDATOR_VERSION}
+        cached = {}
+        if index_path.exists():
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            if index.get("params") == params:
+                cached = {chunk["digest"]: chunk for chunk in index["chunks"]}
+        
+        print(f"🔐 Hashing chunks...")
+        with instrumentation.span("hash"):
+            chunks = content_chunks(self.dataset_path)
+        next_line = 1
+        for chunk in chunks:
+            chunk["first_line"] = next_line
+            next_line += chunk["lines"]
+        dirty = [chunk for chunk in chunks if chunk["digest"] not in cached]
+        dirty_mb = sum(chunk["end"] - chunk["start"] for chunk in dirty) / 1e6
+        print(f"♻️  Reusing {len(chunks) - len(dirty)} of {len(chunks)} chunks, "
+              f"re-validating {len(dirty)} ({dirty_mb:.1f} MB)")
+        
+        path = str(self.dataset_path)
+        args = ([path] * len(dirty), [c["start"] for c in dirty], [c["end"] for c in dirty],
+                [c["first_line"] for c in dirty])
+        if workers > 1 and len(dirty) > 1:
+            with instrumentation.span("validate-pool", workers=workers), \
+                    ProcessPoolExecutor(max_workers=workers) as pool:
+                fresh = list(pool.map(_validate_chunk, *args))
+        else:
+            fresh = list(map(_validate_chunk, *args))
+        fresh = iter(fresh)
+        
+        for chunk in chunks:
+            entry = cached.get(chunk["digest"])
+            if entry:
+                stats = stats_from_dict(entry["stats"])
+                stats["errors"].rebase(chunk["first_line"] - entry["first_line"])
+            else:
+                stats, _ = next(fresh)
+            self.merge_stats(stats)
+            chunk["stats"] = stats_to_dict(stats)
         
+        tmp_path = index_path.with_name(index_path.name + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({"params": params, "chunks": chunks}, f)
+        os.replace(tmp_path, index_path)
+        print(f"💾 Saved chunk index to: {index_path}")
         return self.stats
     
+    def validate_sample(self, sample_size: int, seed: int = 42) -> int:
+        """Validate the lines that start after `sample_size` random byte offsets.
+        
+        Each offset is moved to the start of the next line, so a line is picked
+        with probability proportional to the length of the line before it;
+        neighbouring lengths are unrelated to validity, so estimates stay
+        unbiased in practice. Offsets are visited in file order to keep the
+        seeks short. Error messages carry byte offsets, not line numbers.
+        Returns the number of lines sampled.
+        """
+        size = os.path.getsize(self.dataset_path)
+        if not size:
+            return 0
+        rng = random.Random(seed)
+        offsets = sorted(rng.randrange(size) for _ in range(sample_size))
+        starts = []
+        
+        with instrumentation.span("read"), open(self.dataset_path, 'rb') as f:
+            for sample_num, offset in enumerate(offsets, 1):
+                if offset:
+                    # From the byte before, so an offset already at a line start keeps that line
+                    f.seek(offset - 1)
+                    f.readline()
+                raw = f.readline()
+                if not raw:
+                    # Past the last line start: wrap around to the first line
+                    f.seek(0)
+                    raw = f.readline()
+                starts.append(f.tell() - len(raw))
+                self.check_line(raw, sample_num)
+                
+                if self.error_limit_reached():
+                    self.stopped_early = True
+                    break
+        
+        errors = self.stats["errors"]
+        errors.kept = [_ERROR_LINE.sub(lambda m: f"Offset {starts[int(m.group(1)) - 1]}", error, count=1)
+                       for error in errors.kept]
+        return len(starts)
+    
+    def check_line(self, raw: bytes, line_num: int) -> bool:
+        """Parse and validate one raw JSONL line, recording it in the stats."""
+        self.stats["total_entries"] += 1
+        
+        try:
+            # Schema-typed decode when available; anything it rejects goes
+            # through the dict checks below for a precise error message
+            with instrumentation.span("parse"):
+                conversation = codec.decode_conversation(raw)
+                entry = codec.loads(raw) if conversation is None else None
+            with instrumentation.span("validate"):
+                if conversation is not None:
+                    is_valid, errors = self.validate_conversation(conversation, line_num)
+                else:
+                    is_valid, errors = self.validate_entry(entry, line_num)
+            
+            if is_valid:
+                self.stats["valid_entries"] += 1
+            else:
+                self.stats["errors"].extend(errors)
+            return is_valid
+            
+        except codec.DecodeError as e:
+            self.stats["errors"].add(f"Line {line_num}: JSON decode error - {e}")
+        except Exception as e:
+            self.stats["errors"].add(f"Line {line_num}: Unexpected error - {e}")
+        return False
+    
+    def error_limit_reached(self) -> bool:
+        return self.max_errors is not None and self.stats["errors"].total >= self.max_errors
+    
+    def passed(self) -> bool:
+        """Whether the dataset is fit for training: non-empty, fully read, all valid, with thinking."""
+        return (self.stats["total_entries"] > 0
+                and not self.stopped_early
+                and self.stats["valid_entries"] == self.stats["total_entries"]
+                and self.stats["thinking_entries"] > 0)
+    
+    def summary(self) -> Dict:
+        """Plain-number summary of the stats, for manifests and reports."""
+        errors = self.stats["errors"]
+        return {
+            "total_entries": self.stats["total_entries"],
+            "valid_entries": self.stats["valid_entries"],
+            "invalid_entries": self.stats["total_entries"] - self.stats["valid_entries"],
+            "thinking_entries": self.stats["thinking_entries"],
+            "error_count": errors.total,
+            "error_types": dict(errors.by_type.most_common()),
+        }
+    
+    def report(self) -> Dict:
+        """Everything `print_report` shows, as JSON-serialisable data."""
+        total = self.stats["total_entries"]
+        return {
+            "dataset": str(self.dataset_path),
+            "passed": self.passed(),
+            "stopped_early": self.stopped_early,
+            "max_errors": self.max_errors,
+            **self.summary(),
+            "thinking_coverage": self.stats["thinking_entries"] / total if total else 0.0,
+            "messages": {
+                "total": sum(self.stats["role_distribution"].values()),
+                "role_distribution": dict(self.stats["role_distribution"].most_common()),
+                "length": length_report(self.stats["message_lengths"]),
+            },
+            "thinking_length": length_report(self.stats["thinking_lengths"]),
+            "language_distribution": dict(self.stats["language_stats"].most_common()),
+            "errors": list(self.stats["errors"].kept),
+        }
+    
+    def sample_report(self, confidence: float = 0.95, max_error_rate: float = 0.01, seed: int = 42) -> Dict:
+        """Estimates with confidence intervals from a `validate_sample` run.
+        
+        Rates use Wilson score intervals; length percentile intervals are the
+        distribution-free order-statistic bounds, read off the sketch. The
+        sample is a go when the error rate's upper bound is within
+        `max_error_rate` and some entries have <think> tags.
+        """
+        n = self.stats["total_entries"]
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        invalid = n - self.stats["valid_entries"]
+        error_low, error_high = wilson_interval(invalid, n, z)
+        think_low, think_high = wilson_interval(self.stats["thinking_entries"], n, z)
+        return {
+            "dataset": str(self.dataset_path),
+            "mode": "sample",
+            "sample_size": n,
+            "seed": seed,
+            "confidence": confidence,
+            "max_error_rate": max_error_rate,
+            "go": n > 0 and error_high <= max_error_rate and self.stats["thinking_entries"] > 0,
+            "stopped_early": self.stopped_early,
+            "error_rate": {"estimate": invalid / n if n else 0.0, "low": error_low, "high": error_high},
+            "think_coverage": {"estimate": self.stats["thinking_entries"] / n if n else 0.0,
+                               "low": think_low, "high": think_high},
+            "message_length": percentile_intervals(self.stats["message_lengths"], z),
+            "thinking_length": percentile_intervals(self.stats["thinking_lengths"], z),
+            "error_types": dict(self.stats["errors"].by_type.most_common()),
+            "errors": list(self.stats["errors"].kept),
+        }
+    
+    def merge_stats(self, other: Dict):
+        """Fold the stats of another validator (e.g. a chunk) into ours."""
+        for key, value in other.items():
+            if hasattr(value, "merge"):
+                self.stats[key].merge(value)
+            elif isinstance(value, Counter):
+                self.stats[key].update(value)
+            elif isinstance(value, list):
+                self.stats[key].extend(value)
+            else:
+                self.stats[key] += value
+    
+    def _validate_parallel(self, workers: int):
+        """Validate newline-aligned byte ranges in a process pool.
+        
+        Chunks are merged in file order, so the stats (and the report) are
+        identical to a single-process run. With `max_errors` every chunk
+        stops at the limit and chunks after the one that crosses it are
+        cancelled, so the counts then cover a bit more than a sequential run.
+        Chunks number their lines from 1 and are moved to their place while
+        merging, so nothing reads the file before validation starts.
+        """
+        boundaries = chunk_boundaries(self.dataset_path, workers * CHUNKS_PER_WORKER)
+        ranges = list(zip(boundaries[:-1], boundaries[1:]))
+        path = str(self.dataset_path)
+        
+        with instrumentation.span("validate-pool", workers=workers), \
+                ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(_validate_chunk, [path] * len(ranges),
+                               [s for s, _ in ranges], [e for _, e in ranges], [1] * len(ranges),
+                               [self.max_errors] * len(ranges))
+            first_line = 1
+            for chunk_stats, count in results:
+                chunk_stats["errors"].rebase(first_line - 1)
+                self.merge_stats(chunk_stats)
+                if self.error_limit_reached():
+                    self.stopped_early = True
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    break
+                # Same progress lines as the sequential scan, emitted per chunk
+                for line_num in range(-(-first_line // 1000) * 1000, first_line + count, 1000):
+                    print(f"  Validated {line_num} entries...")
+                first_line += count
+    
     def print_report(self):
         """Print validation report."""
         print("\n" + "=" * 60)
         print("📊 VALIDATION REPORT")
         print("=" * 60)
         
+        total = self.stats['total_entries']
         print(f"\n📈 Dataset Statistics:")
-        print(f"  Total entries: {self.stats['total_entries']}")
+        print(f"  Total entries: {total}")
         print(f"  Valid entries: {self.stats['valid_entries']}")
-        print(f"  Invalid entries: {self.stats['total_entries'] - self.stats['valid_entries']}")
-        print(f"  Entries with <think> tags: {self.stats['thinking_entries']} ({self.stats['thinking_entries']/self.stats['total_entries']*100:.1f}%)")
+        print(f"  Invalid entries: {total - self.stats['valid_entries']}")
+        print(f"  Entries with <think> tags: {self.stats['thinking_entries']} ({self.stats['thinking_entries']/total*100 if total else 0:.1f}%)")
+        if self.stopped_early:
+            print(f"  ⏹️  Stopped after {self.stats['errors'].total} errors (limit {self.max_errors}), "
+                  f"the rest of the file was not read")
         
         print(f"\n💬 Message Statistics:")
         print(f"  Total messages: {sum(self.stats['role_distribution'].values())}")
@@ -139,49 +648,276 @@ class DatasetValidator:
         for role, count in self.stats['role_distribution'].most_common():
             print(f"    - {role}: {count}")
         
-        if self.stats['message_lengths']:
-            avg_msg_length = sum(self.stats['message_lengths']) / len(self.stats['message_lengths'])
-            print(f"  Average message length: {avg_msg_length:.0f} chars")
-            print(f"  Max message length: {max(self.stats['message_lengths'])} chars")
+        msg_lengths = self.stats['message_lengths']
+        if msg_lengths.count:
+            print(f"  Average message length: {msg_lengths.mean():.0f} chars")
+            print(f"  Max message length: {msg_lengths.max} chars")
+            print(f"  Message length p50/p90/p99: {format_percentiles(msg_lengths)} chars")
         
-        if self.stats['thinking_lengths']:
-            avg_think_length = sum(self.stats['thinking_lengths']) / len(self.stats['thinking_lengths'])
+        think_lengths = self.stats['thinking_lengths']
+        if think_lengths.count:
             print(f"\n🧠 Thinking Tag Statistics:")
-            print(f"  Average thinking length: {avg_think_length:.0f} chars")
-            print(f"  Max thinking length: {max(self.stats['thinking_lengths'])} chars")
+            print(f"  Average thinking length: {think_lengths.mean():.0f} chars")
+            print(f"  Max thinking length: {think_lengths.max} chars")
+            print(f"  Thinking length p50/p90/p99: {format_percentiles(think_lengths)} chars")
         
         print(f"\n🌍 Language Distribution:")
         for lang, count in self.stats['language_stats'].most_common():
             print(f"  - {lang}: {count}")
         
-        if self.stats['errors']:
-            print(f"\n⚠️  Errors Found ({len(self.stats['errors'])} total):")
+        errors = self.stats['errors']
+        if errors.total:
+            print(f"\n⚠️  Errors Found ({errors.total} total):")
             # Show first 10 errors
-            for error in self.stats['errors'][:10]:
+            for error in errors.kept[:10]:
                 print(f"  - {error}")
-            if len(self.stats['errors']) > 10:
-                print(f"  ... and {len(self.stats['errors']) - 10} more errors")
+            if errors.total > 10:
+                print(f"  ... and {errors.total - 10} more errors")
+            print(f"  Error types:")
+            for kind, count in errors.by_type.most_common():
+                print(f"    - {kind}: {count}")
         else:
             print(f"\n✅ No errors found! Dataset is clean!")
         
         # Final verdict
         print("\n" + "=" * 60)
-        if self.stats['valid_entries'] == self.stats['total_entries'] and self.stats['thinking_entries'] > 0:
+        if self.passed():
             print("🎉 DATASET VALIDATED SUCCESSFULLY!")
             print(f"   Ready for Qwen3-30B thinking model training!")
+        elif not total:
+            print("⚠️  DATASET NEEDS ATTENTION")
+            print(f"   No entries found.")
         else:
             print("⚠️  DATASET NEEDS ATTENTION")
             print(f"   Fix the errors before training.")
 
+def print_sample_report(report: Dict):
+    """Print the estimates of a sampled validation run."""
+    confidence = f"{report['confidence']*100:g}%"
+    print("\n" + "=" * 60)
+    print("🎲 SAMPLED VALIDATION REPORT")
+    print("=" * 60)
+    
+    print(f"\n📈 Estimates from {report['sample_size']} sampled entries ({confidence} intervals):")
+    error_rate = report["error_rate"]
+    print(f"  Error rate: {error_rate['estimate']*100:.2f}% "
+          f"[{error_rate['low']*100:.2f}% - {error_rate['high']*100:.2f}%]")
+    coverage = report["think_coverage"]
+    print(f"  <think> coverage: {coverage['estimate']*100:.1f}% "
+          f"[{coverage['low']*100:.1f}% - {coverage['high']*100:.1f}%]")
+    for label, key in (("Message", "message_length"), ("Thinking", "thinking_length")):
+        for name, interval in report[key].items():
+            print(f"  {label} length {name}: {interval['estimate']:.0f} chars "
+                  f"[{interval['low']:.0f} - {interval['high']:.0f}]")
+    if report["stopped_early"]:
+        print(f"  ⏹️  Stopped sampling at the error limit")
+    
+    if report["error_types"]:
+        print(f"\n⚠️  Error types in the sample:")
+        for kind, count in report["error_types"].items():
+            print(f"    - {kind}: {count}")
+        for error in report["errors"][:5]:
+            print(f"  - {error}")
+    
+    print("\n" + "=" * 60)
+    if report["go"]:
+        print(f"🎉 GO: error rate below {report['max_error_rate']*100:g}% at {confidence} confidence")
+        print(f"   Run the full scan for final gating.")
+    else:
+        print(f"⚠️  NO-GO: error rate may exceed {report['max_error_rate']*100:g}% (or no <think> tags)")
+        print(f"   Fix the errors before training.")
+
+def wilson_interval(successes: int, n: int, z: float) -> Tuple[float, float]:
+    """Wilson score interval of a binomial proportion."""
+    if not n:
+        return 0.0, 1.0
+    p = successes / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+def percentile_intervals(stats: StreamingStats, z: float) -> Dict:
+    """p50/p90/p99 with order-statistic confidence bounds."""
+    if not stats.count:
+        return {}
+    intervals = {}
+    for q in (0.5, 0.9, 0.99):
+        # Rank bounds of the q-quantile, normal approximation to the binomial
+        spread = z * math.sqrt(q * (1 - q) / stats.count)
+        intervals[f"p{q*100:g}"] = {
+            "estimate": stats.percentile(q),
+            "low": stats.percentile(max(q - spread, 0.0)),
+            "high": stats.percentile(min(q + spread, 1.0)),
+        }
+    return intervals
+
+def length_report(stats: StreamingStats) -> Dict:
+    """Count, mean, max and p50/p90/p99 of a length distribution."""
+    if not stats.count:
+        return {"count": 0}
+    return {
+        "count": stats.count,
+        "mean": stats.mean(),
+        "max": stats.max,
+        "p50": stats.percentile(0.5),
+        "p90": stats.percentile(0.9),
+        "p99": stats.percentile(0.99),
+    }
+
+def format_percentiles(stats: StreamingStats) -> str:
+    return " / ".join(f"{stats.percentile(q):.0f}" for q in (0.5, 0.9, 0.99))
+
+def stats_to_dict(stats: Dict) -> Dict:
+    """JSON-serialisable copy of a validator's stats."""
+    return {key: value.to_dict() if hasattr(value, "to_dict") else value for key, value in stats.items()}
+
+def stats_from_dict(data: Dict) -> Dict:
+    """Inverse of `stats_to_dict`."""
+    stats = DatasetValidator.new_stats()
+    for key, template in stats.items():
+        if hasattr(template, "from_dict"):
+            stats[key] = type(template).from_dict(data[key])
+        elif isinstance(template, Counter):
+            stats[key] = Counter(data[key])
+        else:
+            stats[key] = data[key]
+    return stats
+
+def chunk_index_path(dataset_path: Path) -> Path:
+    """Chunk index sidecar of a dataset: `<name>.chunks.json`."""
+    return Path(str(dataset_path) + CHUNK_INDEX_SUFFIX)
+
+def content_chunks(path: Path) -> List[Dict]:
+    """Split a file into line-aligned chunks cut where the content says so.
+    
+    A chunk ends at the first line past CHUNK_MIN_BYTES whose CRC32 hits the
+    anchor mask (or at CHUNK_MAX_BYTES). Boundaries depend only on nearby
+    lines, so inserting or deleting lines changes the digests of the chunks
+    around the edit instead of shifting every chunk after it.
+    """
+    chunks = []
+    start = pos = lines = 0
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for line in f:
+            digest.update(line)
+            pos += len(line)
+            lines += 1
+            size = pos - start
+            if size >= CHUNK_MAX_BYTES or (size >= CHUNK_MIN_BYTES and not zlib.crc32(line) & CHUNK_ANCHOR_MASK):
+                chunks.append({"start": start, "end": pos, "lines": lines, "digest": digest.hexdigest()})
+                start = pos
+                lines = 0
+                digest = hashlib.blake2b(digest_size=16)
+    if pos > start:
+        chunks.append({"start": start, "end": pos, "lines": lines, "digest": digest.hexdigest()})
+    return chunks
+
+def chunk_boundaries(path: Path, num_chunks: int) -> List[int]:
+    """Split a file into roughly equal byte ranges that start on line boundaries."""
+    size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, num_chunks):
+            f.seek(max(size * i // num_chunks - 1, 0))
+            f.readline()
+            pos = f.tell()
+            if boundaries[-1] < pos < size:
+                boundaries.append(pos)
+    boundaries.append(size)
+    return boundaries
+
+def _validate_chunk(path: str, start: int, end: int, first_line: int,
+                    max_errors: Optional[int] = None) -> Tuple[Dict, int]:
+    """Process pool entry point: validate one chunk and return its stats and line count."""
+    validator = DatasetValidator(path, max_errors)
+    next_line = validator.validate_range(start, end, first_line, show_progress=False)
+    return validator.stats, next_line - first_line
+
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python validate_dataset.py <path_to_dataset.jsonl>")
+    parser = argparse.ArgumentParser(description="Validate a Qwen3 thinking dataset")
+    parser.add_argument("dataset_path", help="Path to the dataset .jsonl file (.jsonl.gz / .jsonl.zst are read directly)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Validate newline-aligned chunks in N processes")
+    parser.add_argument("--json", metavar="PATH", default=None,
+                        help="Also write the report as JSON to PATH ('-' for stdout, the text report then goes to stderr)")
+    parser.add_argument("--max-errors", type=int, default=None,
+                        help="Stop reading once this many errors were found")
+    parser.add_argument("--fail-fast", action="store_true",
+                        help="Stop at the first error (same as --max-errors 1)")
+    parser.add_argument("--sample", type=int, default=None, metavar="N",
+                        help="Validate N lines at random offsets and report estimates instead of a full scan")
+    parser.add_argument("--confidence", type=float, default=0.95,
+                        help="Confidence level of the --sample intervals")
+    parser.add_argument("--max-error-rate", type=float, default=0.01,
+                        help="--sample says go when the error rate's upper bound is at most this")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Seed for the --sample offsets")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Reuse cached stats of unchanged chunks and only re-parse edited ones")
+    parser.add_argument("--chunk-index", type=str, default=None,
+                        help="Chunk index for --incremental (default: <dataset>.chunks.json)")
+    parser.add_argument("--metadata", action="store_true",
+                        help="Also write the per-entry metadata index (<dataset>.meta.npy, see dataset_meta.py)")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.setup(args)
+    
+    sampling = args.sample is not None
+    if sampling and args.sample < 1:
+        print(f"❌ --sample must be a positive number of lines, got {args.sample}")
         sys.exit(1)
+    if (sampling or args.incremental) and dataset_io.is_compressed(args.dataset_path):
+        print("❌ --sample and --incremental need random access, run them on an uncompressed file")
+        sys.exit(1)
+    if args.incremental and (sampling or args.max_errors or args.fail_fast):
+        print("❌ --incremental always covers the whole file, drop --sample/--max-errors/--fail-fast")
+        sys.exit(1)
+    if args.metadata and (sampling or dataset_io.is_compressed(args.dataset_path)):
+        print("❌ --metadata indexes every line by byte offset, run it without --sample on an uncompressed file")
+        sys.exit(1)
+    
+    validator = DatasetValidator(args.dataset_path, max_errors=1 if args.fail_fast else args.max_errors)
+    text_output = sys.stderr if args.json == "-" else sys.stdout
+    with contextlib.redirect_stdout(text_output):
+        if sampling:
+            if not validator.dataset_path.exists():
+                print(f"❌ Dataset file not found: {validator.dataset_path}")
+                sys.exit(1)
+            print(f"🎲 Sampling {args.sample} lines from: {validator.dataset_path}")
+            start = time.perf_counter()
+            validator.validate_sample(args.sample, args.seed)
+            print(f"⏱️  Sampled in {time.perf_counter() - start:.2f}s")
+            report = validator.sample_report(args.confidence, args.max_error_rate, args.seed)
+            print_sample_report(report)
+            passed = report["go"]
+        else:
+            if args.incremental and validator.dataset_path.exists():
+                index_path = Path(args.chunk_index) if args.chunk_index else None
+                validator.validate_incremental(workers=args.workers, index_path=index_path)
+            else:
+                validator.validate_dataset(workers=args.workers)
+            validator.print_report()
+            report = validator.report()
+            passed = validator.passed()
+            if args.metadata and validator.dataset_path.exists():
+                # Imported here, dataset_meta itself builds on this module
+                from dataset_meta import build_metadata, save_metadata
+                meta, info = build_metadata(validator.dataset_path, args.workers)
+                print(f"🗂️  Saved metadata index of {info['entries']} entries to: "
+                      f"{save_metadata(validator.dataset_path, meta, info)}")
+    
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Saved JSON report to: {args.json}")
     
-    dataset_path = sys.argv[1]
-    validator = DatasetValidator(dataset_path)
-    validator.validate_dataset()
-    validator.print_report()
+    # Non-zero unless the dataset is ready for training, so scripts can gate on $?
+    sys.exit(0 if passed else 1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file